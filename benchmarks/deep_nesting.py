@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""Measures flatit and unflatit of deeply nested documents with the
+recursive and the iterative engine.
+
+The document is a chain of tree nodes, every node has one child. The
+recursive engine fails at depths beyond the recursion limit.
+
+usage: python benchmarks/deep_nesting.py [runs]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import flatty
+
+DEPTHS = [10, 100, 1000, 10000]
+
+class Node(flatty.Schema):
+	name = unicode
+	weight = int
+Node.children = flatty.TypedList.set_type(Node)
+
+def chain(depth):
+	root = node = Node(name=u'0', weight=0, children=[])
+	for i in range(1, depth):
+		child = Node(name=unicode(i), weight=i, children=[])
+		node.children.append(child)
+		node = child
+	return root
+
+def measure(func, depth, runs):
+	try:
+		func()
+	except RuntimeError:
+		return None
+	#about 10000 nodes per run
+	number = max(1, 10000 / depth)
+	return min(timeit.repeat(func, number=number, repeat=runs)) / number
+
+def main():
+	runs = 5
+	if len(sys.argv) > 1:
+		runs = int(sys.argv[1])
+	print 'recursion limit %d' % sys.getrecursionlimit()
+	print '%-6s %-10s %12s %12s %12s' % ('depth', 'engine', 'flatit ms',
+										'unflatit ms', 'us/level')
+	for depth in DEPTHS:
+		root = chain(depth)
+		flat = flatty.flatit(root, iterative=True)
+		for engine, iterative in (('recursive', False), ('iterative', True)):
+			to_flat = measure(lambda: flatty.flatit(root, iterative=iterative), depth, runs)
+			to_obj = measure(lambda: flatty.unflatit(Node, flat, iterative=iterative), depth, runs)
+			if to_flat == None or to_obj == None:
+				print '%-6d %-10s %12s %12s %12s' % (depth, engine, '-', '-',
+												'recursion limit')
+				continue
+			print '%-6d %-10s %12.3f %12.3f %12.2f' % (depth, engine,
+						to_flat * 1000, to_obj * 1000,
+						(to_flat + to_obj) * 1000000 / depth)
+
+if __name__ == '__main__':
+	main()
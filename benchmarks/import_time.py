@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""Measures the time of ``import flatty`` in fresh interpreters.
+
+Variants:
+	core      only ``import flatty``
+	backends  ``import flatty`` and using all adapters
+	missing   like backends, but bson, pymongo and couchdb are not installed
+
+usage: python benchmarks/import_time.py [runs]
+"""
+import os
+import sys
+import subprocess
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+SETUP_MISSING = """
+for name in ('bson', 'bson.objectid', 'pymongo', 'couchdb'):
+	sys.modules[name] = None
+"""
+
+USE_BACKENDS = """
+for name in ('binary', 'index', 'store', 'mongo', 'couch', 'sqlite'):
+	try:
+		getattr(flatty, name).__file__
+	except ImportError:
+		pass
+"""
+
+VARIANTS = [
+	('core', '', ''),
+	('backends', '', USE_BACKENDS),
+	('missing', SETUP_MISSING, USE_BACKENDS),
+]
+
+TEMPLATE = """
+import sys
+import time
+%s
+start = time.time()
+import flatty
+%s
+sys.stdout.write(repr(time.time() - start))
+"""
+
+def measure(setup, code, runs):
+	script = TEMPLATE % (setup, code)
+	env = dict(os.environ, PYTHONPATH=SRC, PYTHONDONTWRITEBYTECODE='')
+	times = []
+	for i in range(runs):
+		output = subprocess.check_output([sys.executable, '-c', script], env=env)
+		times.append(float(output))
+	return min(times), sum(times) / len(times)
+
+def main():
+	runs = 20
+	if len(sys.argv) > 1:
+		runs = int(sys.argv[1])
+	print '%-10s %10s %10s' % ('variant', 'min ms', 'mean ms')
+	for name, setup, code in VARIANTS:
+		best, mean = measure(setup, code, runs)
+		print '%-10s %10.2f %10.2f' % (name, best * 1000, mean * 1000)
+
+if __name__ == '__main__':
+	main()
@@ -8,11 +8,57 @@ __docformat__ = "restructuredtext"
 
 
 from flatty import *
-try:
-    import mongo
-except ImportError:
-    pass
-try:
-    import couch
-except ImportError:
-    pass
+
+
+class _LazyModule(object):
+    """Placeholder for a submodule which is imported on first attribute
+    access. Importing the adapters (and e.g. bson for flatty.mongo) only when
+    they are used keeps ``import flatty`` fast. If the dependencies of an
+    adapter are missing, the ImportError is raised on first access."""
+
+    def __init__(self, name):
+        self.__name__ = __name__ + '.' + name
+
+    def __getattr__(self, attr):
+        module = __import__(self.__name__, fromlist=['__name__'])
+        # the import replaced this placeholder in the package namespace
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return "<lazy module '%s'>" % self.__name__
+
+
+binary = _LazyModule('binary')
+index = _LazyModule('index')
+store = _LazyModule('store')
+mongo = _LazyModule('mongo')
+couch = _LazyModule('couch')
+sqlite = _LazyModule('sqlite')
+changes = _LazyModule('changes')
+stream = _LazyModule('stream')
+
+# patch() takes an argument named changes
+_changes = changes
+
+
+def diff(old, new, **kwargs):
+    """returns the changes between `old` and `new`, see
+    :func:`flatty.changes.diff`"""
+    return _changes.diff(old, new, **kwargs)
+
+
+def patch(obj, changes, **kwargs):
+    """applies `changes` to `obj`, see :func:`flatty.changes.patch`"""
+    return _changes.patch(obj, changes, **kwargs)
+
+
+def iter_flat(obj, **kwargs):
+    """yields the JSON text of the flat form of `obj` in chunks, see
+    :func:`flatty.stream.iter_flat`"""
+    return stream.iter_flat(obj, **kwargs)
+
+
+def iter_unflat_items(cls, fileobj, path, **kwargs):
+    """yields the unflattened items of the list at `path` in the JSON
+    document in `fileobj`, see :func:`flatty.stream.iter_unflat_items`"""
+    return stream.iter_unflat_items(cls, fileobj, path, **kwargs)
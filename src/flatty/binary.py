@@ -0,0 +1,362 @@
+"""
+This module provides a compact binary encoding for flatty schemas.
+Field names are not stored, every schema attribute is written as its
+index in the schema definition. Integers are stored as varints and
+date, datetime and time objects in a native binary form. The values of
+:class:`flatty.TypedArray` and binary attributes are stored as raw bytes.
+
+	>>> import flatty
+	>>> import datetime
+	>>>
+	>>> class Bar(flatty.Schema):
+	...	 a_num = int
+	...	 a_day = datetime.date
+	...
+	>>> data = flatty.binary.dumps(Bar(a_num=42, a_day=datetime.date(2011, 7, 15)))
+	>>> len(data)
+	19
+	>>> bar = flatty.binary.loads(Bar, data)
+	>>> bar.a_num, bar.a_day
+	(42, datetime.date(2011, 7, 15))
+
+The data can only be loaded with the same schema definition it was
+dumped with. The :func:`flatty.fingerprint` of the schema is stored in
+the header, :func:`loads` raises :class:`flatty.SchemaVersionError` for
+data of another version of the schema.
+
+=========
+Functions
+=========
+"""
+import binascii
+import datetime
+import struct
+import flatty
+
+#the format of schema data, a header with the schema fingerprint since 2
+VERSION = 2
+
+#the format of plain data
+PLAIN_VERSION = 1
+
+_NONE = 0
+_FALSE = 1
+_TRUE = 2
+_INT = 3
+_FLOAT = 4
+_STR = 5
+_UNICODE = 6
+_LIST = 7
+_DICT = 8
+_DATE = 9
+_DATETIME = 10
+_TIME = 11
+_RECORD = 12
+
+_double = struct.Struct('>d')
+
+class DecodeError(ValueError):
+	"""
+	Raised if the binary data is corrupt or doesn't match the schema
+
+	"""
+	pass
+
+def dumps(obj, obj_type=None):
+	"""encodes `obj` to the compact binary form
+
+		Args:
+			obj: a :class:`flatty.Schema` instance
+
+			obj_type: the type of `obj`, by default the class of `obj`
+
+		Returns:
+			a string with the encoded data"""
+	if obj_type == None:
+		obj_type = type(obj)
+	out = [chr(VERSION), _fingerprint(obj_type)]
+	_encode(out, obj_type, obj)
+	return ''.join(out)
+
+def loads(cls, data):
+	"""decodes the `data` back in an instance of `cls`
+
+		Args:
+			cls: the class of the encoded object
+
+			data: a string (or buffer) returned by :func:`dumps`
+
+		Returns:
+			an instance of type `cls`
+
+		Raises:
+			SchemaVersionError: if `data` was dumped with another version
+				of the schema
+
+			DecodeError: if `data` is corrupt"""
+	if len(data) == 0 or ord(data[0]) != VERSION:
+		raise DecodeError('Unsupported binary format version')
+	fp = _fingerprint(cls)
+	if data[1:1 + len(fp)] != fp:
+		raise flatty.SchemaVersionError('Data was dumped with another version '
+										'of %s' % repr(cls))
+	try:
+		obj, pos = _decode(cls, data, 1 + len(fp))
+	except (IndexError, struct.error):
+		raise DecodeError('Truncated data')
+	if pos != len(data):
+		raise DecodeError('Trailing data after position %d' % pos)
+	return obj
+
+def _fingerprint(cls):
+	#the 8 bytes of the hex fingerprint
+	return binascii.unhexlify(flatty.fingerprint(cls))
+
+def dumps_plain(obj):
+	"""encodes a plain python object without schema, supported are None,
+	bool, int, long, float, str, unicode, list, tuple, dict, date, datetime
+	and time
+
+		Returns:
+			a string with the encoded data"""
+	out = [chr(PLAIN_VERSION)]
+	_encode_plain(out, obj)
+	return ''.join(out)
+
+def loads_plain(data):
+	"""decodes data returned by :func:`dumps_plain`, tuples are decoded as
+	lists
+
+		Returns:
+			the object"""
+	if len(data) == 0 or ord(data[0]) != PLAIN_VERSION:
+		raise DecodeError('Unsupported binary format version')
+	try:
+		obj, pos = _decode_plain(data, 1)
+	except (IndexError, struct.error):
+		raise DecodeError('Truncated data')
+	if pos != len(data):
+		raise DecodeError('Trailing data after position %d' % pos)
+	return obj
+
+def _write_varint(out, num):
+	while num > 0x7f:
+		out.append(chr((num & 0x7f) | 0x80))
+		num >>= 7
+	out.append(chr(num))
+
+def _read_varint(data, pos):
+	num = 0
+	shift = 0
+	while True:
+		byte = ord(data[pos])
+		pos += 1
+		num |= (byte & 0x7f) << shift
+		if byte < 0x80:
+			return num, pos
+		shift += 7
+
+def _encode(out, val_type, obj):
+	if obj is None:
+		out.append(chr(_NONE))
+		return
+	conv = flatty.ConvertManager.get_converter(val_type)
+	if conv == None:
+		_encode_plain(out, obj)
+	elif issubclass(conv, flatty.SchemaConverter):
+		out.append(chr(_RECORD))
+		for index, (attr_name, attr_type, default) in enumerate(val_type.__fields__.values()):
+			attr_value = getattr(obj, attr_name)
+			if attr_value is None or attr_value is attr_type:
+				#not set, restored as None
+				continue
+			flatty.check_type(attr_type, attr_value)
+			_write_varint(out, index + 1)
+			_encode(out, attr_type, attr_value)
+		out.append(chr(0))
+	elif issubclass(conv, flatty.TypedListConverter):
+		flatty.check_type(val_type, obj)
+		out.append(chr(_LIST))
+		_write_varint(out, len(obj))
+		for item in obj:
+			flatty.check_type(val_type.ftype, item)
+			_encode(out, val_type.ftype, item)
+	elif issubclass(conv, flatty.TypedDictConverter):
+		flatty.check_type(val_type, obj)
+		out.append(chr(_DICT))
+		_write_varint(out, len(obj))
+		for k, v in obj.items():
+			flatty.check_type(val_type.ftype, v)
+			_encode_plain(out, k)
+			_encode(out, val_type.ftype, v)
+	elif conv in (flatty.DateConverter, flatty.DateTimeConverter,
+				flatty.TimeConverter):
+		_encode_plain(out, obj)
+	elif issubclass(conv, (flatty.TypedArrayConverter, flatty.BinaryConverter)):
+		flatty.check_type(val_type, obj)
+		_encode_plain(out, conv.to_bytes(val_type, obj))
+	else:
+		_encode_plain(out, conv.to_flat(val_type, obj))
+
+def _encode_plain(out, obj):
+	if obj is None:
+		out.append(chr(_NONE))
+	elif obj is True:
+		out.append(chr(_TRUE))
+	elif obj is False:
+		out.append(chr(_FALSE))
+	elif isinstance(obj, (int, long)):
+		out.append(chr(_INT))
+		#zigzag encoding to keep small negative numbers small
+		if obj >= 0:
+			_write_varint(out, obj << 1)
+		else:
+			_write_varint(out, ((-obj) << 1) - 1)
+	elif isinstance(obj, float):
+		out.append(chr(_FLOAT))
+		out.append(_double.pack(obj))
+	elif isinstance(obj, str):
+		out.append(chr(_STR))
+		_write_varint(out, len(obj))
+		out.append(obj)
+	elif isinstance(obj, unicode):
+		obj = obj.encode('utf-8')
+		out.append(chr(_UNICODE))
+		_write_varint(out, len(obj))
+		out.append(obj)
+	elif isinstance(obj, (list, tuple)):
+		out.append(chr(_LIST))
+		_write_varint(out, len(obj))
+		for item in obj:
+			_encode_plain(out, item)
+	elif isinstance(obj, dict):
+		out.append(chr(_DICT))
+		_write_varint(out, len(obj))
+		for k, v in obj.items():
+			_encode_plain(out, k)
+			_encode_plain(out, v)
+	elif isinstance(obj, datetime.datetime):
+		out.append(chr(_DATETIME))
+		_write_varint(out, obj.toordinal())
+		_write_varint(out, _time_micros(obj))
+	elif isinstance(obj, datetime.date):
+		out.append(chr(_DATE))
+		_write_varint(out, obj.toordinal())
+	elif isinstance(obj, datetime.time):
+		out.append(chr(_TIME))
+		_write_varint(out, _time_micros(obj))
+	else:
+		raise TypeError('Can not encode ' + repr(type(obj)))
+
+def _time_micros(obj):
+	return ((obj.hour * 60 + obj.minute) * 60 + obj.second) * 1000000 \
+			+ obj.microsecond
+
+def _micros_time(micros):
+	seconds, microsecond = divmod(micros, 1000000)
+	minutes, second = divmod(seconds, 60)
+	hour, minute = divmod(minutes, 60)
+	return datetime.time(hour, minute, second, microsecond)
+
+def _decode(val_type, data, pos):
+	tag = ord(data[pos])
+	if tag == _NONE:
+		return None, pos + 1
+	conv = flatty.ConvertManager.get_converter(val_type)
+	if conv == None:
+		return _decode_plain(data, pos)
+	elif issubclass(conv, flatty.SchemaConverter):
+		if tag != _RECORD:
+			raise DecodeError('Record expected at position %d' % pos)
+		pos += 1
+		fields = val_type.__fields__.values()
+		obj = val_type()
+		for attr_name, attr_type, default in fields:
+			setattr(obj, attr_name, None)
+		while True:
+			index, pos = _read_varint(data, pos)
+			if index == 0:
+				return obj, pos
+			if index > len(fields):
+				raise DecodeError('Unknown field index %d' % index)
+			attr_name, attr_type, default = fields[index - 1]
+			value, pos = _decode(attr_type, data, pos)
+			flatty.check_type(attr_type, value)
+			setattr(obj, attr_name, value)
+	elif issubclass(conv, flatty.TypedListConverter):
+		if tag != _LIST:
+			raise DecodeError('List expected at position %d' % pos)
+		num, pos = _read_varint(data, pos + 1)
+		obj = val_type()
+		for i in xrange(num):
+			item, pos = _decode(val_type.ftype, data, pos)
+			obj.append(item)
+		return obj, pos
+	elif issubclass(conv, flatty.TypedDictConverter):
+		if tag != _DICT:
+			raise DecodeError('Dict expected at position %d' % pos)
+		num, pos = _read_varint(data, pos + 1)
+		obj = val_type()
+		for i in xrange(num):
+			k, pos = _decode_plain(data, pos)
+			obj[k], pos = _decode(val_type.ftype, data, pos)
+		return obj, pos
+	elif conv in (flatty.DateConverter, flatty.DateTimeConverter,
+				flatty.TimeConverter):
+		return _decode_plain(data, pos)
+	elif issubclass(conv, (flatty.TypedArrayConverter, flatty.BinaryConverter)):
+		raw, pos = _decode_plain(data, pos)
+		return conv.from_bytes(val_type, raw), pos
+	else:
+		flat, pos = _decode_plain(data, pos)
+		return conv.to_obj(val_type, flat), pos
+
+def _decode_plain(data, pos):
+	tag = ord(data[pos])
+	pos += 1
+	if tag == _NONE:
+		return None, pos
+	elif tag == _TRUE:
+		return True, pos
+	elif tag == _FALSE:
+		return False, pos
+	elif tag == _INT:
+		num, pos = _read_varint(data, pos)
+		if num & 1:
+			return -((num + 1) >> 1), pos
+		return num >> 1, pos
+	elif tag == _FLOAT:
+		return _double.unpack_from(data, pos)[0], pos + 8
+	elif tag == _STR:
+		length, pos = _read_varint(data, pos)
+		return data[pos:pos + length], pos + length
+	elif tag == _UNICODE:
+		length, pos = _read_varint(data, pos)
+		return data[pos:pos + length].decode('utf-8'), pos + length
+	elif tag == _LIST:
+		num, pos = _read_varint(data, pos)
+		obj = []
+		for i in xrange(num):
+			item, pos = _decode_plain(data, pos)
+			obj.append(item)
+		return obj, pos
+	elif tag == _DICT:
+		num, pos = _read_varint(data, pos)
+		obj = {}
+		for i in xrange(num):
+			k, pos = _decode_plain(data, pos)
+			obj[k], pos = _decode_plain(data, pos)
+		return obj, pos
+	elif tag == _DATETIME:
+		ordinal, pos = _read_varint(data, pos)
+		micros, pos = _read_varint(data, pos)
+		return datetime.datetime.combine(datetime.date.fromordinal(ordinal),
+										_micros_time(micros)), pos
+	elif tag == _DATE:
+		ordinal, pos = _read_varint(data, pos)
+		return datetime.date.fromordinal(ordinal), pos
+	elif tag == _TIME:
+		micros, pos = _read_varint(data, pos)
+		return _micros_time(micros), pos
+	else:
+		raise DecodeError('Unknown tag %d at position %d' % (tag, pos - 1))
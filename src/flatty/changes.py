@@ -0,0 +1,363 @@
+"""
+This module computes the changes between two versions of a schema object
+or of its flat form. A change set is a list of changes, every change is a
+dict with the operation `op`, the dotted `path` of the changed attribute
+and for ``'set'`` the new flat `value`. List items are addressed by their
+index, items of dicts by their key.
+
+	>>> import flatty
+	>>>
+	>>> class Address(flatty.Schema):
+	...	 city = str
+	...	 street = str
+	...
+	>>> class Person(flatty.Schema):
+	...	 name = str
+	...	 address = Address
+	...	 tags = flatty.TypedList.set_type(str)
+	...
+	>>> old = Person(name='John', address=Address(city='Graz', street='Hauptplatz'),
+	...			  tags=['a'])
+	>>> new = Person(name='John', address=Address(city='Wien', street='Hauptplatz'),
+	...			  tags=['a', 'b'])
+	>>> flatty.diff(old, new)
+	[{'path': 'address.city', 'value': 'Wien', 'op': 'set'}, {'path': 'tags.1', 'value': 'b', 'op': 'set'}]
+
+Unchanged objects are skipped without looking at their content if old and
+new share them. If the caller knows which attributes were changed, the
+`paths` argument restricts the comparison to them.
+
+Change sets (or MongoDB update documents) are applied to objects with
+:func:`patch`, only the values of the changed attributes are converted.
+
+	>>> flatty.patch(old, [{'op':'set', 'path':'address.city', 'value':'Wien'}]).address.city
+	'Wien'
+	>>> flatty.changes.to_update(flatty.diff(old, new))
+	{'$set': {'tags.1': 'b'}}
+
+=========
+Functions
+=========
+"""
+import flatty
+
+def diff(old, new, obj_type=None, keys=None, paths=None):
+	"""returns the changes which turn `old` into `new`
+
+		Args:
+			old: a :class:`flatty.Schema` instance or a flat dict
+
+			new: an object of the same type as `old`
+
+			obj_type: the schema class of `old` and `new`, by default the
+				class of `new`. Flat dicts are compared without schema.
+
+			keys: a dict mapping the dotted paths of lists to the attribute
+				(or for flat dicts the key) which identifies their items,
+				e.g. ``{'comments':'id'}``. Such lists are compared by the
+				keys of their items and the items are addressed by their key
+				in the change paths, the order of the items is not compared.
+				Other lists are compared item by item. (default=None)
+
+			paths: list of dotted paths of the attributes which may have
+				changed, see the `include` argument of :func:`flatty.flatit`.
+				Other attributes are not compared. (default=None, everything
+				is compared)
+
+		Returns:
+			a list of changes. Each change is a dict with the keys ``'op'``
+			(``'set'`` or ``'unset'``), ``'path'`` and for ``'set'`` the
+			flat ``'value'``.
+
+		Raises:
+			TypeError: if `old` and `new` are not of the same type"""
+	if obj_type == None and isinstance(new, flatty.Schema):
+		obj_type = type(new)
+	if obj_type != None:
+		if type(old) != type(new) or not isinstance(new, obj_type):
+			raise TypeError('Instances of %s expected' % repr(obj_type))
+	elif not isinstance(old, dict) or not isinstance(new, dict):
+		raise TypeError('Schema instances or flat dicts expected')
+
+	changes = []
+	_diff(changes, '', '', obj_type, old, new, keys or {},
+		flatty._compile_paths(paths))
+	return changes
+
+def patch(obj, changes, keys=None):
+	"""applies `changes` to the schema object `obj`. The flat values are
+	converted and type checked with the types of the schema, other
+	attributes are not touched.
+
+		Args:
+			obj: a :class:`flatty.Schema` instance, it is changed in place
+
+			changes: a list of changes as returned by :func:`diff` or a
+				MongoDB update document with ``'$set'`` and ``'$unset'``
+
+			keys: the `keys` the changes were computed with, see
+				:func:`diff` (default=None)
+
+		Returns:
+			`obj`
+
+		Raises:
+			AttributeError: if a path names an attribute which is not in
+				the schema
+
+			IndexError, KeyError: if a path names a list item or dict key
+				which doesn't exist
+
+			TypeError: if a path goes through a list or another value
+				which is None"""
+	if isinstance(changes, dict):
+		changes = _from_update(changes)
+	keys = keys or {}
+	for change in changes:
+		op = change['op']
+		if op not in ('set', 'unset'):
+			raise ValueError('Unknown operation ' + repr(op))
+		if change['path'] == '':
+			raise ValueError('Empty path')
+		names = change['path'].split('.')
+		container, container_type = obj, type(obj)
+		key_path = ''
+		for i, name in enumerate(names[:-1]):
+			container, container_type, key_path = _child(container,
+											container_type, key_path, name, keys)
+			if container is None:
+				raise TypeError('Can not patch %s, %s is None' % \
+								(change['path'], '.'.join(names[:i + 1])))
+		_apply(container, container_type, key_path, names[-1], keys,
+			op, change.get('value'))
+	return obj
+
+def to_update(changes):
+	"""returns the MongoDB update document with ``'$set'`` and
+	``'$unset'`` for a list of changes. Changes of lists compared by keys
+	can't be expressed in an update document."""
+	update = {}
+	for change in changes:
+		if change['op'] == 'set':
+			update.setdefault('$set', {})[change['path']] = change['value']
+		else:
+			update.setdefault('$unset', {})[change['path']] = ''
+	return update
+
+def _from_update(update):
+	for op in update:
+		if op not in ('$set', '$unset'):
+			raise ValueError('Unsupported update operator ' + op)
+	changes = []
+	for path, value in update.get('$set', {}).items():
+		changes.append({'op':'set', 'path':path, 'value':value})
+	for path in update.get('$unset', {}):
+		changes.append({'op':'unset', 'path':path})
+	return changes
+
+def _child(container, container_type, key_path, name, keys):
+	"""returns the value of `name` in `container` with its type and key
+	path, missing schema objects and dicts are created"""
+	kind = flatty._kind(container_type)
+	if kind == flatty._SCHEMA:
+		attr_type = _field_type(container_type, name)
+		value = _value(container, name, attr_type)
+		if value == None and flatty._kind(attr_type) in (flatty._SCHEMA, flatty._DICT):
+			value = attr_type()
+			setattr(container, name, value)
+		return value, attr_type, flatty._join_path(key_path, name)
+	elif kind == flatty._LIST:
+		return container[_list_index(container, key_path, name, keys)], \
+				container_type.ftype, key_path
+	elif kind == flatty._DICT:
+		value = container.get(name)
+		if value == None and flatty._kind(container_type.ftype) in \
+			(flatty._SCHEMA, flatty._DICT):
+			value = container[name] = container_type.ftype()
+		return value, container_type.ftype, key_path
+	raise TypeError('Can not patch into %s' % repr(container_type))
+
+def _apply(container, container_type, key_path, name, keys, op, value):
+	kind = flatty._kind(container_type)
+	if kind == flatty._SCHEMA:
+		attr_type = _field_type(container_type, name)
+		if op == 'set':
+			setattr(container, name, _convert(attr_type, value))
+		elif name in container.__dict__:
+			#back to the default of the class
+			delattr(container, name)
+	elif kind == flatty._LIST:
+		if op == 'set':
+			value = _convert(container_type.ftype, value)
+			if key_path in keys:
+				key = keys[key_path]
+				for i, item in enumerate(container):
+					if _item_key(item, key) == name:
+						container[i] = value
+						break
+				else:
+					container.append(value)
+			elif int(name) == len(container):
+				container.append(value)
+			else:
+				container[_list_index(container, key_path, name, keys)] = value
+		elif key_path in keys:
+			del container[_list_index(container, key_path, name, keys)]
+		else:
+			#like MongoDB, unset list items become None
+			container[_list_index(container, key_path, name, keys)] = None
+	elif kind == flatty._DICT:
+		if op == 'set':
+			container[name] = _convert(container_type.ftype, value)
+		else:
+			del container[name]
+	else:
+		raise TypeError('Can not patch into %s' % repr(container_type))
+
+def _field_type(schema_cls, name):
+	if name not in schema_cls.__fields__:
+		raise AttributeError('%s has no attribute %s' % (repr(schema_cls), name))
+	return schema_cls.__fields__[name].type
+
+def _list_index(items, key_path, name, keys):
+	if key_path in keys:
+		key = keys[key_path]
+		for i, item in enumerate(items):
+			if _item_key(item, key) == name:
+				return i
+		raise KeyError(name)
+	index = int(name)
+	if index < 0 or index >= len(items):
+		raise IndexError('List index out of range: ' + name)
+	return index
+
+def _convert(val_type, value):
+	value = flatty.unflatit(val_type, value)
+	flatty.check_type(val_type, value)
+	return value
+
+def _set(changes, path, val_type, value):
+	if val_type != None and value is not None:
+		value = flatty.flatit(value, val_type)
+	changes.append({'op':'set', 'path':path, 'value':value})
+
+def _unset(changes, path):
+	changes.append({'op':'unset', 'path':path})
+
+def _diff(changes, path, key_path, val_type, old, new, keys, paths):
+	"""compares `old` and `new` and appends the changes below `path`.
+	`key_path` is the path without list indexes and dict keys, it selects
+	the entry in `keys`."""
+	if old is new:
+		return
+	if old is None or new is None:
+		_set(changes, path, val_type, new)
+		return
+
+	conv = None
+	if val_type != None:
+		conv = flatty.ConvertManager.get_converter(val_type)
+	if conv != None and issubclass(conv, flatty.SchemaConverter):
+		if type(old) != type(new):
+			_set(changes, path, val_type, new)
+			return
+		for attr_name, attr_type, default in val_type.__fields__.values():
+			child_paths = None
+			if paths != None:
+				projection = flatty._project(paths, None, attr_name)
+				if projection == None:
+					continue
+				child_paths = projection[0]
+			_diff(changes, flatty._join_path(path, attr_name),
+				flatty._join_path(key_path, attr_name), attr_type,
+				_value(old, attr_name, attr_type), _value(new, attr_name, attr_type),
+				keys, child_paths)
+	elif (conv == None and isinstance(old, dict) and isinstance(new, dict)) or \
+		(conv != None and issubclass(conv, flatty.TypedDictConverter)):
+		item_type = getattr(val_type, 'ftype', None)
+		for k, v in new.items():
+			if paths != None and val_type == None:
+				projection = flatty._project(paths, None, k)
+				if projection == None:
+					continue
+				child_paths = projection[0]
+			else:
+				child_paths = paths
+			if k not in old:
+				_set(changes, flatty._join_path(path, k), item_type, v)
+			else:
+				if val_type == None:
+					child_key_path = flatty._join_path(key_path, k)
+				else:
+					child_key_path = key_path
+				_diff(changes, flatty._join_path(path, k), child_key_path,
+					item_type, old[k], v, keys, child_paths)
+		for k in old:
+			if k not in new and (paths == None or val_type != None or k in paths):
+				_unset(changes, flatty._join_path(path, k))
+	elif (conv == None and isinstance(old, list) and isinstance(new, list)) or \
+		(conv != None and issubclass(conv, flatty.TypedListConverter)):
+		item_type = getattr(val_type, 'ftype', None)
+		if key_path in keys:
+			_diff_keyed(changes, path, key_path, item_type, old, new,
+						keys, paths)
+		else:
+			_diff_positional(changes, path, key_path, val_type, old, new,
+							keys, paths)
+	elif conv == None:
+		if type(old) != type(new) or old != new:
+			_set(changes, path, val_type, new)
+	else:
+		#compare the flat forms, e.g. == of numpy arrays is element-wise
+		flat = flatty.flatit(new, val_type)
+		if flatty.flatit(old, val_type) != flat:
+			changes.append({'op':'set', 'path':path, 'value':flat})
+
+def _diff_positional(changes, path, key_path, val_type, old, new, keys, paths):
+	if len(new) < len(old):
+		#removed items can't be addressed by set and unset
+		_set(changes, path, val_type, new)
+		return
+	item_type = getattr(val_type, 'ftype', None)
+	for i in xrange(len(old)):
+		_diff(changes, flatty._join_path(path, i), key_path, item_type,
+			old[i], new[i], keys, paths)
+	for i in xrange(len(old), len(new)):
+		_set(changes, flatty._join_path(path, i), item_type, new[i])
+
+def _diff_keyed(changes, path, key_path, item_type, old, new, keys, paths):
+	key = keys[key_path]
+	old_items = _index_items(old, key)
+	new_items = _index_items(new, key)
+	for item in new:
+		k = _item_key(item, key)
+		if k in old_items:
+			_diff(changes, flatty._join_path(path, k), key_path, item_type,
+				old_items[k], item, keys, paths)
+		else:
+			_set(changes, flatty._join_path(path, k), item_type, item)
+	for item in old:
+		k = _item_key(item, key)
+		if k not in new_items:
+			_unset(changes, flatty._join_path(path, k))
+
+def _index_items(items, key):
+	index = {}
+	for item in items:
+		k = _item_key(item, key)
+		if k in index:
+			raise ValueError('Duplicate key %s in list' % k)
+		index[k] = item
+	return index
+
+def _item_key(item, key):
+	if isinstance(item, dict):
+		return '%s' % item[key]
+	return '%s' % getattr(item, key)
+
+def _value(obj, attr_name, attr_type):
+	value = getattr(obj, attr_name)
+	if flatty._isclass(value) and value == attr_type:
+		#attribute is not set
+		return None
+	return value
@@ -1,35 +1,73 @@
 """
+Stores of documents can be queued and written in bulk with a
+:class:`WriteBehindSession`::
+
+	with flatty.couch.WriteBehindSession(db, max_docs=500):
+		for event in events:
+			counter.count += 1
+			counter.store(db)
 
 =======
 Classes
 =======
 """
+import uuid
 import flatty
 
 class Document(flatty.Schema):
 	"""
 	This class is the base Class for alls couchdb documents
+	
+	Attributes of type buffer, memoryview and bytearray are stored base64
+	encoded like inline attachments.
+	
+	If `__skip_unchanged__` is True, :meth:`store` doesn't write the
+	document if its flat form has the same :func:`flatty.content_hash` as
+	when it was loaded or stored last, no new revision is created then.
+	`__written__` tells if the last store wrote (or queued) the document.
 	"""
+	#couchdb reserves top-level keys starting with an underscore
+	__fingerprint_key__ = 'schema_fingerprint'
+	__skip_unchanged__ = False
+	__content_hash__ = None
+	__written__ = None
 	
 	_id = unicode
 	_rev = unicode
 	
 	def store(self, db):
 		"""stores the document in the couchdb 
+		
+		Within a :class:`WriteBehindSession` for `db` the document is only
+		queued, new documents get their id right away and the new `rev` is
+		set when the session writes the document.
 	
 		Args:
 			db: should must be a couchdb-python ''Database'' object
 			
 		Returns:
 			returns a tuple `id, rev`. `id`  is the document id which stays the
-			same over time. `rev` changes on every store.
+			same over time. `rev` changes on every store, it is None if the
+			document was queued.
 		"""
 		flattened =  self.flatit()
+		session = WriteBehindSession.current(db)
+		if session != None and self._id == unicode:
+			self._id = flattened['_id'] = unicode(uuid.uuid4().hex)
 		if self._id == unicode:
 			del flattened['_id']
 		if self._rev == unicode:
 			del flattened['_rev']
+		if flatty._skip_store(self, flattened, session, self._id):
+			self.__written__ = False
+			return self._id, self._rev
+		self.__written__ = True
+		if session != None:
+			session.queue(self._id, self, flattened)
+			return self._id, None
 		self._id, self._rev = db.save(flattened)
+		if self.__skip_unchanged__:
+			self.__content_hash__ = _written_hash(flattened, self._id, self._rev)
 		return self._id, self._rev
 	
 	@classmethod
@@ -44,6 +82,39 @@ class Document(flatty.Schema):
 		Returns:
 			returns the object
 		"""
-		return cls.unflatit(db[id])
+		doc = db[id]
+		obj = cls.unflatit(doc)
+		if cls.__skip_unchanged__:
+			obj.__content_hash__ = flatty.content_hash(doc)
+		return obj
 		
-	
\ No newline at end of file
+	
+
+class WriteBehindSession(flatty.WriteBehindSession):
+	"""
+	Queues the stores of :class:`Document` objects in `db` and writes them
+	with one bulk request, see :class:`flatty.WriteBehindSession` for the
+	arguments. Conflicts are reported per document with the exception
+	returned by couchdb-python, e.g. ``couchdb.ResourceConflict``.
+	
+	"""
+	def _write(self, entries):
+		results = self.db.update([flat for key, (flat, docs, state) in entries])
+		errors = []
+		for (key, (flat, docs, state)), (success, id, rev) in zip(entries, results):
+			for doc in docs:
+				if success:
+					doc._id, doc._rev = id, rev
+					if doc.__skip_unchanged__:
+						doc.__content_hash__ = _written_hash(flat, id, rev)
+				else:
+					#rev is the exception
+					errors.append((doc, rev))
+		return errors
+
+def _written_hash(flat, id, rev):
+	"""returns the content hash of the document `flat` as it was stored
+	with `id` and `rev`"""
+	flat = dict(flat)
+	flat['_id'], flat['_rev'] = id, rev
+	return flatty.content_hash(flat)
@@ -8,11 +8,27 @@ marshaller/unmarshaller. As an example look at the other modules eg. flatty.couc
 Classes
 =======
 """
-import inspect
 import datetime
+import re
 import types
+import threading
+import weakref
+import hashlib
+import sys
+import collections
+import array
+import base64
+from timeit import default_timer as _timer
 
 
+#equivalents of inspect.isclass and inspect.ismethod, importing the inspect
+#module would double the import time of flatty
+def _isclass(obj):
+	return isinstance(obj, (type, types.ClassType))
+
+def _ismethod(obj):
+	return isinstance(obj, types.MethodType)
+
 class MetaBaseFlattyType(type):
 	def __eq__(self, other):
 		""" We need to overwrite this since the dynamically generated classes
@@ -143,6 +159,177 @@ class TypedDict(BaseFlattyType, dict):
 	"""
 	pass
 
+class TypedArray(BaseFlattyType):
+	"""
+	This class is used for numeric arrays. The values are held in a
+	`numpy.ndarray` if NumPy is installed, otherwise in an `array.array`.
+	The type is the name of a NumPy dtype: int8, uint8, int16, uint16,
+	int32, uint32, int64, uint64, float32 or float64.
+	
+	Arrays are flattened to lists or, with ``encoding='base64'``, to a
+	base64 string of the little-endian values.
+	
+		>>> import flatty
+		>>> 
+		>>> class Series(flatty.Schema):
+		...	 samples = flatty.TypedArray.set_type('float64')
+		...	 packed = flatty.TypedArray.set_type('int16', encoding='base64')
+		... 
+		>>> series = Series(samples=[0.5, 1.5], packed=[1, 2])
+		>>> flatted = series.flatit()
+		>>> flatted['samples'], flatted['packed']
+		([0.5, 1.5], 'AQACAA==')
+		>>> list(Series.unflatit(flatted).packed)
+		[1, 2]
+	"""
+	encoding = 'list'
+	
+	@classmethod
+	def set_type(cls, ftype, encoding='list'):
+		"""sets the type of the array
+	
+		Args:
+			ftype: the name of the NumPy dtype of the values
+			
+			encoding: either ``'list'`` or ``'base64'`` (default='list')
+			
+		Returns:
+			a class object with the class variables `ftype` and `encoding`
+			set"""
+		if ftype not in _array_codes:
+			raise ValueError('Unsupported array type ' + repr(ftype))
+		if encoding not in ('list', 'base64'):
+			raise ValueError('Unsupported array encoding ' + repr(encoding))
+		return type(cls.__name__, cls.__bases__, dict(ftype=ftype,
+					encoding=encoding, set_type=cls.set_type))
+
+def _find_array_codes():
+	codes = {'int8':'b', 'uint8':'B', 'int16':'h', 'uint16':'H',
+			'float32':'f', 'float64':'d'}
+	for ftype, candidates in [('int32', 'ilh'), ('uint32', 'ILH'),
+							('int64', 'lq'), ('uint64', 'LQ')]:
+		size = int(ftype[-2:]) // 8
+		for code in candidates:
+			try:
+				if array.array(code).itemsize == size:
+					codes[ftype] = code
+					break
+			except ValueError:
+				pass
+	return codes
+
+#array.array type codes for the dtype names
+_array_codes = _find_array_codes()
+
+_numpy_module = []
+
+def _numpy():
+	"""returns the numpy module or None if it is not installed. It is only
+	imported when it is needed."""
+	if len(_numpy_module) == 0:
+		try:
+			import numpy
+		except ImportError:
+			numpy = None
+		_numpy_module.append(numpy)
+	return _numpy_module[0]
+
+class Field(collections.namedtuple('Field', ['name', 'type', 'default'])):
+	"""
+	Descriptor of a schema attribute in :attr:`Schema.__fields__`. `type`
+	is the type of the attribute and `default` the value in the schema
+	definition, for default instances `type` is the type of `default`.
+	
+	"""
+	__slots__ = ()
+
+class FieldMap(dict):
+	"""
+	Read-only mapping of the attribute names of a schema class to their
+	:class:`Field`. Iterating yields the names in the order flatty processes
+	the attributes, :meth:`values` returns a tuple of the fields in this
+	order.
+	
+	"""
+	def __init__(self, fields):
+		self._fields = tuple(fields)
+		dict.__init__(self, [(field.name, field) for field in self._fields])
+	
+	def _read_only(self, *args, **kwargs):
+		raise TypeError('FieldMap is read-only')
+	
+	__setitem__ = __delitem__ = _read_only
+	clear = pop = popitem = setdefault = update = _read_only
+	
+	def __iter__(self):
+		return iter(self.keys())
+	
+	def keys(self):
+		return [field.name for field in self._fields]
+	
+	def values(self):
+		return self._fields
+	
+	def items(self):
+		return [(field.name, field) for field in self._fields]
+	
+	iterkeys = __iter__
+	
+	def itervalues(self):
+		return iter(self._fields)
+	
+	def iteritems(self):
+		return iter(self.items())
+	
+	def __repr__(self):
+		return 'FieldMap(%s)' % repr(list(self._fields))
+
+class MetaSchema(type):
+	"""
+	Metaclass of :class:`Schema`. Looks up the attributes of a schema class
+	once, when the class is created, and stores them in `__fields__`. They
+	are looked up again if attributes of the class or of its base classes
+	are changed later.
+	
+	"""
+	def __init__(cls, name, bases, attrs):
+		super(MetaSchema, cls).__init__(name, bases, attrs)
+		cls._update_fields()
+	
+	def __setattr__(cls, name, value):
+		if name == '__fields__':
+			raise AttributeError('__fields__ is read-only')
+		super(MetaSchema, cls).__setattr__(name, value)
+		if not name.startswith('__'):
+			cls._fields_changed()
+	
+	def __delattr__(cls, name):
+		super(MetaSchema, cls).__delattr__(name)
+		if not name.startswith('__'):
+			cls._fields_changed()
+	
+	def _fields_changed(cls):
+		stack = [cls]
+		while stack:
+			schema_cls = stack.pop()
+			schema_cls._update_fields()
+			stack.extend(type.__subclasses__(schema_cls))
+		#fingerprints of nested schemas include the fields too
+		_fingerprint_cache.clear()
+		#the compiled upgrades lead to the old fingerprints
+		MigrationManager._compiled.clear()
+	
+	def _update_fields(cls):
+		fields = []
+		for attr_name in dir(cls):
+			attr_value = getattr(cls, attr_name)
+			if not attr_name.startswith('__') and not _ismethod(attr_value):
+				attr_type = attr_value
+				if _isclass(attr_value) == False:
+					attr_type = type(attr_value)
+				fields.append(Field(attr_name, attr_type, attr_value))
+		type.__setattr__(cls, '__fields__', FieldMap(fields))
+
 class Schema(object):
 	"""
 	This class builds the base class for all schema classes.
@@ -154,35 +341,84 @@ class Schema(object):
 		...	 a_num = int
 		...	 a_str = str
 		...	 a_thing = None  
+		...
+		>>> Bar.__fields__['a_thing']
+		Field(name='a_thing', type=<type 'NoneType'>, default=None)
+		>>> list(Bar.__fields__)
+		['a_num', 'a_str', 'a_thing']
+	
+	The attributes of a schema class are available in `__fields__`, a
+	read-only :class:`FieldMap` which is computed when the class is
+	created.
+	
+	Attributes listed in `__indexes__` are indexed by the
+	:class:`flatty.index.IndexManager`.
+	
+	Set `__versioned__` to True to store the :func:`fingerprint` of the
+	schema in the flat dict under the key `__fingerprint_key__`. Such dicts
+	are upgraded with the migrations registered at the
+	:class:`MigrationManager` when they are unflattened with a changed
+	schema.
 	
 	"""
+	__metaclass__ = MetaSchema
+	__versioned__ = False
+	__fingerprint_key__ = '__fingerprint__'
+	__indexes__ = ()
+	
 	def __init__(self, **kwargs):
 		#to comfortably set attributes via kwargs in the __init__
+		if kwargs:
+			fields = type(self).__fields__
 		for name, value in kwargs.items():
-			if not hasattr(self, name):
+			if name not in fields and not hasattr(self, name):
 				raise AttributeError('Attribute not exists')
 			setattr(self, name, value)
 	
-	def flatit(self):
-		"""one way to flatten the instance of this class
+	def flatit(self, **kwargs):
+		"""one way to flatten the instance of this class, takes the same
+		keyword arguments as :func:`flatit`
 			
 		Returns:
 			a dict where the instance is flattened to primitive types"""
-		return flatit(self)
+		return flatit(self, **kwargs)
 	
 	@classmethod
-	def unflatit(cls, flat_dict):
-		"""one way to unflatten and load the data back in the schema objects
+	def unflatit(cls, flat_dict, **kwargs):
+		"""one way to unflatten and load the data back in the schema objects,
+		takes the same keyword arguments as :func:`unflatit`
 			
 		Returns:
 			the object"""
 		
-		return unflatit(cls, flat_dict)		
+		return unflatit(cls, flat_dict, **kwargs)		
+	
+	@classmethod
+	def validate_flat(cls, flat_dict):
+		"""checks if `flat_dict` can be unflattened to an instance of this
+		class, see :func:`validate`
+			
+		Returns:
+			a list of `(path, message)` tuples, empty if `flat_dict` is
+			valid"""
+		return validate(cls, flat_dict)
+			
+def schema_fields(schema_cls):
+	"""returns the fields of a schema class in the order flatty processes
+	them, see :attr:`Schema.__fields__`
+	
+		Args:
+			schema_cls: a subclass of :class:`Schema`
+	
+		Returns:
+			a list of `(name, type)` tuples. For default instances in the
+			schema definition `type` is the type of the instance"""
+	return [(field.name, field.type) for field in schema_cls.__fields__.values()]
 			
 def _check_type(val, type):
 	if type == None or val == None or type == types.NoneType:
 		return
-	if inspect.isclass(type) == False:
+	if _isclass(type) == False:
 		type = type.__class__
 	if not isinstance(val, type): 
 		raise TypeError(str(val.__class__) + " != " + str(type))
@@ -230,6 +466,49 @@ class Converter(object):
 			a converted high level schema object"""
 		raise NotImplementedError()
 	
+	@classmethod
+	def validate_flat(cls, val_type, val, path, errors):
+		"""checks if the flat `val` can be converted to `val_type`, used
+		by :func:`validate`. The default implementation converts `val`
+		with :meth:`to_obj`, converters override it to check without
+		building objects.
+	
+		Args:
+			val_type: type from schema
+			
+			val: the flat value, not None
+			
+			path: the dotted path of `val`
+			
+			errors: list to which a tuple `(path, message)` is appended
+				for every error"""
+		try:
+			cls.check_type(val_type, cls.to_obj(val_type, val))
+		except (TypeError, ValueError), e:
+			errors.append((path, str(e)))
+
+def _validate_format(regex, fmt, factory, val, path, errors):
+	"""validates the date or time string `val` with `regex` and by
+	building the value with `factory` from the numbers in the string"""
+	match = None
+	if isinstance(val, basestring):
+		match = regex.match(val)
+	if match == None:
+		errors.append((path, '%s does not match %s' % (repr(val), fmt)))
+		return
+	numbers = [int(num) for num in match.groups()]
+	if len(numbers) > 3:
+		#fraction of a second to microseconds like strptime
+		numbers[-1] = int(match.groups()[-1].ljust(6, '0'))
+	try:
+		factory(*numbers)
+	except ValueError, e:
+		errors.append((path, '%s: %s' % (repr(val), e)))
+
+_date_regex = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})$')
+_datetime_regex = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})T(\d{1,2}):(\d{1,2}):(\d{1,2})\.(\d{1,6})$')
+_time_regex = re.compile(r'(\d{1,2}):(\d{1,2}):(\d{1,2})\.(\d{1,6})$')
+
 class DateConverter(Converter):
 	"""
 	Converter for datetime.date
@@ -246,6 +525,9 @@ class DateConverter(Converter):
 		if val == None:
 			return None
 		return datetime.datetime.strptime(str(val), "%Y-%m-%d").date()
+	@classmethod
+	def validate_flat(cls, val_type, val, path, errors):
+		_validate_format(_date_regex, '%Y-%m-%d', datetime.date, val, path, errors)
 			
 class DateTimeConverter(Converter):
 	"""
@@ -263,6 +545,10 @@ class DateTimeConverter(Converter):
 		if val == None:
 			return None
 		return datetime.datetime.strptime(str(val), "%Y-%m-%dT%H:%M:%S.%f")
+	@classmethod
+	def validate_flat(cls, val_type, val, path, errors):
+		_validate_format(_datetime_regex, '%Y-%m-%dT%H:%M:%S.%f',
+						datetime.datetime, val, path, errors)
 
 class TimeConverter(Converter):
 	"""
@@ -280,65 +566,343 @@ class TimeConverter(Converter):
 		if val == None:
 			return None
 		return datetime.datetime.strptime(str(val), "%H:%M:%S.%f").time()
+	@classmethod
+	def validate_flat(cls, val_type, val, path, errors):
+		_validate_format(_time_regex, '%H:%M:%S.%f', datetime.time, val,
+						path, errors)
+
+class BinaryConverter(Converter):
+	"""
+	Converter for binary data of the types buffer, memoryview and bytearray.
+	Attributes of these types accept str values too.
+	
+	The data is flattened to the type given with the `binary` option of
+	:func:`flatit`, e.g. ``bson.Binary``, otherwise to a base64 encoded
+	string. Unflattened buffers and memoryviews reference the flat value,
+	the data is not copied.
+	
+		>>> import flatty
+		>>> 
+		>>> class Blob(flatty.Schema):
+		...	 data = buffer
+		...
+		>>> flatty.flatit(Blob(data=buffer('flatty', 3)))
+		{'data': 'dHR5'}
+		>>> flatty.flatit(Blob(data='flatty'), binary=str)
+		{'data': 'flatty'}
+		>>> str(flatty.unflatit(Blob, {'data': 'dHR5'}).data)
+		'tty'
+	
+	"""
+	@classmethod
+	def check_type(cls, attr_type, attr_value):
+		if attr_value is None or isinstance(attr_value, _binary_types):
+			return
+		raise TypeError(repr(type(attr_value)) + '!=' + repr(attr_type))
+	
+	@classmethod
+	def to_flat(cls, obj_type, obj):
+		check_type(obj_type, obj)
+		if obj is None:
+			return None
+		context = getattr(_local, 'flat_context', None)
+		if context == None or context.binary == None:
+			return base64.b64encode(obj)
+		return context.binary(cls.to_bytes(obj_type, obj))
+	
+	@classmethod
+	def to_obj(cls, val_type, val):
+		if val is None:
+			return None
+		context = getattr(_local, 'obj_context', None)
+		if isinstance(val, basestring) and (context == None or
+			context.binary == None or not isinstance(val, context.binary)):
+			val = base64.b64decode(val)
+		return cls.from_bytes(val_type, val)
+	
+	@classmethod
+	def to_bytes(cls, obj_type, obj):
+		"""returns the data of `obj` as string, str values are not copied"""
+		if isinstance(obj, str):
+			return obj
+		if isinstance(obj, memoryview):
+			return obj.tobytes()
+		return str(obj)
+	
+	@classmethod
+	def from_bytes(cls, val_type, data):
+		"""returns an instance of `val_type` with the data of the string
+		`data`"""
+		if issubclass(val_type, buffer):
+			return buffer(data)
+		return val_type(data)
+
+_binary_types = (str, buffer, memoryview, bytearray)
+	
+_local = threading.local()
+
+class _FlatContext(object):
+	"""
+	State of one :func:`flatit` call. Holds the options of the call, the
+	already flattened schema objects and the objects which are currently
+	flattened to detect cycles. `include` and `exclude` are the path trees
+	(see :func:`_compile_paths`) of the object which is currently flattened.
 	
+	"""
+	def __init__(self, compact=False, include=None, exclude=None, binary=None):
+		self.compact = compact
+		self.include = include
+		self.exclude = exclude
+		self.binary = binary
+		self.memo = {}
+		self.active = set()
+
+class _ObjContext(object):
+	"""
+	State of one :func:`unflatit` call. Holds the options of the call.
+	
+	"""
+	def __init__(self, compact=False, include=None, binary=None):
+		self.compact = compact
+		self.include = include
+		self.exclude = None
+		self.binary = binary
+
+def _compile_paths(paths):
+	"""builds a tree of nested dicts from a list of dotted paths, e.g.
+	``['a.b', 'a.c', 'd']`` results in ``{'a':{'b':True, 'c':True}, 'd':True}``.
+	`True` marks the end of a path, which selects the whole subtree."""
+	if paths == None:
+		return None
+	tree = {}
+	for path in paths:
+		node = tree
+		names = path.split('.')
+		for name in names[:-1]:
+			if node.get(name) is True:
+				break
+			node = node.setdefault(name, {})
+		else:
+			node[names[-1]] = True
+	return tree
+
+def _project(include, exclude, attr_name):
+	"""returns None if the attribute `attr_name` is not selected by the path
+	trees `include` and `exclude`, otherwise a tuple with the path trees for
+	the value of the attribute"""
+	child_include = None
+	if include != None:
+		if attr_name not in include:
+			return None
+		if include[attr_name] is not True:
+			child_include = include[attr_name]
+	child_exclude = None
+	if exclude != None and attr_name in exclude:
+		if exclude[attr_name] is True:
+			return None
+		child_exclude = exclude[attr_name]
+	return child_include, child_exclude
+
+class SchemaVersionError(ValueError):
+	"""
+	Raised if flattened data was created with another version of the
+	schema than the one used for unflattening.
+	
+	"""
+	pass
+
+class CycleError(ValueError):
+	"""
+	Raised if an object references itself (directly or through other
+	objects) and therefore can't be flattened.
+	
+	"""
+	pass
+
+def _copy_flat(flat):
+	"""returns a copy of the dicts and lists in the flat value `flat`,
+	without recursion as flat values may be nested deeply"""
+	result = [None]
+	stack = [(result, 0, flat)]
+	while stack:
+		target, key, value = stack.pop()
+		if isinstance(value, dict):
+			copy = target[key] = {}
+			for k, v in value.iteritems():
+				stack.append((copy, k, v))
+		elif isinstance(value, list):
+			copy = target[key] = [None] * len(value)
+			for index, item in enumerate(value):
+				stack.append((copy, index, item))
+		else:
+			target[key] = value
+	return result[0]
+
 class SchemaConverter(Converter):
 	"""
 	Convert basic schema classes
 	
+	Within one :func:`flatit` call every schema object is flattened only
+	once, even if it is referenced from many places. The other places get
+	a copy of its flat dict, so the flat dicts can be changed independently.
+	
 	"""
 	@classmethod
 	def check_type(cls, attr_type, attr_value):
-		if not issubclass(type(attr_value), attr_type):
+		if not(issubclass(type(attr_value), attr_type) \
+			 or type(attr_value) == types.NoneType):
 			raise TypeError(repr(type(attr_value)) + '!=' + repr(attr_type))
 	
 	@classmethod
 	def to_flat(cls, obj_type, obj):
-		flat_dict = {}
-		for attr_name in dir(obj_type):
+		if obj == None:
+			return None
+		context = getattr(_local, 'flat_context', None)
+		if context == None:
+			#called directly, flatit sets up the context and calls us again
+			return flatit(obj, obj_type)
+		
+		key = (id(obj), obj_type, id(context.include), id(context.exclude))
+		entry = context.memo.get(key)
+		#the entry holds obj, so its id isn't reused by another object
+		if entry != None and entry[0] is obj:
+			return _copy_flat(entry[1])
+		if id(obj) in context.active:
+			raise CycleError('Cycle detected while flattening ' + repr(obj))
+		
+		context.active.add(id(obj))
+		try:
+			flat_dict = cls._to_flat(obj_type, obj)
+		finally:
+			context.active.discard(id(obj))
+		context.memo[key] = (obj, flat_dict)
+		return flat_dict
+	
+	@classmethod
+	def _to_flat(cls, obj_type, obj):
+		context = _local.flat_context
+		compact = context.compact
+		include, exclude = context.include, context.exclude
+		projected = include != None or exclude != None
+		if compact:
+			flat = []
+		else:
+			flat = {}
+		for attr_name, attr_type, default in obj_type.__fields__.values():
+			if projected:
+				projection = _project(include, exclude, attr_name)
+				if projection == None:
+					if compact:
+						flat.append(None)
+					continue
+				context.include, context.exclude = projection
+			
 			attr_value = getattr(obj, attr_name)
-			attr_type = getattr(obj_type, attr_name)
-			if not attr_name.startswith('__') and not inspect.ismethod(attr_value):
+			
+			#set None if types are still present in the object
+			# and these are types and not objects
+			if _isclass(attr_value) and attr_value == attr_type:
+				attr_value = None
 				
-				#set None if types are still present in the object
-				# and these are types and not objects
-				if attr_value == attr_type and inspect.isclass(attr_value):
-					attr_value = None
-					
-				#get the type of default instances in schema definitions
-				if inspect.isclass(attr_type) == False:
-					attr_type = type(attr_type)
-					
-				check_type(attr_type, attr_value)
-				attr_value = flatit(attr_value, attr_type)
-					
-				flat_dict[attr_name] = attr_value		
-		return flat_dict
+			timed = ConvertManager._stats != None
+			if timed:
+				start = _timer()
+			check_type(attr_type, attr_value)
+			attr_value = flatit(attr_value, attr_type)
+			if timed:
+				ConvertManager.record_stats('fields',
+					obj_type.__name__ + '.' + attr_name, 'to_flat',
+					_timer() - start, attr_value)
+			
+			if compact:
+				flat.append(attr_value)
+			else:
+				flat[attr_name] = attr_value
+		context.include, context.exclude = include, exclude
+		return flat
 	
 	@classmethod
 	def to_obj(cls, val_type, val):
+		if val == None:
+			return None
+		fields = val_type.__fields__.values()
+		context = getattr(_local, 'obj_context', None)
+		include = None
+		if context != None:
+			include = context.include
+		if context != None and context.compact:
+			if not isinstance(val, list) or len(val) != len(fields):
+				raise TypeError('List with %d values expected for %s' % \
+								(len(fields), repr(val_type)))
+			val = dict(zip([field.name for field in fields], val))
+		
 		#instantiate new object
 		cls_obj = val_type()
 		#iterate all attributes
-		for attr_name in dir(val_type):
-			attr_value = getattr(val_type, attr_name)
-			if not attr_name.startswith('__') and not inspect.ismethod(attr_value):
-				#set attr the value of the flat_dict if exists
-				flat_val = None
-				if attr_name in val:
-					flat_val = val[attr_name]
-					#get the type of default instances in schema definitions
-					if inspect.isclass(attr_value) == False:
-						attr_value = type(attr_value)
-					conv_attr_value = unflatit(attr_value, flat_val)
-					check_type(attr_value, conv_attr_value)
-				
-					setattr(cls_obj, attr_name, conv_attr_value)
+		for attr_name, attr_type, default in fields:
+			if include != None:
+				projection = _project(include, None, attr_name)
+				if projection == None:
+					continue
+				context.include = projection[0]
+			
+			#set attr the value of the flat_dict if exists
+			if attr_name in val:
+				flat_val = val[attr_name]
+				timed = ConvertManager._stats != None
+				if timed:
+					start = _timer()
+				conv_attr_value = unflatit(attr_type, flat_val)
+				check_type(attr_type, conv_attr_value)
+				if timed:
+					ConvertManager.record_stats('fields',
+						val_type.__name__ + '.' + attr_name, 'to_obj',
+						_timer() - start, flat_val)
+			
+				setattr(cls_obj, attr_name, conv_attr_value)
+		if include != None:
+			context.include = include
 		return cls_obj
+	
+	@classmethod
+	def validate_flat(cls, val_type, val, path, errors):
+		if not isinstance(val, dict):
+			errors.append((path, repr(type(val)) + '!=' + repr(dict)))
+			return
+		for attr_name, attr_type, default in val_type.__fields__.values():
+			if attr_name in val:
+				_validate(attr_type, val[attr_name], _join_path(path, attr_name),
+						errors)
+
+_primitive_types = (int, long, float, bool, str, unicode, basestring)
+
+def _has_primitive_ftype(cls):
+	"""returns True if the items of the :class:`TypedList` or
+	:class:`TypedDict` class `cls` are of a primitive type without a
+	converter. This is determined once per class and registry."""
+	registry = ConvertManager.registry()
+	primitive = registry._primitive.get(cls)
+	if primitive == None:
+		primitive = cls.ftype in _primitive_types and \
+					registry.get_converter(cls.ftype) == None
+		registry._primitive[cls] = primitive
+	return primitive
+
+def _check_primitive_items(ftype, items):
+	"""checks the type of all `items` against `ftype` at once"""
+	for item_type in set(map(type, items)):
+		if item_type is not types.NoneType and not issubclass(item_type, ftype):
+			#check item by item to raise the usual TypeError
+			for item in items:
+				check_type(ftype, item)
 
 class TypedListConverter(Converter):
 	"""
 	Convert TypedList classes
 	
+	Lists of primitive types like int, float or unicode are checked and
+	copied as a whole instead of converting every item.
+	
 	"""
 	
 	@classmethod
@@ -358,6 +922,9 @@ class TypedListConverter(Converter):
 		check_type(obj_type, obj)
 		if obj == None:
 			return None
+		if _has_primitive_ftype(obj_type):
+			_check_primitive_items(obj_type.ftype, obj)
+			return list(obj)
 		flat_list = []
 		for item in obj:
 			check_type(obj_type.ftype, item)
@@ -366,18 +933,32 @@ class TypedListConverter(Converter):
 	
 	@classmethod
 	def to_obj(cls, val_type, val):
-		obj = val_type()
 		if val == None:
 			return None
+		if _has_primitive_ftype(val_type) and \
+			val_type.ftype not in ConvertManager._intern_types:
+			return val_type(val)
 		
+		obj = val_type()
 		for item in val:
 			obj.append(unflatit(val_type.ftype, item))
 		return obj
 	
+	@classmethod
+	def validate_flat(cls, val_type, val, path, errors):
+		if not isinstance(val, list):
+			errors.append((path, repr(type(val)) + '!=' + repr(list)))
+			return
+		for i, item in enumerate(val):
+			_validate(val_type.ftype, item, _join_path(path, i), errors)
+	
 	
 class TypedDictConverter(Converter):
 	"""
-	Convert TypedList classes
+	Convert TypedDict classes
+	
+	Dicts of primitive types like int, float or unicode are checked and
+	copied as a whole instead of converting every item.
 	
 	"""
 	@classmethod
@@ -393,6 +974,9 @@ class TypedDictConverter(Converter):
 		check_type(obj_type, obj)
 		if obj == None:
 			return None
+		if _has_primitive_ftype(obj_type):
+			_check_primitive_items(obj_type.ftype, obj.values())
+			return dict(obj)
 		flat_dict = {}
 		for k, v in obj.items():
 			check_type(obj_type.ftype, v)
@@ -403,26 +987,267 @@ class TypedDictConverter(Converter):
 	def to_obj(cls, val_type, val):
 		if val == None:
 			return None
+		if _has_primitive_ftype(val_type) and \
+			val_type.ftype not in ConvertManager._intern_types:
+			return val_type(val)
 		obj = val_type()
 		for k, v in val.items():
 			obj[k] = unflatit(val_type.ftype, v)
 		return obj
 	
+	@classmethod
+	def validate_flat(cls, val_type, val, path, errors):
+		if not isinstance(val, dict):
+			errors.append((path, repr(type(val)) + '!=' + repr(dict)))
+			return
+		for k, v in val.items():
+			_validate(val_type.ftype, v, _join_path(path, k), errors)
+	
+
+class TypedArrayConverter(Converter):
+	"""
+	Convert TypedArray classes
+	
+	"""
+	@classmethod
+	def check_type(cls, attr_type, attr_value):
+		if attr_value is None:
+			return
+		if isinstance(attr_value, list):
+			#lists are checked at once by their item types like TypedList
+			if attr_type.ftype.startswith('float'):
+				item_types = (int, long, float)
+			else:
+				item_types = (int, long)
+			for item_type in set(map(type, attr_value)):
+				if not issubclass(item_type, item_types):
+					raise TypeError(repr(item_type) + '!=' + repr(attr_type.ftype))
+			return
+		if isinstance(attr_value, array.array):
+			if attr_value.typecode != _array_codes.get(attr_type.ftype):
+				raise TypeError(repr(attr_value.typecode) + '!=' + repr(attr_type.ftype))
+			return
+		numpy = _numpy()
+		if numpy != None and isinstance(attr_value, numpy.ndarray):
+			if attr_value.dtype != numpy.dtype(attr_type.ftype):
+				raise TypeError(repr(attr_value.dtype) + '!=' + repr(attr_type.ftype))
+			return
+		raise TypeError(repr(type(attr_value)) + '!=' + repr(attr_type))
+	
+	@classmethod
+	def to_flat(cls, obj_type, obj):
+		check_type(obj_type, obj)
+		if obj is None:
+			return None
+		if obj_type.encoding == 'base64':
+			return base64.b64encode(cls.to_bytes(obj_type, obj))
+		if isinstance(obj, list):
+			return list(obj)
+		return obj.tolist()
+	
+	@classmethod
+	def to_obj(cls, val_type, val):
+		if val is None:
+			return None
+		if isinstance(val, basestring):
+			return cls.from_bytes(val_type, base64.b64decode(val))
+		numpy = _numpy()
+		if numpy != None:
+			return numpy.array(val, dtype=val_type.ftype)
+		return array.array(_array_codes[val_type.ftype], val)
+	
+	@classmethod
+	def to_bytes(cls, obj_type, obj):
+		"""returns the values of `obj` as string of little-endian values"""
+		numpy = _numpy()
+		if numpy != None:
+			return numpy.asarray(obj, dtype=numpy.dtype(obj_type.ftype).newbyteorder('<')).tostring()
+		if isinstance(obj, list):
+			obj = array.array(_array_codes[obj_type.ftype], obj)
+		if sys.byteorder == 'big':
+			obj = array.array(obj.typecode, obj)
+			obj.byteswap()
+		return obj.tostring()
+	
+	@classmethod
+	def from_bytes(cls, val_type, data):
+		"""returns an array with the values of the little-endian string
+		`data`. With NumPy no copy is made, the array is read-only then."""
+		numpy = _numpy()
+		if numpy != None:
+			return numpy.frombuffer(data, dtype=numpy.dtype(val_type.ftype).newbyteorder('<'))
+		obj = array.array(_array_codes[val_type.ftype])
+		obj.fromstring(data)
+		if sys.byteorder == 'big':
+			obj.byteswap()
+		return obj
+	
+
+class ConverterRegistry(object):
+	"""
+	An immutable set of converters. Changes create a new registry, so a
+	registry can be shared by threads without locks. Converter lookups are
+	cached per registry.
+	
+	The registry used for conversions is the one passed to :func:`flatit`
+	or :func:`unflatit`, the one activated with a ``with`` statement in the
+	current thread or otherwise the global registry of the
+	:class:`ConvertManager`.
+	
+		>>> import flatty
+		>>> import datetime
+		>>> 
+		>>> class OrdinalConverter(flatty.Converter):
+		...	 @classmethod
+		...	 def to_flat(cls, obj_type, obj):
+		...		 return obj.toordinal()
+		...
+		>>> registry = flatty.ConvertManager.registry().with_converter(
+		...				datetime.date, OrdinalConverter)
+		>>> flatty.flatit(datetime.date(2011, 7, 15), registry=registry)
+		734333
+		>>> with registry:
+		...	 flatty.flatit(datetime.date(2011, 7, 15))
+		734333
+		>>> flatty.flatit(datetime.date(2011, 7, 15))
+		'2011-07-15'
+	
+		Args:
+			converters: a dict mapping the types to dicts with the converter
+				`conv` and the `exact` flag, see
+				:meth:`ConvertManager.set_converter` (default=None)
+	
+	"""
+	def __init__(self, converters=None):
+		self._convert_dict = dict(converters or {})
+		#weak keys, the registry doesn't keep dynamically created classes
+		#alive
+		self._cache = weakref.WeakKeyDictionary()
+		self._primitive = weakref.WeakKeyDictionary()
+	
+	def get_converter(self, val_type):
+		"""returns the converter responsible for `val_type`, see
+		:meth:`ConvertManager.get_converter`"""
+		try:
+			conv = self._cache.get(val_type, _missing)
+		except TypeError:
+			#unhashable type or no weak reference possible
+			return self._lookup(val_type)
+		if conv is _missing:
+			conv = self._lookup(val_type)
+			#no lock needed, every thread would store the same converter
+			self._cache[val_type] = conv
+		return conv
+	
+	def _lookup(self, val_type):
+		for type in self._convert_dict:
+			#String comparisson is okay here since we compare schema against
+			#object types which can differ in the ftype class variable therefore
+			#string compare is correct and direct type compare fails
+			if str(val_type) == str(type):
+				return self._convert_dict[type]['conv']
+		
+		for type in self._convert_dict:
+			if self._convert_dict[type]['exact'] == False and issubclass(val_type, type):
+				return self._convert_dict[type]['conv']
+		
+		return None
+	
+	def with_converter(self, conv_type, converter, exact=True):
+		"""returns a new registry with the converter for `conv_type` set,
+		see :meth:`ConvertManager.set_converter`"""
+		if not (_isclass(converter) and issubclass(converter, Converter)):
+			raise TypeError('Subclass of Converter expected')
+		converters = dict(self._convert_dict)
+		converters[conv_type] = {'conv':converter, 'exact':exact}
+		return ConverterRegistry(converters)
+	
+	def without_converter(self, conv_type):
+		"""returns a new registry without the converter for `conv_type`"""
+		converters = dict(self._convert_dict)
+		converters.pop(conv_type, None)
+		return ConverterRegistry(converters)
+	
+	def converters(self):
+		"""returns a dict mapping the types to their converters"""
+		return dict([(conv_type, entry['conv']) for conv_type, entry \
+					in self._convert_dict.items()])
+	
+	def __enter__(self):
+		stack = getattr(_local, 'registry_stack', None)
+		if stack == None:
+			stack = _local.registry_stack = []
+		stack.append(getattr(_local, 'registry', None))
+		_local.registry = self
+		return self
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		_local.registry = _local.registry_stack.pop()
 
 class ConvertManager(object):
 	"""
 	Class for managing the converters
 	
+	The converters are kept in an immutable :class:`ConverterRegistry`.
+	:meth:`set_converter` and :meth:`del_converter` replace the global
+	registry with a changed copy. :func:`flatit`, :func:`unflatit` and
+	:func:`validate` activate the current registry for the thread when they
+	start, so conversions which are running keep using the registry they
+	started with.
+	
+	The manager can also collect statistics about the converters (call
+	counts, cumulative time and size of the flat data) and the schema fields.
+	Statistics are disabled by default and cost only one attribute lookup
+	per conversion then. Enable them with :meth:`enable_stats` and read them
+	with :meth:`stats` or :func:`flatty.stats`.
+	
+	With :meth:`enable_interning` the results of unflattening immutable
+	types are cached, so equal flat values result in the same object.
+	
 	"""
 	
-	_convert_dict = {
+	_registry = ConverterRegistry({
 					datetime.date:{'conv':DateConverter, 'exact':True},
 					datetime.datetime:{'conv':DateTimeConverter, 'exact':True},
 					datetime.time:{'conv':TimeConverter, 'exact':True},
 					Schema:{'conv':SchemaConverter, 'exact':False},
 					TypedDict:{'conv':TypedDictConverter, 'exact':True},
 					TypedList:{'conv':TypedListConverter, 'exact':True},
-					}
+					TypedArray:{'conv':TypedArrayConverter, 'exact':True},
+					buffer:{'conv':BinaryConverter, 'exact':True},
+					memoryview:{'conv':BinaryConverter, 'exact':True},
+					bytearray:{'conv':BinaryConverter, 'exact':True},
+					})
+	_registry_lock = threading.Lock()
+	
+	_stats = None
+	_stats_hook = None
+	_intern_cache = None
+	_intern_types = frozenset()
+	
+	@classmethod
+	def get_converter(cls, val_type):
+		"""returns the converter responsible for `val_type`
+	
+		Args:
+			val_type: the type for which we look up the converter
+			
+		Returns:
+			a subclass of :class:`Converter` or None if no converter is
+			registered for `val_type` in the current registry"""
+		registry = getattr(_local, 'registry', None)
+		if registry == None:
+			registry = cls._registry
+		return registry.get_converter(val_type)
+	
+	@classmethod
+	def registry(cls):
+		"""returns the current :class:`ConverterRegistry`, the one active
+		in this thread or the global one"""
+		registry = getattr(_local, 'registry', None)
+		if registry == None:
+			registry = cls._registry
+		return registry
 	
 	@classmethod
 	def to_flat(cls, val_type, obj):
@@ -435,18 +1260,16 @@ class ConvertManager(object):
 			
 		Returns:
 			a converted primitive object"""
-		for type in cls._convert_dict:
-			#String comparisson is okay here since we compare schema against
-			#object types which can differ in the ftype class variable therefore
-			#string compare is correct and direct type compare fails
-			if str(val_type) == str(type):
-				return cls._convert_dict[type]['conv'].to_flat(val_type, obj)
-		
-		for type in cls._convert_dict:
-			if cls._convert_dict[type]['exact'] == False and issubclass(val_type, type):
-				return cls._convert_dict[type]['conv'].to_flat(val_type, obj)
-			
-		return obj
+		conv = cls.get_converter(val_type)
+		if conv == None:
+			return obj
+		if cls._stats != None:
+			start = _timer()
+			flat = conv.to_flat(val_type, obj)
+			cls.record_stats('converters', conv.__name__, 'to_flat',
+							_timer() - start, flat)
+			return flat
+		return conv.to_flat(val_type, obj)
 	
 	@classmethod
 	def to_obj(cls, val_type, val):
@@ -460,19 +1283,30 @@ class ConvertManager(object):
 			
 		Returns:
 			a converted high level schema object"""
-		
-		for type in cls._convert_dict:
-			#String comparisson is okay here since we compare schema against
-			#object types which can differ in the ftype class variable therefore
-			#string compare is correct and direct type compare fails
-			if str(val_type) == str(type):
-				return cls._convert_dict[type]['conv'].to_obj(val_type, val)
-		
-		for type in cls._convert_dict:
-			if cls._convert_dict[type]['exact'] == False and issubclass(val_type, type):
-				return cls._convert_dict[type]['conv'].to_obj(val_type, val)
-			
-		return val
+		conv = cls.get_converter(val_type)
+		intern_cache = cls._intern_cache
+		if intern_cache != None and isinstance(val, basestring) and \
+			val_type in cls._intern_types:
+			#'x' == u'x', the type of the value keeps them apart
+			key = (val_type, type(val), val)
+			obj = intern_cache.get(key, _missing)
+			if obj is _missing:
+				obj = cls._to_obj(conv, val_type, val)
+				intern_cache.put(key, obj)
+			return obj
+		return cls._to_obj(conv, val_type, val)
+	
+	@classmethod
+	def _to_obj(cls, conv, val_type, val):
+		if conv == None:
+			return val
+		if cls._stats != None:
+			start = _timer()
+			obj = conv.to_obj(val_type, val)
+			cls.record_stats('converters', conv.__name__, 'to_obj',
+							_timer() - start, val)
+			return obj
+		return conv.to_obj(val_type, val)
 	
 	@classmethod
 	def check_type(cls, attr_type, attr_value):
@@ -485,18 +1319,10 @@ class ConvertManager(object):
 			
 		Returns:
 			None if everything is ok, otherwise raise TypeError"""
-		for type in cls._convert_dict:
-			#String comparisson is okay here since we compare schema against
-			#object types which can differ in the ftype class variable therefore
-			#string compare is correct and direct type compare fails
-			if str(attr_type) == str(type):
-				cls._convert_dict[type]['conv'].check_type(attr_type, attr_value)
-				return
-			
-		for type in cls._convert_dict:
-			if cls._convert_dict[type]['exact'] == False and issubclass(attr_type, type):
-				cls._convert_dict[type]['conv'].check_type(attr_type, attr_value)
-				return
+		conv = cls.get_converter(attr_type)
+		if conv != None:
+			conv.check_type(attr_type, attr_value)
+			return
 			
 		_check_type(attr_value, attr_type)
 	
@@ -516,19 +1342,213 @@ class ConvertManager(object):
 				because Schema Classes are always inherited at least once.
 				(default=True) 
 		"""
-		if inspect.isclass(converter) and \
-			issubclass(converter, Converter):
-			cls._convert_dict[conv_type] = {}
-			cls._convert_dict[conv_type]['conv'] = converter
-			cls._convert_dict[conv_type]['exact'] = exact
-		else:
-			raise TypeError('Subclass of Converter expected')
-	@classmethod
+		with cls._registry_lock:
+			cls._registry = cls._registry.with_converter(conv_type, converter,
+														exact)
 	
+	@classmethod
 	def del_converter(cls, conv_type):
 		"""deletes the converter object for a given `conv_type`"""
-		if conv_type in cls._convert_dict:
-			del cls._convert_dict[conv_type]
+		with cls._registry_lock:
+			cls._registry = cls._registry.without_converter(conv_type)
+	
+	@classmethod
+	def enable_stats(cls, hook=None):
+		"""enables the collection of conversion statistics
+	
+		Args:
+			hook: optional callable which is called after every recorded
+				conversion with the arguments `(kind, name, direction,
+				elapsed, size)`. `kind` is either ``'converters'`` or
+				``'fields'``, `name` the converter class name or the
+				``'Schema.field'`` name, `direction` either ``'to_flat'`` or
+				``'to_obj'``, `elapsed` the time in seconds and `size` the
+				number of items or bytes of the flat data.
+		"""
+		if cls._stats == None:
+			cls._stats = {'converters':{}, 'fields':{}}
+		#wrapped to avoid binding the hook as method of the class
+		cls._stats_hook = staticmethod(hook)
+	
+	@classmethod
+	def disable_stats(cls):
+		"""disables the collection of conversion statistics and drops the
+		collected data"""
+		cls._stats = None
+		cls._stats_hook = None
+	
+	@classmethod
+	def reset_stats(cls):
+		"""drops the collected statistics but keeps the collection enabled"""
+		if cls._stats != None:
+			cls._stats = {'converters':{}, 'fields':{}}
+	
+	@classmethod
+	def stats(cls):
+		"""returns the collected statistics
+	
+		Returns:
+			None if the statistics are disabled, otherwise a dict with the
+			keys ``'converters'`` (per converter class name) and ``'fields'``
+			(per ``'Schema.field'`` name). Each entry maps the direction
+			(``'to_flat'`` or ``'to_obj'``) to a dict with `calls`, `time`
+			(cumulative seconds, including nested conversions) and `size`
+			(cumulative items or bytes of the flat data)."""
+		if cls._stats == None:
+			return None
+		result = {}
+		for kind, entries in cls._stats.items():
+			result[kind] = {}
+			for name, directions in entries.items():
+				result[kind][name] = {}
+				for direction, counters in directions.items():
+					result[kind][name][direction] = dict(counters)
+		return result
+	
+	@classmethod
+	def enable_interning(cls, maxsize=10000, max_bytes=None,
+						types=(datetime.date, datetime.datetime, datetime.time,
+							str, unicode)):
+		"""enables the interning of unflattened values. Only use it for
+		immutable types.
+	
+		Args:
+			maxsize: maximum number of cached values (default=10000)
+			
+			max_bytes: maximum memory of the cached values in bytes
+				(default=None, no limit)
+			
+			types: the types for which the values are interned
+		"""
+		cls._intern_types = frozenset(types)
+		cls._intern_cache = InternCache(maxsize, max_bytes)
+	
+	@classmethod
+	def disable_interning(cls):
+		"""disables the interning of unflattened values and drops the cache"""
+		cls._intern_cache = None
+		cls._intern_types = frozenset()
+	
+	@classmethod
+	def intern_stats(cls):
+		"""returns the statistics of the intern cache, see
+		:meth:`InternCache.stats`, or None if interning is disabled"""
+		if cls._intern_cache == None:
+			return None
+		return cls._intern_cache.stats()
+	
+	@classmethod
+	def record_stats(cls, kind, name, direction, elapsed, flat):
+		"""adds one conversion to the statistics, is a no-op if statistics
+		are disabled
+	
+		Args:
+			kind: ``'converters'`` or ``'fields'``
+			
+			name: name of the converter or the field
+			
+			direction: ``'to_flat'`` or ``'to_obj'``
+			
+			elapsed: time in seconds the conversion took
+			
+			flat: the flat data, used to determine the size
+		"""
+		stats = cls._stats
+		if stats == None:
+			return
+		size = _flat_size(flat)
+		entries = stats[kind].setdefault(name, {})
+		counters = entries.get(direction)
+		if counters == None:
+			counters = entries[direction] = {'calls':0, 'time':0.0, 'size':0}
+		counters['calls'] += 1
+		counters['time'] += elapsed
+		counters['size'] += size
+		if cls._stats_hook != None:
+			cls._stats_hook(kind, name, direction, elapsed, size)
+	
+_missing = object()
+
+class InternCache(object):
+	"""
+	A bounded least recently used cache, used by the :class:`ConvertManager`
+	to intern unflattened values. The cache is shared by all threads, its
+	methods are guarded by a lock.
+	
+	Args:
+		maxsize: maximum number of entries
+		
+		max_bytes: maximum memory of the entries in bytes, measured with
+			`sys.getsizeof`, or None for no limit
+	"""
+	def __init__(self, maxsize=10000, max_bytes=None):
+		self.maxsize = maxsize
+		self.max_bytes = max_bytes
+		self._lock = threading.Lock()
+		self.clear()
+	
+	def get(self, key, default=None):
+		"""returns the value for `key` and marks it as recently used"""
+		with self._lock:
+			try:
+				value, size = self._data.pop(key)
+			except KeyError:
+				self._misses += 1
+				return default
+			self._data[key] = (value, size)
+			self._hits += 1
+			return value
+	
+	def put(self, key, value):
+		"""adds `value` for `key` and evicts the least recently used entries
+		if the cache is full"""
+		size = sys.getsizeof(key[-1]) + sys.getsizeof(value)
+		with self._lock:
+			old = self._data.pop(key, None)
+			if old != None:
+				self._bytes -= old[1]
+			self._data[key] = (value, size)
+			self._bytes += size
+			while len(self._data) > self.maxsize or \
+				(self.max_bytes != None and self._bytes > self.max_bytes):
+				evicted_key, (evicted, evicted_size) = self._data.popitem(last=False)
+				self._bytes -= evicted_size
+				self._evictions += 1
+	
+	def clear(self):
+		"""removes all entries and resets the statistics"""
+		with self._lock:
+			self._data = collections.OrderedDict()
+			self._bytes = 0
+			self._hits = 0
+			self._misses = 0
+			self._evictions = 0
+	
+	def stats(self):
+		"""returns a dict with the number of `hits`, `misses` and
+		`evictions`, the `hit_rate`, the number of entries `size` and their
+		memory `bytes`"""
+		with self._lock:
+			lookups = self._hits + self._misses
+			hit_rate = 0.0
+			if lookups > 0:
+				hit_rate = float(self._hits) / lookups
+			return {'hits':self._hits, 'misses':self._misses,
+					'evictions':self._evictions, 'hit_rate':hit_rate,
+					'size':len(self._data), 'bytes':self._bytes,
+					'maxsize':self.maxsize, 'max_bytes':self.max_bytes}
+
+def _flat_size(flat):
+	if isinstance(flat, (basestring, list, tuple, dict)):
+		return len(flat)
+	return 0
+	
+def stats():
+	"""returns the statistics collected by the :class:`ConvertManager`
+	
+		Returns:
+			see :meth:`ConvertManager.stats`"""
+	return ConvertManager.stats()
 	
 def check_type(attr_type, attr_value):
 	"""check the type of attr_value against attr_type
@@ -542,19 +1562,211 @@ def check_type(attr_type, attr_value):
 			attr_value, raise TypeError"""
 	ConvertManager.check_type(attr_type, attr_value)
 	
-def flatit(obj, obj_type=None):
+class MigrationManager(object):
+	"""
+	Class for managing the migrations of flattened data from older versions
+	of a schema. A migration is a function which gets the flat data of one
+	schema version and returns the flat data of the next version. 
+	
+	For every old fingerprint the migrations leading to the current
+	fingerprint of the schema are looked up once and composed to a single
+	upgrade function. Migrations of data flattened with ``compact=True``
+	get lists instead of dicts and are registered separately.
+	
+		>>> import flatty
+		>>> 
+		>>> class Person(flatty.Schema):
+		...	 __versioned__ = True
+		...	 name = str
+		... 
+		>>> old = Person(name='John Doe').flatit()
+		>>> 
+		>>> class Person(flatty.Schema):
+		...	 __versioned__ = True
+		...	 full_name = str
+		... 
+		>>> @flatty.migration(Person, old['__fingerprint__'])
+		... def rename_name(flat_dict):
+		...	 flat_dict['full_name'] = flat_dict.pop('name')
+		...	 return flat_dict
+		... 
+		>>> Person.unflatit(old).full_name
+		'John Doe'
+	
+	"""
+	
+	_migrations = {}
+	_compiled = {}
+	
+	@classmethod
+	def add_migration(cls, schema_cls, from_fp, to_fp, func, compact=False):
+		"""adds a migration for `schema_cls`
+	
+		Args:
+			schema_cls: the current schema class
+			
+			from_fp: fingerprint of the schema version `func` migrates from
+			
+			to_fp: fingerprint of the schema version `func` migrates to
+			
+			func: function which gets the flat data of version `from_fp`
+				and returns the flat data of version `to_fp`
+			
+			compact: if True, `func` migrates the lists of data flattened
+				with ``compact=True`` (default=False)
+		"""
+		cls._migrations.setdefault(schema_cls, {})[(from_fp, compact)] = (to_fp, func)
+		cls._compiled.pop(schema_cls, None)
+	
+	@classmethod
+	def del_migrations(cls, schema_cls):
+		"""deletes all migrations of `schema_cls`"""
+		cls._migrations.pop(schema_cls, None)
+		cls._compiled.pop(schema_cls, None)
+	
+	@classmethod
+	def get_upgrade(cls, schema_cls, from_fp, compact=False):
+		"""returns a function which upgrades flat data of version `from_fp`
+		to the current version of `schema_cls`
+	
+		Args:
+			compact: if True, the function upgrades data flattened with
+				``compact=True`` (default=False)
+	
+		Raises:
+			SchemaVersionError: if no migrations lead from `from_fp` to the
+				current version"""
+		compiled = cls._compiled.setdefault(schema_cls, {})
+		upgrade = compiled.get((from_fp, compact))
+		if upgrade != None:
+			return upgrade
+		
+		current_fp = fingerprint(schema_cls)
+		migrations = cls._migrations.get(schema_cls, {})
+		steps = []
+		fp = from_fp
+		while fp != current_fp:
+			if (fp, compact) not in migrations or len(steps) > len(migrations):
+				raise SchemaVersionError('No migration from version %s to %s of %s' \
+										% (from_fp, current_fp, repr(schema_cls)))
+			fp, func = migrations[(fp, compact)]
+			steps.append(func)
+		
+		def upgrade(data):
+			if isinstance(data, dict):
+				data = dict(data)
+			for func in steps:
+				data = func(data)
+			return data
+		compiled[(from_fp, compact)] = upgrade
+		return upgrade
+	
+def migration(schema_cls, from_fp, to_fp=None, compact=False):
+	"""decorator to register a migration function at the
+	:class:`MigrationManager`
+	
+		Args:
+			schema_cls: the schema class
+			
+			from_fp: fingerprint of the old schema version
+			
+			to_fp: fingerprint of the version the function migrates to, by
+				default the current fingerprint of `schema_cls`
+			
+			compact: if True, the function migrates data flattened with
+				``compact=True`` (default=False)"""
+	if to_fp == None:
+		to_fp = fingerprint(schema_cls)
+	def register(func):
+		MigrationManager.add_migration(schema_cls, from_fp, to_fp, func, compact)
+		return func
+	return register
+	
+def flatit(obj, obj_type=None, compact=False, include=None, exclude=None,
+		binary=None, registry=None, iterative=False):
 	"""one way to flatten the `obj`
 	
 		Args:
 			obj: a :class:`Schema` instance which will be flatted
+			
+			obj_type: the type of `obj`, by default the class of `obj`
+			
+			compact: if True, schema objects are flattened to lists of their
+				attribute values in the order of :attr:`Schema.__fields__`
+				instead of dicts. The fingerprint of the schema is prepended
+				to the outermost list. (default=False)
+			
+			include: list of dotted paths of the attributes which are
+				flattened, e.g. ``['name', 'address.city']``. Paths go
+				through the items of :class:`TypedList` and
+				:class:`TypedDict` attributes without naming an index or
+				key. Other attributes are not visited and left out, or are
+				None in compact lists. (default=None, everything is
+				flattened)
+			
+			exclude: list of dotted paths of the attributes which are left
+				out (default=None)
+			
+			binary: a callable which is called with the str data of
+				buffer, memoryview and bytearray attributes and returns
+				their flat value, e.g. ``bson.Binary``. (default=None, the
+				data is base64 encoded)
+			
+			registry: the :class:`ConverterRegistry` used for this call
+				(default=None, the current registry)
+			
+			iterative: if True, nested schema objects, lists and dicts are
+				flattened with an explicit stack instead of recursive calls,
+				so the depth of `obj` is not limited by the recursion limit.
+				The result is the same. (default=False)
 	
 		Returns:
-			a dict where the obj is flattened to primitive types"""
+			a dict where the obj is flattened to primitive types. Schema
+			objects referenced more than once are flattened once, every
+			place gets its own copy of the flat dict. If the schema is
+			versioned the dict contains its fingerprint.
+			
+		Raises:
+			CycleError: if `obj` contains a reference cycle"""
 	if obj_type == None:
 		obj_type = type(obj)
-	return ConvertManager.to_flat(obj_type, obj)
+	if getattr(_local, 'flat_context', None) != None:
+		#nested call of a converter
+		return ConvertManager.to_flat(obj_type, obj)
 	
-def unflatit(cls, flat_dict):
+	if registry == None and getattr(_local, 'registry', None) == None:
+		#pin the global registry, converters set meanwhile apply to later calls
+		registry = ConvertManager._registry
+	if registry != None:
+		with registry:
+			return flatit(obj, obj_type, compact, include, exclude, binary,
+						iterative=iterative)
+	
+	_local.flat_context = _FlatContext(compact=compact,
+									include=_compile_paths(include),
+									exclude=_compile_paths(exclude),
+									binary=binary)
+	try:
+		if iterative:
+			flat = _flat_iterative(obj_type, obj)
+		else:
+			flat = ConvertManager.to_flat(obj_type, obj)
+	finally:
+		_local.flat_context = None
+	return _add_fingerprint(obj_type, flat, compact)
+
+def _add_fingerprint(obj_type, flat, compact):
+	"""adds the fingerprint of the schema `obj_type` to the outermost flat
+	value if it is compact or the schema is versioned"""
+	if _is_schema(obj_type) and flat != None:
+		if compact:
+			flat = [fingerprint(obj_type)] + flat
+		elif obj_type.__versioned__:
+			flat[obj_type.__fingerprint_key__] = fingerprint(obj_type)
+	return flat
+	
+def unflatit(cls, flat_dict, compact=False, include=None, binary=None,
+			registry=None, iterative=False):
 	"""one way to unflatten and load the data back in the `cls`
 	
 		Args:
@@ -562,8 +1774,752 @@ def unflatit(cls, flat_dict):
 				the `cls`
 			cls: the class from which the instance is builded where the 
 				data is merged
+			compact: must be True if `flat_dict` was flattened with
+				``compact=True`` (default=False)
+			include: list of dotted paths of the attributes which are
+				unflattened, see :func:`flatit`. Other attributes keep their
+				default values. (default=None, everything is unflattened)
+			binary: the type of the flat values of binary attributes, see
+				:func:`flatit`. Other strings are base64 decoded.
+				(default=None)
+			registry: the :class:`ConverterRegistry` used for this call
+				(default=None, the current registry)
+			iterative: if True, the data is unflattened with an explicit
+				stack instead of recursive calls, see :func:`flatit`
+				(default=False)
+			
+		Returns:
+			an instance of type `cls`
+			
+		Raises:
+			SchemaVersionError: if the data was flattened with another
+				version of the schema and no migrations are registered
+				to upgrade it"""
+	if getattr(_local, 'obj_context', None) != None:
+		#nested call of a converter
+		return ConvertManager.to_obj(cls, flat_dict)
+	
+	if registry == None and getattr(_local, 'registry', None) == None:
+		#pin the global registry, converters set meanwhile apply to later calls
+		registry = ConvertManager._registry
+	if registry != None:
+		with registry:
+			return unflatit(cls, flat_dict, compact, include, binary,
+							iterative=iterative)
+	
+	flat_dict = _upgrade(cls, flat_dict, compact)
+	_local.obj_context = _ObjContext(compact=compact,
+									include=_compile_paths(include),
+									binary=binary)
+	try:
+		if iterative:
+			return _obj_iterative(cls, flat_dict)
+		return ConvertManager.to_obj(cls, flat_dict)
+	finally:
+		_local.obj_context = None
+
+def _upgrade(cls, flat_dict, compact):
+	"""removes the fingerprint from the outermost flat value and migrates
+	the data if it was flattened with another version of the schema"""
+	if _is_schema(cls) and flat_dict != None:
+		from_fp = None
+		if compact:
+			if not isinstance(flat_dict, list) or len(flat_dict) == 0:
+				raise TypeError('List expected for compact data')
+			from_fp = flat_dict[0]
+			flat_dict = flat_dict[1:]
+		elif isinstance(flat_dict, dict):
+			from_fp = flat_dict.get(cls.__fingerprint_key__)
+		if from_fp != None and from_fp != fingerprint(cls):
+			flat_dict = MigrationManager.get_upgrade(cls, from_fp, compact)(flat_dict)
+	return flat_dict
+
+class SlicedTask(object):
+	"""
+	A conversion which runs in slices, returned by :func:`aflatit` and
+	:func:`aunflatit`. Every call of :meth:`step` converts a part of the
+	object and returns, so an event loop can run other callbacks in
+	between. Iterating the task runs one slice per item, e.g. with
+	twisted's ``cooperate(iter(task))`` or in a tornado coroutine::
+	
+		task = flatty.aflatit(obj, slice_ms=2)
+		for pause in task:
+			yield gen.moment
+		flat = task.result
+	
+	The conversion uses the registry which was active when the task was
+	created. The converted object must not be changed until the task is
+	done. Field statistics are not recorded. Converter statistics are only
+	recorded for the values which :func:`aunflatit` converts with other
+	converters than the ones of schemas, typed lists and typed dicts. If
+	the conversion fails, the task is done and its exception is raised
+	again on later calls.
+	
+	"""
+	def __init__(self, steps, result, context_name, context, finish,
+				slice_ms, registry):
+		self.done = False
+		self.result = None
+		self._steps = steps
+		self._result = result
+		self._context_name = context_name
+		self._context = context
+		self._finish = finish
+		self._slice_ms = slice_ms
+		self._registry = registry or ConvertManager.registry()
+		self._error = None
+	
+	def step(self):
+		"""converts the next slice, i.e. `slice_items` values or with
+		`slice_ms` as many blocks of `slice_items` values as fit in the
+		budget. The clock is checked after every block, the next block is
+		started if it probably ends within the budget, estimated by the
+		duration of the last block. At least one block is converted.
+		
+			Returns:
+				True if the conversion is done, the converted value is
+				in :attr:`result` then
+		
+			Raises:
+				the exception of the conversion, also on every call after
+				it failed"""
+		if self._error != None:
+			raise self._error[0], self._error[1], self._error[2]
+		if self.done:
+			return True
+		previous = getattr(_local, self._context_name, None)
+		setattr(_local, self._context_name, self._context)
+		try:
+			with self._registry:
+				start = last = _timer()
+				while True:
+					try:
+						self._steps.next()
+					except StopIteration:
+						self.done = True
+						self.result = self._finish(self._result[0])
+						return True
+					if self._slice_ms == None:
+						return False
+					now = _timer()
+					if (now - start + now - last) * 1000 > self._slice_ms:
+						return False
+					last = now
+		except:
+			self.done = True
+			self._error = sys.exc_info()
+			raise
+		finally:
+			setattr(_local, self._context_name, previous)
+	
+	def run(self):
+		"""converts the rest at once
+		
+			Returns:
+				the converted value"""
+		while not self.step():
+			pass
+		return self.result
+	
+	def __iter__(self):
+		while not self.step():
+			yield self
+
+def aflatit(obj, obj_type=None, compact=False, include=None, exclude=None,
+			binary=None, registry=None, slice_items=100, slice_ms=None):
+	"""flattens `obj` in slices for event loops, the nesting is walked like
+	``flatit(obj, iterative=True)``. Takes the arguments of :func:`flatit`
+	and
+	
+		Args:
+			slice_items: the number of schema objects, list items, dict
+				items and attributes converted in one slice (default=100)
 			
+			slice_ms: if set, the time budget of a slice in milliseconds,
+				blocks of `slice_items` values are converted while the next
+				one probably fits in the budget, see :meth:`SlicedTask.step`
+				(default=None)
+	
 		Returns:
-			an instance of type `cls`"""
-	return ConvertManager.to_obj(cls, flat_dict)
+			a :class:`SlicedTask`, the flat value is in its `result` when it
+			is done"""
+	if obj_type == None:
+		obj_type = type(obj)
+	context = _FlatContext(compact=compact, include=_compile_paths(include),
+						exclude=_compile_paths(exclude), binary=binary)
+	result = [None]
+	#the generator starts on the first step with the context set
+	steps = _flat_steps(obj_type, obj, result, max(1, slice_items))
+	return SlicedTask(steps, result, 'flat_context', context,
+					lambda flat: _add_fingerprint(obj_type, flat, compact),
+					slice_ms, registry)
+
+def aunflatit(cls, flat_dict, compact=False, include=None, binary=None,
+			registry=None, slice_items=100, slice_ms=None):
+	"""unflattens `flat_dict` in slices for event loops, see
+	:func:`aflatit`. Takes the arguments of :func:`unflatit`.
+	
+		Returns:
+			a :class:`SlicedTask`, the object is in its `result` when it is
+			done"""
+	if registry != None:
+		with registry:
+			flat_dict = _upgrade(cls, flat_dict, compact)
+	else:
+		flat_dict = _upgrade(cls, flat_dict, compact)
+	context = _ObjContext(compact=compact, include=_compile_paths(include),
+						binary=binary)
+	result = [None]
+	steps = _obj_steps(cls, flat_dict, result, max(1, slice_items))
+	return SlicedTask(steps, result, 'obj_context', context, lambda obj: obj,
+					slice_ms, registry)
+
+_OTHER, _SCHEMA, _LIST, _DICT = range(4)
+
+def _kind(val_type, registry=None):
+	"""returns `_SCHEMA`, `_LIST` or `_DICT` if the converter of `val_type`
+	in `registry` (default=None, the current registry) converts schema
+	objects, typed lists or typed dicts, otherwise `_OTHER`"""
+	if registry == None:
+		registry = ConvertManager.registry()
+	conv = registry.get_converter(val_type)
+	if conv == None:
+		return _OTHER
+	elif issubclass(conv, SchemaConverter):
+		return _SCHEMA
+	elif issubclass(conv, TypedListConverter):
+		return _LIST
+	elif issubclass(conv, TypedDictConverter):
+		return _DICT
+	return _OTHER
+
+def _converter_kinds():
+	"""returns a dict which caches `(converter, kind)` of the types for
+	one run of :func:`_flat_iterative` or :func:`_obj_iterative`"""
+	registry = ConvertManager.registry()
+	
+	class Kinds(dict):
+		def __missing__(self, val_type):
+			entry = registry.get_converter(val_type), _kind(val_type, registry)
+			self[val_type] = entry
+			return entry
+	return Kinds()
+
+def _flat_iterative(obj_type, obj):
+	"""flattens `obj` like the converters, but instead of calling
+	:func:`flatit` for nested values the values are put on a stack together
+	with the container and key of their flat value. Other converters than
+	the ones of schemas, typed lists and typed dicts are called as usual.
+	Conversion statistics are not recorded."""
+	result = [None]
+	for pause in _flat_steps(obj_type, obj, result, None):
+		pass
+	return result[0]
+
+def _flat_steps(obj_type, obj, result, slice_items):
+	"""generator of :func:`_flat_iterative` which pauses after every
+	`slice_items` values and pushed list or dict items and stores the flat
+	value in `result`"""
+	context = _local.flat_context
+	compact = context.compact
+	memo = context.memo
+	active = context.active
+	kinds = _converter_kinds()
+	#(container, key, type, value, include, exclude), the container None
+	#marks the end of the schema object with the id in key
+	stack = [(result, 0, obj_type, obj, context.include, context.exclude)]
+	pop = stack.pop
+	push = stack.append
+	count = 0
+	while stack:
+		count += 1
+		if count == slice_items:
+			yield count
+			count = 0
+		target, key, val_type, value, include, exclude = pop()
+		if target is None:
+			active.discard(key)
+			continue
+		conv, kind = kinds[val_type]
+		if conv == None:
+			target[key] = value
+		elif value is None:
+			#converters may map None like in the recursive conversion
+			target[key] = conv.to_flat(val_type, None)
+		elif kind == _SCHEMA:
+			if id(value) in active:
+				raise CycleError('Cycle detected while flattening ' + repr(value))
+			memo_key = (id(value), val_type, id(include), id(exclude))
+			entry = memo.get(memo_key)
+			if entry is not None and entry[0] is value:
+				target[key] = _copy_flat(entry[1])
+				continue
+			fields = val_type.__fields__.values()
+			if compact:
+				flat = [None] * len(fields)
+			else:
+				flat = {}
+			target[key] = flat
+			memo[memo_key] = (value, flat)
+			active.add(id(value))
+			push((None, id(value), None, None, None, None))
+			projected = include != None or exclude != None
+			child_include, child_exclude = include, exclude
+			index = -1
+			for attr_name, attr_type, default in fields:
+				index += 1
+				if projected:
+					projection = _project(include, exclude, attr_name)
+					if projection == None:
+						continue
+					child_include, child_exclude = projection
+				if compact:
+					slot = index
+				else:
+					slot = attr_name
+				attr_value = getattr(value, attr_name)
+				if _isclass(attr_value) and attr_value == attr_type:
+					attr_value = None
+				attr_conv = kinds[attr_type][0]
+				if attr_conv == None:
+					_check_type(attr_value, attr_type)
+					if attr_value is None:
+						flat[slot] = None
+						continue
+				else:
+					attr_conv.check_type(attr_type, attr_value)
+					if attr_value is None:
+						flat[slot] = attr_conv.to_flat(attr_type, None)
+						continue
+				push((flat, slot, attr_type, attr_value, child_include, child_exclude))
+		elif kind == _LIST:
+			conv.check_type(val_type, value)
+			if _has_primitive_ftype(val_type):
+				_check_primitive_items(val_type.ftype, value)
+				target[key] = list(value)
+				continue
+			flat = target[key] = [None] * len(value)
+			index = 0
+			for item in value:
+				check_type(val_type.ftype, item)
+				push((flat, index, type(item), item, include, exclude))
+				index += 1
+				count += 1
+				if count == slice_items:
+					yield count
+					count = 0
+		elif kind == _DICT:
+			conv.check_type(val_type, value)
+			if _has_primitive_ftype(val_type):
+				_check_primitive_items(val_type.ftype, value.values())
+				target[key] = dict(value)
+				continue
+			flat = target[key] = {}
+			for k, v in value.iteritems():
+				check_type(val_type.ftype, v)
+				push((flat, k, type(v), v, include, exclude))
+				count += 1
+				if count == slice_items:
+					yield count
+					count = 0
+		else:
+			target[key] = conv.to_flat(val_type, value)
+
+def _obj_iterative(cls, flat):
+	"""unflattens `flat` like the converters, see :func:`_flat_iterative`.
+	Objects are created and attached to their parent before their
+	attributes or items are set. Other values are converted with
+	:meth:`ConvertManager.to_obj`, which records converter statistics and
+	interns values, field statistics are not recorded."""
+	result = [None]
+	for pause in _obj_steps(cls, flat, result, None):
+		pass
+	return result[0]
+
+def _obj_steps(cls, flat, result, slice_items):
+	"""generator of :func:`_obj_iterative`, see :func:`_flat_steps`"""
+	context = _local.obj_context
+	compact = context.compact
+	kinds = _converter_kinds()
+	to_obj = ConvertManager.to_obj
+	#(container, key, type, flat value, include), the key None marks that
+	#the converted attributes in the dict at the place of the type can be
+	#set to the schema object in container
+	stack = [(result, 0, cls, flat, context.include)]
+	pop = stack.pop
+	push = stack.append
+	count = 0
+	while stack:
+		count += 1
+		if count == slice_items:
+			yield count
+			count = 0
+		target, key, val_type, val, include = pop()
+		if key is None:
+			for attr_name, attr_type, default in type(target).__fields__.values():
+				if attr_name in val_type:
+					value = val_type[attr_name]
+					attr_conv = kinds[attr_type][0]
+					if attr_conv == None:
+						_check_type(value, attr_type)
+					else:
+						attr_conv.check_type(attr_type, value)
+					setattr(target, attr_name, value)
+			continue
+		if val is None:
+			target[key] = to_obj(val_type, val)
+			continue
+		conv, kind = kinds[val_type]
+		if kind == _SCHEMA:
+			fields = val_type.__fields__.values()
+			if compact:
+				if not isinstance(val, list) or len(val) != len(fields):
+					raise TypeError('List with %d values expected for %s' % \
+									(len(fields), repr(val_type)))
+				val = dict(zip([field.name for field in fields], val))
+			obj = val_type()
+			attrs = {}
+			push((obj, None, attrs, None, None))
+			child_include = include
+			for attr_name, attr_type, default in fields:
+				if include != None:
+					projection = _project(include, None, attr_name)
+					if projection == None:
+						continue
+					child_include = projection[0]
+				if attr_name in val:
+					push((attrs, attr_name, attr_type, val[attr_name], child_include))
+		elif kind == _LIST:
+			if _has_primitive_ftype(val_type) and \
+				val_type.ftype not in ConvertManager._intern_types:
+				obj = val_type(val)
+			else:
+				obj = val_type([None] * len(val))
+				index = 0
+				for item in val:
+					push((obj, index, val_type.ftype, item, include))
+					index += 1
+					count += 1
+					if count == slice_items:
+						yield count
+						count = 0
+		elif kind == _DICT:
+			if _has_primitive_ftype(val_type) and \
+				val_type.ftype not in ConvertManager._intern_types:
+				obj = val_type(val)
+			else:
+				obj = val_type()
+				for k, v in val.iteritems():
+					push((obj, k, val_type.ftype, v, include))
+					count += 1
+					if count == slice_items:
+						yield count
+						count = 0
+		else:
+			obj = to_obj(val_type, val)
+		target[key] = obj
+
+def validate(cls, flat_dict):
+	"""checks if `flat_dict` can be unflattened to an instance of `cls`
+	without building any objects. The types of all values, the items of
+	:class:`TypedList` and :class:`TypedDict` attributes and the format of
+	date and time strings are checked. Keys which are not in the schema
+	are ignored like in :func:`unflatit`.
+	
+		>>> import flatty
+		>>> import datetime
+		>>> 
+		>>> class Bar(flatty.Schema):
+		...	 a_num = int
+		...	 a_day = datetime.date
+		...	 tags = flatty.TypedList.set_type(str)
+		...
+		>>> flatty.validate(Bar, {'a_num': 1, 'a_day': '2011-07-15', 'tags': ['x']})
+		[]
+		>>> sorted(flatty.validate(Bar, {'a_num': '1', 'a_day': '2011-13-01', 'tags': ['x', 2]}))
+		[('a_day', "'2011-13-01': month must be in 1..12"), ('a_num', "<type 'str'> != <type 'int'>"), ('tags.1', "<type 'int'> != <type 'str'>")]
+	
+		Args:
+			cls: the class into which `flat_dict` would be unflattened
+			
+			flat_dict: the flat data
+			
+		Returns:
+			a list of `(path, message)` tuples with all errors, empty if
+			`flat_dict` is valid. The path is the dotted path of the value,
+			list items are addressed by their index."""
+	if _is_schema(cls) and isinstance(flat_dict, dict):
+		from_fp = flat_dict.get(cls.__fingerprint_key__)
+		if from_fp != None and from_fp != fingerprint(cls):
+			try:
+				upgrade = MigrationManager.get_upgrade(cls, from_fp)
+			except SchemaVersionError, e:
+				return [('', str(e))]
+			flat_dict = upgrade(flat_dict)
+	errors = []
+	#pin the current registry, converters set meanwhile apply to later calls
+	with ConvertManager.registry():
+		_validate(cls, flat_dict, '', errors)
+	return errors
+
+def _validate(val_type, val, path, errors):
+	if val is None:
+		return
+	conv = ConvertManager.get_converter(val_type)
+	if conv != None:
+		conv.validate_flat(val_type, val, path, errors)
+		return
+	try:
+		_check_type(val, val_type)
+	except TypeError, e:
+		errors.append((path, str(e)))
+
+def _join_path(path, name):
+	if path == '':
+		return '%s' % name
+	return '%s.%s' % (path, name)
+
+def _is_schema(cls):
+	return _isclass(cls) and issubclass(cls, Schema)
+
+_fingerprint_cache = weakref.WeakKeyDictionary()
+
+def fingerprint(schema_cls):
+	"""returns a fingerprint of the structure of a schema class. The
+	fingerprint changes if attributes are added, removed, renamed or their
+	types change, also in nested schemas. Renaming schema classes doesn't
+	change the fingerprint.
+	
+		Args:
+			schema_cls: a subclass of :class:`Schema`
+	
+		Returns:
+			a string with 16 hex digits"""
+	fp = _fingerprint_cache.get(schema_cls)
+	if fp == None:
+		signature = _type_signature(schema_cls, [])
+		fp = hashlib.sha1(signature).hexdigest()[:16]
+		_fingerprint_cache[schema_cls] = fp
+	return fp
+	
+def _type_signature(val_type, parents):
+	conv = ConvertManager.get_converter(val_type)
+	if conv != None and issubclass(conv, SchemaConverter):
+		if val_type in parents:
+			#recursive schema, reference the parent by its depth
+			return '@%d' % parents.index(val_type)
+		parents = parents + [val_type]
+		return '{' + ','.join([attr_name + ':' + \
+						_type_signature(attr_type, parents) \
+						for attr_name, attr_type, default in val_type.__fields__.values()]) + '}'
+	if conv != None and issubclass(conv, TypedListConverter):
+		return '[' + _type_signature(val_type.ftype, parents) + ']'
+	if conv != None and issubclass(conv, TypedDictConverter):
+		return '<' + _type_signature(val_type.ftype, parents) + '>'
+	if val_type == None:
+		return '*'
+	return getattr(val_type, '__module__', '') + '.' + \
+			getattr(val_type, '__name__', repr(val_type))
+
+def content_hash(flat):
+	"""returns a hash of the content of a flattened object. Dicts with the
+	same items have the same hash, independent of their order. str and
+	unicode strings with the same (UTF-8 encoded) content are equal.
+	
+		Args:
+			flat: the result of :func:`flatit` or a loaded document
+	
+		Returns:
+			a string with 40 hex digits"""
+	digest = hashlib.sha1()
+	_hash_flat(digest.update, flat)
+	return digest.hexdigest()
+
+def _hash_flat(update, flat):
+	if isinstance(flat, basestring):
+		if isinstance(flat, unicode):
+			flat = flat.encode('utf-8')
+		update('s%d:' % len(flat))
+		update(flat)
+	elif isinstance(flat, dict):
+		update('d%d:' % len(flat))
+		#str and unicode keys can't be compared, they are sorted like they
+		#are hashed
+		for key, value in sorted(flat.items(), key=_hash_order):
+			_hash_flat(update, key)
+			_hash_flat(update, value)
+	elif isinstance(flat, (list, tuple)):
+		update('l%d:' % len(flat))
+		for item in flat:
+			_hash_flat(update, item)
+	else:
+		#None, numbers and values of the database, e.g. ids
+		value = repr(flat)
+		update('%s%d:' % (type(flat).__name__, len(value)))
+		update(value)
+
+def _hash_order(item):
+	key = item[0]
+	if isinstance(key, unicode):
+		return key.encode('utf-8')
+	return key
+
+def _skip_store(doc, flat, session=None, key=None):
+	"""returns True if the store of `doc` can be skipped because
+	`__skip_unchanged__` is set and `flat` has the content hash of the
+	document when it was loaded or stored last. Documents queued in the
+	write-behind `session` are always stored, the queued version differs."""
+	if not doc.__skip_unchanged__ or doc.__content_hash__ == None:
+		return False
+	if session != None and key in session:
+		return False
+	return content_hash(flat) == doc.__content_hash__
+
+class WriteBehindError(Exception):
+	"""
+	Raised by :meth:`WriteBehindSession.flush` if documents couldn't be
+	written. The other documents of the flush are written.
+	
+		Attributes:
+			errors: a list of `(doc, exception)` tuples
+	
+	"""
+	def __init__(self, errors):
+		Exception.__init__(self, '%d documents could not be written: %s' % \
+						(len(errors), ', '.join([repr(error) for doc, error \
+												in errors[:3]])))
+		self.errors = errors
+
+class WriteBehindSession(object):
+	"""
+	Base class of the write-behind sessions of the database adapters, e.g.
+	:class:`flatty.mongo.WriteBehindSession`. Within a ``with`` statement
+	the adapters don't write stored documents right away but queue their
+	flat form in the session. Repeated stores of the same document replace
+	the queued version, the queue is written in bulk when it holds
+	`max_docs` documents, when the oldest queued store is older than
+	`max_delay` seconds (checked on every store) and at the end of the
+	``with`` statement. If the ``with`` block raises, errors of this last
+	write are ignored and its exception is raised. Documents stay queued if
+	:meth:`_write` raises.
+	
+	Subclasses implement :meth:`_write`. Sessions are active in the thread
+	which entered them.
+	
+		Args:
+			db: the database the documents are stored in
+			
+			max_docs: the number of queued documents which are written
+				together (default=100)
+			
+			max_delay: the seconds after which the queued documents are
+				written on the next store (default=None, no limit)
+			
+			on_error: a callable which is called with `doc, exception` of
+				every document which couldn't be written (default=None,
+				:meth:`flush` raises :class:`WriteBehindError`)
+	
+	"""
+	def __init__(self, db, max_docs=100, max_delay=None, on_error=None):
+		self.db = db
+		self.max_docs = max_docs
+		self.max_delay = max_delay
+		self.on_error = on_error
+		self._queue = collections.OrderedDict()
+		self._since = None
+	
+	@classmethod
+	def current(cls, db):
+		"""returns the innermost active session of this class for `db` in
+		the current thread or None"""
+		for session in reversed(getattr(_local, 'write_behind', ())):
+			if isinstance(session, cls) and session.db is db:
+				return session
+		return None
+	
+	def queue(self, key, doc, flat, state=None):
+		"""queues the flat form of `doc`. A queued document with the same
+		`key` is replaced, its `state` is kept.
+		
+			Args:
+				key: the key of the document, e.g. its id
+				
+				doc: the stored object
+				
+				flat: the flat form of `doc`
+				
+				state: data of the adapter about the stored version of the
+					document, e.g. the revision (default=None)"""
+		entry = self._queue.get(key)
+		if entry == None:
+			self._queue[key] = [flat, [doc], state]
+		else:
+			entry[0] = flat
+			if not [queued for queued in entry[1] if queued is doc]:
+				entry[1].append(doc)
+		if self._since == None:
+			self._since = _timer()
+		if len(self._queue) >= self.max_docs or (self.max_delay != None and \
+				_timer() - self._since >= self.max_delay):
+			self.flush()
+	
+	def __len__(self):
+		return len(self._queue)
+	
+	def __contains__(self, key):
+		return key in self._queue
+	
+	def flush(self):
+		"""writes the queued documents
+		
+			Raises:
+				WriteBehindError: if documents couldn't be written and the
+				session has no `on_error` callable"""
+		entries = self._queue.items()
+		if not entries:
+			self._since = None
+			return
+		errors = self._write(entries)
+		#the entries stay queued if _write raises
+		for key, entry in entries:
+			if self._queue.get(key) is entry:
+				del self._queue[key]
+		if not self._queue:
+			self._since = None
+		if errors and self.on_error != None:
+			for doc, error in errors:
+				self.on_error(doc, error)
+		elif errors:
+			raise WriteBehindError(errors)
+	
+	def _write(self, entries):
+		"""needs to be implemented to write the documents
+		
+			Args:
+				entries: a list of `(key, [flat, docs, state])` items in the
+					order the documents were first stored, `docs` are the
+					objects stored under `key`
+			
+			Returns:
+				a list of `(doc, exception)` tuples of the documents which
+				couldn't be written"""
+		raise NotImplementedError()
+	
+	def __enter__(self):
+		stack = getattr(_local, 'write_behind', None)
+		if stack == None:
+			stack = _local.write_behind = []
+		stack.append(self)
+		return self
 	
+	def __exit__(self, exc_type, exc_value, traceback):
+		_local.write_behind.remove(self)
+		if exc_type == None:
+			self.flush()
+			return
+		#the queued documents are still written, but errors don't replace
+		#the exception of the with block
+		try:
+			self.flush()
+		except Exception:
+			pass
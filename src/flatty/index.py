@@ -0,0 +1,206 @@
+"""
+This module provides in-process indexes over collections of schema
+objects. The indexed attributes are declared in the schema with
+`__indexes__`, dotted paths index attributes of nested objects.
+
+	>>> import flatty
+	>>> import flatty.index
+	>>> import datetime
+	>>>
+	>>> class User(flatty.Schema):
+	...	 __indexes__ = ['email', 'created.year']
+	...	 email = str
+	...	 created = datetime.date
+	...
+	>>> users = flatty.index.IndexManager(User)
+	>>> key = users.add(User(email='john@example.com', created=datetime.date(2011, 7, 15)))
+	>>> key = users.add(User(email='jane@example.com', created=datetime.date(2012, 1, 13)))
+	>>> [user.email for user in users.find_by('created.year', 2012)]
+	['jane@example.com']
+	>>> [user.email for user in users.find_range('email', 'i', 'k')]
+	['jane@example.com', 'john@example.com']
+
+=======
+Classes
+=======
+"""
+import bisect
+import itertools
+import flatty
+import binary
+
+class IndexManager(object):
+	"""
+	Maintains a hash index and a sorted index for every indexed attribute
+	of the objects added to it. Objects are identified by a key, which is
+	the `_id` of documents or a generated number.
+
+	The indexes are updated when objects are added or removed. If an object
+	is changed while it is in the manager, call :meth:`update`.
+
+	Args:
+		schema_cls: the schema class of the objects
+
+		fields: the indexed attributes, by default the `__indexes__` of
+			`schema_cls`
+	"""
+
+	def __init__(self, schema_cls, fields=None):
+		if fields == None:
+			fields = schema_cls.__indexes__
+		for field in fields:
+			if field.split('.')[0] not in schema_cls.__fields__:
+				raise AttributeError('%s has no attribute %s' % (repr(schema_cls), field))
+		self.schema_cls = schema_cls
+		self.fields = list(fields)
+		self._objects = {}
+		self._values = {}
+		self._hashed = dict([(field, {}) for field in self.fields])
+		self._sorted = dict([(field, ([], [])) for field in self.fields])
+		self._counter = itertools.count()
+
+	def add(self, obj, key=None):
+		"""adds `obj` to the indexes
+
+		Args:
+			obj: an instance of the schema class
+
+			key: the key of `obj`, by default the `_id` of `obj` if it has
+				one, otherwise a generated number
+
+		Returns:
+			the key of `obj`"""
+		if key == None:
+			key = getattr(obj, '_id', None)
+			if key == None or isinstance(key, type):
+				key = self._counter.next()
+		if key in self._objects:
+			self.remove(key)
+		values = {}
+		for field in self.fields:
+			values[field] = _resolve(obj, field)
+		self._insert(key, obj, values)
+		return key
+
+	def remove(self, key):
+		"""removes the object with `key` from the indexes
+
+		Raises:
+			KeyError: if no object with `key` exists"""
+		values = self._values.pop(key)
+		del self._objects[key]
+		for field, value in values.items():
+			value = _hashable(value)
+			keys = self._hashed[field][value]
+			keys.discard(key)
+			if len(keys) == 0:
+				del self._hashed[field][value]
+			if value != None:
+				sorted_values, sorted_keys = self._sorted[field]
+				start = bisect.bisect_left(sorted_values, value)
+				end = bisect.bisect_right(sorted_values, value)
+				pos = sorted_keys.index(key, start, end)
+				del sorted_values[pos]
+				del sorted_keys[pos]
+
+	def update(self, key):
+		"""updates the indexes of the object with `key` after it was
+		changed"""
+		self.add(self._objects[key], key)
+
+	def get(self, key):
+		"""returns the object with `key`"""
+		return self._objects[key]
+
+	def find_by(self, field, value):
+		"""returns a list of all objects with `value` in the indexed
+		attribute `field`"""
+		keys = self._hashed[field].get(_hashable(value), ())
+		return [self._objects[key] for key in keys]
+
+	def find_range(self, field, low=None, high=None):
+		"""returns a list of all objects where the value of the indexed
+		attribute `field` is between `low` and `high` (both inclusive),
+		ordered by the value. None values are not included.
+
+		Args:
+			field: an indexed attribute
+
+			low: the lower bound or None for no lower bound
+
+			high: the upper bound or None for no upper bound"""
+		sorted_values, sorted_keys = self._sorted[field]
+		start = 0
+		end = len(sorted_values)
+		if low != None:
+			start = bisect.bisect_left(sorted_values, low)
+		if high != None:
+			end = bisect.bisect_right(sorted_values, high)
+		return [self._objects[key] for key in sorted_keys[start:end]]
+
+	def __len__(self):
+		return len(self._objects)
+
+	def __iter__(self):
+		return iter(self._objects)
+
+	def dump(self):
+		"""returns the indexes as string to persist them next to the
+		objects, e.g. as record of a :class:`flatty.store.Store`"""
+		return binary.dumps_plain([self.fields, self._values])
+
+	@classmethod
+	def load(cls, schema_cls, data, objects):
+		"""restores an :class:`IndexManager` without reading the indexed
+		attributes of the objects again
+
+		Args:
+			schema_cls: the schema class of the objects
+
+			data: the string returned by :meth:`dump`
+
+			objects: a dict mapping the keys to the objects
+
+		Returns:
+			the :class:`IndexManager`"""
+		fields, values = binary.loads_plain(data)
+		manager = cls(schema_cls, fields)
+		for key, obj in objects.items():
+			manager._insert(key, obj, values[key])
+		if len(objects) > 0:
+			numbers = [key for key in objects if isinstance(key, (int, long))]
+			if len(numbers) > 0:
+				manager._counter = itertools.count(max(numbers) + 1)
+		return manager
+
+	def _insert(self, key, obj, values):
+		self._objects[key] = obj
+		self._values[key] = values
+		for field, value in values.items():
+			value = _hashable(value)
+			self._hashed[field].setdefault(value, set()).add(key)
+			if value != None:
+				sorted_values, sorted_keys = self._sorted[field]
+				pos = bisect.bisect_right(sorted_values, value)
+				sorted_values.insert(pos, value)
+				sorted_keys.insert(pos, key)
+
+def _resolve(obj, path):
+	for name in path.split('.'):
+		if obj == None:
+			return None
+		obj = getattr(obj, name)
+		if isinstance(obj, type):
+			#attribute is not set
+			return None
+		if callable(obj) and not isinstance(obj, flatty.Schema):
+			#e.g. 'created.date' of a datetime
+			obj = obj()
+	return obj
+
+def _hashable(value):
+	if isinstance(value, list):
+		return tuple([_hashable(item) for item in value])
+	if isinstance(value, dict):
+		return tuple(sorted([(k, _hashable(v)) for k, v in value.items()]))
+	return value
@@ -1,11 +1,21 @@
 """
+Stores of documents can be queued and written in bulk with a
+:class:`WriteBehindSession`::
+
+	with flatty.mongo.WriteBehindSession(db, max_docs=500):
+		for event in events:
+			counter.count += 1
+			counter.store(db)
 
 =======
 Classes
 =======
 """
+import collections
 import flatty
+from bson import BSON
 from bson.objectid import ObjectId
+from bson.binary import Binary
 
 class Document(flatty.Schema):
 	"""
@@ -16,9 +26,20 @@ class Document(flatty.Schema):
 		to define string attributes of type basestring (which is the parent 
 		class of str and unicode class). Otherwise flatty will
 		raise a TypeError (<type 'str'> != <type 'unicode'>) 
+	
+	Attributes of type buffer, memoryview and bytearray are stored as BSON
+	binary data.
+	
+	If `__skip_unchanged__` is True, :meth:`store` doesn't write the
+	document if its flat form has the same :func:`flatty.content_hash` as
+	when it was loaded or stored last. `__written__` tells if the last
+	store wrote (or queued) the document.
 	"""
 	__collection__ = None
 	__old_doc__ = None
+	__skip_unchanged__ = False
+	__content_hash__ = None
+	__written__ = None
 	_id = ObjectId
 	
 	def store(self, db):
@@ -26,6 +47,9 @@ class Document(flatty.Schema):
 		Only saves the document if it wasn't changed in the meantime otherwise
 		*UpdateFailedError* Exception is raised
 	
+		Within a :class:`WriteBehindSession` for `db` the document is only
+		queued, new documents get their id right away.
+	
 		Args:
 			db: should must be a pymongo ''Database'' object
 			
@@ -35,12 +59,27 @@ class Document(flatty.Schema):
 		"""
 		error = None
 		
-		flattened =  self.flatit()
-		if self._id == ObjectId:
-			del flattened['_id']
+		flattened =  self.flatit(binary=Binary)
 		
 		if self.__collection__ == None:
 			self.__collection__ = self.__class__.__name__.lower()
+		
+		session = WriteBehindSession.current(db)
+		if flatty._skip_store(self, flattened, session,
+							(self.__collection__, self._id)):
+			self.__written__ = False
+			return self._id
+		self.__written__ = True
+		
+		if session != None:
+			if self._id == ObjectId:
+				self._id = flattened['_id'] = ObjectId()
+			session.queue((self.__collection__, self._id), self, flattened,
+						self.__old_doc__)
+			return self._id
+		
+		if self._id == ObjectId:
+			del flattened['_id']
 			
 		if self.__old_doc__ == None:
 			id = db[self.__collection__].save(flattened, safe=True, manipulate=True)
@@ -51,6 +90,9 @@ class Document(flatty.Schema):
 		if error != None and 'updatedExisting' in error \
 			and error['updatedExisting'] == False:
 			raise UpdateFailedError('Document in db is newer than the document for storing')
+		if self.__skip_unchanged__:
+			flattened['_id'] = self._id
+			self.__content_hash__ = flatty.content_hash(flattened)
 		return self._id
 
 	
@@ -70,12 +112,72 @@ class Document(flatty.Schema):
 			cls.__collection__ = cls.__name__.lower()
 		doc = db[cls.__collection__].find_one({'_id':id})
 		
-		obj = cls.unflatit(doc)
+		obj = cls.unflatit(doc, binary=Binary)
 		obj.__old_doc__ =  doc
+		if cls.__skip_unchanged__:
+			obj.__content_hash__ = flatty.content_hash(doc)
 		
 		
 		return obj
 		
+class WriteBehindSession(flatty.WriteBehindSession):
+	"""
+	Queues the stores of :class:`Document` objects in `db` and writes them
+	with one unordered bulk operation per collection, see
+	:class:`flatty.WriteBehindSession` for the arguments. Documents which
+	were loaded are only replaced if they weren't changed in the meantime,
+	otherwise *UpdateFailedError* is reported for them. The bulk operations
+	need pymongo 2.7 or newer.
+	
+	"""
+	def _write(self, entries):
+		#bulk operations need pymongo 2.7, Document works with older versions
+		from pymongo.errors import BulkWriteError, OperationFailure
+		groups = collections.OrderedDict()
+		for key, entry in entries:
+			groups.setdefault(key[0], []).append((key[1], entry))
+		errors = []
+		for collection, group in groups.items():
+			bulk = self.db[collection].initialize_unordered_bulk_op()
+			for id, (flat, docs, old_doc) in group:
+				if old_doc == None:
+					bulk.find({'_id':id}).upsert().replace_one(flat)
+				else:
+					bulk.find(old_doc).replace_one(flat)
+			try:
+				result = bulk.execute()
+			except BulkWriteError, e:
+				result = e.details
+			failed = {}
+			for error in result['writeErrors']:
+				failed[error['index']] = OperationFailure(error['errmsg'],
+														error['code'])
+			
+			#the stored version of written documents, as they are compared
+			#in the next update
+			written = dict([(id, BSON.encode(flat).decode()) for id, (flat, docs, old_doc) \
+							in group])
+			if result['nMatched'] + result['nUpserted'] < len(group) - len(failed):
+				#some loaded documents were changed in the meantime
+				ids = [id for index, (id, entry) in enumerate(group) \
+						if entry[2] != None and index not in failed]
+				current = dict([(doc['_id'], doc) for doc in \
+								self.db[collection].find({'_id':{'$in':ids}})])
+				for index, (id, entry) in enumerate(group):
+					if id in ids and current.get(id) != written[id]:
+						failed[index] = UpdateFailedError('Document in db is newer '
+												'than the document for storing')
+			
+			for index, (id, (flat, docs, old_doc)) in enumerate(group):
+				if index in failed:
+					errors.extend([(doc, failed[index]) for doc in docs])
+				else:
+					for doc in docs:
+						doc.__old_doc__ = written[id]
+						if doc.__skip_unchanged__:
+							doc.__content_hash__ = flatty.content_hash(written[id])
+		return errors
+	
 class UpdateFailedError(Exception):
 	pass
 	
\ No newline at end of file
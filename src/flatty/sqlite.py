@@ -0,0 +1,279 @@
+"""
+This module stores flatty documents in SQLite databases. Every document
+class has its own table with one row per document. The flattened document
+is stored as JSON, attributes listed in `__indexes__` get generated columns
+with an index.
+
+	>>> import flatty
+	>>> import flatty.sqlite
+	>>> import sqlite3
+	>>>
+	>>> class Person(flatty.sqlite.Document):
+	...	 __indexes__ = ['name']
+	...	 name = basestring
+	...	 age = int
+	...
+	>>> db = sqlite3.connect(':memory:')
+	>>> person = Person(name='John Doe', age=42)
+	>>> id, rev = person.store(db)
+	>>> rev
+	1
+	>>> Person.load(db, id).name
+	u'John Doe'
+	>>> [person.age for person in Person.find_by(db, 'name', 'John Doe')]
+	[42]
+
+**IMPORTANT**:
+	The json module returns strings as unicode, so string attributes
+	should be of type basestring or unicode like in :mod:`flatty.mongo`.
+
+=======
+Classes
+=======
+"""
+import json
+import uuid
+import sqlite3
+import flatty
+
+#generated columns are supported since SQLite 3.31.0
+_generated_columns = sqlite3.sqlite_version_info >= (3, 31, 0)
+
+#stay below the default SQLITE_MAX_VARIABLE_NUMBER of old versions
+_batch_size = 500
+
+#(id(db), table, indexes) of the tables create_table has already set up.
+#sqlite3 connections can't be weakly referenced, so the entries are keyed
+#by id and a reused id of a closed connection is detected by
+#_recreate_table
+_created = set()
+
+class Document(flatty.Schema):
+	"""
+	This class is the base Class for all SQLite documents. The documents
+	are stored in the table `__table__`, by default the lower case class
+	name. The table is created on first use.
+
+	Documents have a revision `_rev` which is increased on every store.
+	A document is only stored if the revision in the database is the one
+	the document was loaded with, otherwise *UpdateFailedError* is raised.
+	"""
+	__table__ = None
+	_id = unicode
+	_rev = int
+
+	def store(self, db):
+		"""stores the document in the database
+
+		Args:
+			db: a sqlite3 ``Connection`` object
+
+		Returns:
+			returns a tuple `id, rev`. `id` is the document id which stays
+			the same over time. `rev` changes on every store.
+		"""
+		return self.store_many(db, [self])[0]
+
+	@classmethod
+	def store_many(cls, db, docs):
+		"""stores all `docs` in one transaction. If one of the documents
+		can't be stored, none of them is stored.
+
+		Args:
+			db: a sqlite3 ``Connection`` object
+
+			docs: a list of instances of this class
+
+		Returns:
+			a list of `id, rev` tuples
+		"""
+		cls._ensure_table(db)
+		try:
+			results = cls._store_batch(db, docs)
+		except sqlite3.OperationalError, e:
+			#the batch was rolled back, the table is created outside of it
+			if not cls._recreate_table(db, e):
+				raise
+			results = cls._store_batch(db, docs)
+
+		#only change the documents when the transaction was committed
+		for doc, (id, rev) in zip(docs, results):
+			doc._id, doc._rev = id, rev
+		return results
+
+	@classmethod
+	def _store_batch(cls, db, docs):
+		table = cls._table()
+		results = []
+		with db:
+			for doc in docs:
+				id = doc._id
+				if id == unicode or id == None:
+					id = unicode(uuid.uuid4().hex)
+				data = doc._dumps()
+				if doc._rev == int or doc._rev == None:
+					rev = 1
+					try:
+						db.execute('INSERT INTO "%s" (id, rev, data) VALUES (?, ?, ?)' \
+								% table, (id, rev, data))
+					except sqlite3.IntegrityError:
+						raise UpdateFailedError('Document %s already exists' % id)
+				else:
+					rev = doc._rev + 1
+					cursor = db.execute('UPDATE "%s" SET rev = ?, data = ? ' \
+									'WHERE id = ? AND rev = ?' % table,
+									(rev, data, id, doc._rev))
+					if cursor.rowcount == 0:
+						raise UpdateFailedError('Document in db is newer than the '
+												'document for storing')
+				results.append((id, rev))
+		return results
+
+	@classmethod
+	def load(cls, db, id):
+		"""loads the document from the database
+
+		Args:
+			db: a sqlite3 ``Connection`` object
+
+			id: the document id
+
+		Returns:
+			returns the object
+
+		Raises:
+			KeyError: if no document with `id` exists
+		"""
+		doc = cls.load_many(db, [id])[0]
+		if doc == None:
+			raise KeyError(id)
+		return doc
+
+	@classmethod
+	def load_many(cls, db, ids):
+		"""loads the documents with the given ids
+
+		Args:
+			db: a sqlite3 ``Connection`` object
+
+			ids: a list of document ids
+
+		Returns:
+			a list with the objects in the order of `ids`, None for ids
+			which don't exist
+		"""
+		cls._ensure_table(db)
+		rows = {}
+		for i in range(0, len(ids), _batch_size):
+			batch = ids[i:i + _batch_size]
+			cursor = cls._execute(db, 'SELECT id, rev, data FROM "%s" WHERE id IN (%s)' \
+								% (cls._table(), ', '.join(['?'] * len(batch))), batch)
+			for row in cursor:
+				rows[row[0]] = row
+		return [cls._loads(rows[id]) if id in rows else None for id in ids]
+
+	@classmethod
+	def find_by(cls, db, field, value):
+		"""returns all documents where the indexed attribute `field` has the
+		flat `value`
+
+		Args:
+			db: a sqlite3 ``Connection`` object
+
+			field: an attribute listed in `__indexes__`
+
+			value: the flattened value, e.g. the isoformat of a date
+		"""
+		if field not in cls.__indexes__:
+			raise AttributeError('%s is not indexed' % field)
+		cls._ensure_table(db)
+		if _generated_columns:
+			column = _column(field)
+		else:
+			column = "json_extract(data, '$.%s')" % field
+		cursor = cls._execute(db, 'SELECT id, rev, data FROM "%s" WHERE %s = ?' \
+							% (cls._table(), column), (value,))
+		return [cls._loads(row) for row in cursor]
+
+	@classmethod
+	def create_table(cls, db):
+		"""creates the table and the indexes for this class if they don't
+		exist yet. Generated columns of attributes which were added to
+		`__indexes__` after the table was created are added to the table.
+		The methods of the documents call it once per connection and class."""
+		table = cls._table()
+		columns = ['id TEXT PRIMARY KEY', 'rev INTEGER NOT NULL', 'data TEXT NOT NULL']
+		generated = []
+		if _generated_columns:
+			for field in cls.__indexes__:
+				generated.append((_column(field),
+								"%s GENERATED ALWAYS AS (json_extract(data, '$.%s')) VIRTUAL" \
+								% (_column(field), field)))
+		with db:
+			db.execute('CREATE TABLE IF NOT EXISTS "%s" (%s)' \
+					% (table, ', '.join(columns + [column for name, column in generated])))
+			#table_info doesn't list generated columns, table_xinfo does
+			existing = set(row[1] for row in db.execute('PRAGMA table_xinfo("%s")' % table))
+			for name, column in generated:
+				if name not in existing:
+					db.execute('ALTER TABLE "%s" ADD COLUMN %s' % (table, column))
+				db.execute('CREATE INDEX IF NOT EXISTS "%s_%s" ON "%s" (%s)' \
+						% (table, name, table, name))
+		_created.add(cls._created_key(db))
+
+	@classmethod
+	def _ensure_table(cls, db):
+		#the DDL commits pending transactions, so it only runs on first use
+		if cls._created_key(db) not in _created:
+			cls.create_table(db)
+
+	@classmethod
+	def _created_key(cls, db):
+		return id(db), cls._table(), tuple(cls.__indexes__)
+
+	@classmethod
+	def _execute(cls, db, sql, params):
+		try:
+			return db.execute(sql, params)
+		except sqlite3.OperationalError, e:
+			if not cls._recreate_table(db, e):
+				raise
+			return db.execute(sql, params)
+
+	@classmethod
+	def _recreate_table(cls, db, error):
+		"""creates the table again and returns True if `error` is caused by
+		a missing table which is in _created. A new connection may have the
+		id of a closed one. Must not be called in a transaction, the DDL
+		commits it."""
+		key = cls._created_key(db)
+		if key not in _created or not str(error).startswith('no such table'):
+			return False
+		_created.discard(key)
+		cls.create_table(db)
+		return True
+
+	@classmethod
+	def _table(cls):
+		if cls.__table__ == None:
+			return cls.__name__.lower()
+		return cls.__table__
+
+	def _dumps(self):
+		flattened = self.flatit()
+		del flattened['_id']
+		del flattened['_rev']
+		return json.dumps(flattened)
+
+	@classmethod
+	def _loads(cls, row):
+		flattened = json.loads(row[2])
+		flattened['_id'] = row[0]
+		flattened['_rev'] = row[1]
+		return cls.unflatit(flattened)
+
+def _column(field):
+	return 'idx_' + field.replace('.', '__')
+
+class UpdateFailedError(Exception):
+	pass
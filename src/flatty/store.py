@@ -0,0 +1,290 @@
+"""
+This module provides a local, dependency free record store for flatty
+schemas. Documents are encoded with :mod:`flatty.binary` and appended to
+segment files in a directory. An in-memory index maps the document ids to
+the position of the records and reads go through `mmap`, so no file reads
+are needed to access a record.
+
+	>>> import flatty
+	>>> import flatty.store
+	>>> import tempfile
+	>>>
+	>>> class Person(flatty.store.Document):
+	...	 name = unicode
+	...	 age = int
+	...
+	>>> db = flatty.store.Store(tempfile.mkdtemp())
+	>>> person = Person(name=u'John Doe', age=42)
+	>>> id = person.store(db)
+	>>> Person.load(db, id).name
+	u'John Doe'
+	>>> db.close()
+
+The store is not thread-safe and must only be opened by one process at a
+time.
+
+=======
+Classes
+=======
+"""
+import os
+import mmap
+import struct
+import marshal
+import uuid
+import flatty
+import binary
+
+_header = struct.Struct('>BII')
+_RECORD = 0
+_TOMBSTONE = 1
+
+_SEGMENT_NAME = 'segment-%06d.dat'
+_INDEX_NAME = 'index'
+
+class Store(object):
+	"""
+	An append-only record store in a directory. Records are byte strings
+	identified by an id (a unicode or str).
+
+	Updating or deleting a record appends a new record, the space of the
+	old record is freed by :meth:`compact`.
+
+	Args:
+		path: the directory of the store, it is created if it not exists
+
+		segment_size: a new segment file is started when the current one
+			exceeds this number of bytes (default=64MB)
+	"""
+
+	def __init__(self, path, segment_size=64 * 1024 * 1024):
+		self.path = path
+		self.segment_size = segment_size
+		if not os.path.isdir(path):
+			os.makedirs(path)
+		self._index = {}
+		self._maps = {}
+		self._file = None
+		self._open()
+
+	def put(self, id, data):
+		"""stores `data` under `id`, replaces an existing record"""
+		key = _encode_id(id)
+		self._append(_RECORD, key, data)
+
+	def get(self, id):
+		"""returns the record stored under `id`
+
+		Returns:
+			a read-only buffer referencing the mapped segment file. The
+			mapping is kept until the buffer is released, also if the store
+			is compacted or closed.
+
+		Raises:
+			KeyError: if no record with `id` exists"""
+		segment, offset, length = self._index[_encode_id(id)]
+		return buffer(self._map(segment, offset + length), offset, length)
+
+	def delete(self, id):
+		"""deletes the record stored under `id`
+
+		Raises:
+			KeyError: if no record with `id` exists"""
+		key = _encode_id(id)
+		if key not in self._index:
+			raise KeyError(id)
+		self._append(_TOMBSTONE, key, '')
+
+	def __contains__(self, id):
+		return _encode_id(id) in self._index
+
+	def __len__(self):
+		return len(self._index)
+
+	def keys(self):
+		"""returns the ids of all records"""
+		return [key.decode('utf-8') for key in self._index]
+
+	def compact(self):
+		"""rewrites all live records to new segments and removes the old
+		segments. Buffers returned by :meth:`get` keep the old data."""
+		old_segments = self._segments()
+		live = sorted(self._index.items(), key=lambda item: item[1])
+		self._start_segment(old_segments[-1] + 1)
+		for key, (segment, offset, length) in live:
+			data = self._map(segment, offset + length)[offset:offset + length]
+			self._append(_RECORD, key, data)
+
+		self._close_maps()
+		for segment in old_segments:
+			os.remove(self._segment_path(segment))
+		self._write_index()
+
+	def close(self):
+		"""writes the index and closes all files"""
+		if self._file != None:
+			self._write_index()
+			self._file.close()
+			self._file = None
+		self._close_maps()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def _segments(self):
+		segments = []
+		for name in os.listdir(self.path):
+			if name.startswith('segment-') and name.endswith('.dat'):
+				segments.append(int(name[8:-4]))
+		return sorted(segments)
+
+	def _segment_path(self, segment):
+		return os.path.join(self.path, _SEGMENT_NAME % segment)
+
+	def _open(self):
+		segments = self._segments()
+		sizes = {}
+		index_path = os.path.join(self.path, _INDEX_NAME)
+		if os.path.exists(index_path):
+			with open(index_path, 'rb') as f:
+				sizes, self._index = marshal.load(f)
+			for segment, size in sizes.items():
+				if segment not in segments or \
+					os.path.getsize(self._segment_path(segment)) < size:
+					#index doesn't match the segments, rebuild it
+					sizes = {}
+					self._index = {}
+					break
+
+		#only scan what was appended after the index was written
+		for segment in segments:
+			self._scan(segment, sizes.get(segment, 0))
+		if len(segments) == 0:
+			self._start_segment(0)
+		else:
+			self._start_segment(segments[-1])
+
+	def _scan(self, segment, offset):
+		path = self._segment_path(segment)
+		size = os.path.getsize(path)
+		with open(path, 'rb') as f:
+			f.seek(offset)
+			while offset + _header.size <= size:
+				flag, key_length, length = _header.unpack(f.read(_header.size))
+				data_offset = offset + _header.size + key_length
+				if data_offset + length > size:
+					#torn record of an interrupted write
+					break
+				key = f.read(key_length)
+				if flag == _TOMBSTONE:
+					self._index.pop(key, None)
+				else:
+					self._index[key] = (segment, data_offset, length)
+				offset = data_offset + length
+				f.seek(offset)
+		if offset < size:
+			#drop the incomplete tail, new records are appended after the
+			#last complete one
+			with open(path, 'r+b') as f:
+				f.truncate(offset)
+
+	def _start_segment(self, segment):
+		if self._file != None:
+			self._file.close()
+		self._segment = segment
+		self._file = open(self._segment_path(segment), 'ab')
+		self._file.seek(0, os.SEEK_END)
+		self._size = self._file.tell()
+
+	def _append(self, flag, key, data):
+		length = _header.size + len(key) + len(data)
+		if self._size > 0 and self._size + length > self.segment_size:
+			self._start_segment(self._segment + 1)
+		self._file.write(_header.pack(flag, len(key), len(data)))
+		self._file.write(key)
+		self._file.write(data)
+		self._file.flush()
+		if flag == _TOMBSTONE:
+			del self._index[key]
+		else:
+			self._index[key] = (self._segment, self._size + _header.size + len(key),
+								len(data))
+		self._size += length
+
+	def _map(self, segment, end):
+		mapped = self._maps.get(segment)
+		if mapped != None and len(mapped) >= end:
+			return mapped
+		with open(self._segment_path(segment), 'rb') as f:
+			#old maps are not closed, buffers may still reference them
+			mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		self._maps[segment] = mapped
+		return mapped
+
+	def _close_maps(self):
+		#buffers returned by get reference the maps, they are unmapped when
+		#the last buffer is released
+		self._maps = {}
+
+	def _write_index(self):
+		sizes = {}
+		for segment in self._segments():
+			sizes[segment] = os.path.getsize(self._segment_path(segment))
+		index_path = os.path.join(self.path, _INDEX_NAME)
+		with open(index_path + '.tmp', 'wb') as f:
+			marshal.dump((sizes, self._index), f)
+		os.rename(index_path + '.tmp', index_path)
+
+def _encode_id(id):
+	if isinstance(id, unicode):
+		return id.encode('utf-8')
+	return str(id)
+
+class Document(flatty.Schema):
+	"""
+	This class is the base Class for all documents in a :class:`Store`.
+	The documents are stored in the :mod:`flatty.binary` encoding, which
+	holds the :func:`flatty.fingerprint` of their schema.
+	"""
+
+	_id = unicode
+
+	def store(self, db):
+		"""stores the document in the store
+
+		Args:
+			db: a :class:`Store` object
+
+		Returns:
+			returns *id*. *id* is the document id which stays the same over
+			time, a new one is generated if the document has none.
+		"""
+		if self._id == unicode or self._id == None:
+			self._id = unicode(uuid.uuid4().hex)
+		db.put(self._id, binary.dumps(self))
+		return self._id
+
+	@classmethod
+	def load(cls, db, id):
+		"""loads the document from the store
+
+		Args:
+			db: a :class:`Store` object
+
+			id: the document id
+
+		Returns:
+			returns the object
+
+		Raises:
+			SchemaVersionError: if the document was stored with another
+				version of the schema
+		"""
+		try:
+			return binary.loads(cls, db.get(id))
+		except flatty.SchemaVersionError:
+			raise flatty.SchemaVersionError('Document %s was stored with another '
+											'version of %s' % (id, repr(cls)))
@@ -0,0 +1,450 @@
+"""
+This module writes the flat form of schema objects as JSON text in chunks
+while it walks the objects. The flat dict and the whole JSON string are
+never built, so objects with huge :class:`flatty.TypedList` attributes can
+be streamed to files or sockets with bounded memory.
+The other way round the items of a list in a large JSON document are read
+and unflattened one by one. :func:`flatty.iter_flat` and
+:func:`flatty.iter_unflat_items` are shortcuts for the functions of this
+module.
+
+	>>> import json
+	>>> import flatty
+	>>>
+	>>> class Point(flatty.Schema):
+	...	 x = int
+	...	 y = int
+	...
+	>>> class Track(flatty.Schema):
+	...	 name = str
+	...	 points = flatty.TypedList.set_type(Point)
+	...
+	>>> track = Track(name='run', points=[Point(x=i, y=2 * i) for i in range(1000)])
+	>>> chunks = list(flatty.iter_flat(track, chunk_size=1024))
+	>>> len(chunks) > 1
+	True
+	>>> json.loads(''.join(chunks)) == json.loads(json.dumps(track.flatit()))
+	True
+	>>> import StringIO
+	>>> points = flatty.iter_unflat_items(Track, StringIO.StringIO(''.join(chunks)),
+	...								   'points')
+	>>> point = points.next()
+	>>> point.x, point.y
+	(0, 0)
+
+=========
+Functions
+=========
+"""
+import json
+import re
+import flatty
+
+#primitive list items are encoded in slices of this size
+_SLICE = 1000
+
+def iter_flat(obj, obj_type=None, chunk_size=65536, compact=False,
+			include=None, exclude=None):
+	"""yields the JSON text of the flat form of `obj` in chunks. Schema
+	objects, :class:`flatty.TypedList` and :class:`flatty.TypedDict` values
+	are walked item by item, other values are flattened with their
+	converter and encoded on their own.
+
+		Args:
+			obj: a :class:`flatty.Schema` instance
+
+			obj_type: the type of `obj`, by default the class of `obj`
+
+			chunk_size: the minimal length of the chunks, only the last
+				chunk and chunks with single big values differ from it
+				(default=65536)
+
+			compact, include, exclude: see :func:`flatty.flatit`
+
+		Returns:
+			a generator of strings which joined are the JSON text of
+			``flatit(obj)``
+
+		Raises:
+			CycleError: if `obj` contains a reference cycle"""
+	if obj_type == None:
+		obj_type = type(obj)
+	include = flatty._compile_paths(include)
+	exclude = flatty._compile_paths(exclude)
+	#the registry and the context of the whole walk, converters of single
+	#values see them like in flatit
+	registry = flatty.ConvertManager.registry()
+	context = flatty._FlatContext(compact=compact)
+	#the fingerprint entry of the outermost schema object
+	head = None
+	if flatty._is_schema(obj_type) and obj is not None:
+		if compact:
+			head = json.dumps(flatty.fingerprint(obj_type))
+		elif obj_type.__versioned__:
+			head = '%s: %s' % (json.dumps(obj_type.__fingerprint_key__),
+								json.dumps(flatty.fingerprint(obj_type)))
+
+	active = set()
+	out = []
+	size = 0
+	#every level of the walk is an iterator of text and values
+	stack = [iter([(obj_type, obj, include, exclude, head)])]
+	while stack:
+		for item in stack[-1]:
+			if item.__class__ is not tuple:
+				out.append(item)
+				size += len(item)
+				if size >= chunk_size:
+					yield ''.join(out)
+					out = []
+					size = 0
+				continue
+			val_type, value, child_include, child_exclude, head = item
+			if value is None:
+				#converters may map None like in flatit
+				text = json.dumps(_flat_value(registry, context, val_type, None,
+											child_include, child_exclude))
+			else:
+				kind = flatty._kind(val_type, registry)
+				if kind == flatty._SCHEMA:
+					if id(value) in active:
+						raise flatty.CycleError('Cycle detected while flattening ' + \
+												repr(value))
+					active.add(id(value))
+					stack.append(_iter_schema(val_type, value, compact,
+											child_include, child_exclude,
+											head, active))
+					break
+				elif kind == flatty._LIST:
+					flatty.check_type(val_type, value)
+					stack.append(_iter_list(val_type, value, child_include,
+											child_exclude))
+					break
+				elif kind == flatty._DICT:
+					flatty.check_type(val_type, value)
+					stack.append(_iter_dict(val_type, value, child_include,
+											child_exclude))
+					break
+				text = json.dumps(_flat_value(registry, context, val_type, value,
+												child_include, child_exclude))
+			out.append(text)
+			size += len(text)
+		else:
+			stack.pop()
+	if out:
+		yield ''.join(out)
+
+def dump(obj, fileobj, obj_type=None, chunk_size=65536, **kwargs):
+	"""writes the JSON text of the flat form of `obj` to `fileobj` chunk
+	by chunk, takes the same keyword arguments as :func:`iter_flat`
+
+		Args:
+			obj: a :class:`flatty.Schema` instance
+
+			fileobj: an object with a write method, e.g. a file or
+				``socket.makefile('w')``"""
+	for chunk in iter_flat(obj, obj_type, chunk_size, **kwargs):
+		fileobj.write(chunk)
+
+def iter_unflat_items(cls, fileobj, path, read_size=65536):
+	"""reads the JSON document in `fileobj` incrementally and yields the
+	unflattened items of the :class:`flatty.TypedList` at `path` one by
+	one. Only the current item and the read buffer are kept in memory,
+	values outside of `path` are skipped without decoding them. The
+	document is read until the end of the list.
+
+		Args:
+			cls: the :class:`flatty.Schema` class of the document
+
+			fileobj: an object with a read method which returns the JSON
+				text of the flat form of a `cls` instance, e.g. a file
+
+			path: dotted path of the list, e.g. ``'orders'`` or
+				``'customer.orders'``. Parts which are numbers are indexes
+				of lists, other parts attribute names or keys of dicts
+
+			read_size: the minimal number of characters read at once,
+				values which don't fit in the buffer are read in growing
+				steps (default=65536)
+
+		Returns:
+			a generator of the items, nothing is generated if the list is
+			missing or null
+
+		Raises:
+			TypeError: if `path` doesn't address a TypedList in `cls` or
+			an item has the wrong type
+
+			ValueError: if the document isn't valid JSON"""
+	item_type = _item_type(cls, path)
+	reader = _Reader(fileobj, read_size)
+	for name in path.split('.'):
+		if not reader.find(name):
+			return
+	if reader.peek() == 'n':
+		reader.value()
+		return
+	reader.expect('[')
+	if reader.peek() == ']':
+		return
+	while True:
+		item = flatty.unflatit(item_type, reader.value())
+		flatty.check_type(item_type, item)
+		yield item
+		if reader.expect(',]') == ']':
+			return
+
+def _item_type(cls, path):
+	val_type = cls
+	for name in path.split('.') + [None]:
+		kind = flatty._kind(val_type)
+		if name == None and kind == flatty._LIST:
+			return val_type.ftype
+		elif name == None:
+			break
+		elif kind == flatty._SCHEMA and name in val_type.__fields__:
+			val_type = val_type.__fields__[name].type
+		elif kind == flatty._LIST and name.isdigit():
+			val_type = val_type.ftype
+		elif kind == flatty._DICT:
+			val_type = val_type.ftype
+		else:
+			break
+	raise TypeError('%s is not the path of a TypedList in %s' % \
+					(path, repr(cls)))
+
+_special = re.compile(r'["\\\[\]{}]')
+_string_special = re.compile(r'["\\]')
+
+class _Reader(object):
+	"""a buffered scanner of JSON text"""
+	
+	def __init__(self, fileobj, read_size):
+		self.fileobj = fileobj
+		self.read_size = read_size
+		self.buf = ''
+		self.pos = 0
+		self.eof = False
+		self.decoder = json.JSONDecoder()
+	
+	def _fill(self):
+		#the consumed text is only dropped when it is most of the buffer and
+		#at least as much as is buffered is read, so a value which spans
+		#many reads isn't copied again on every read
+		if self.eof:
+			raise ValueError('Unexpected end of JSON document')
+		if self.pos > len(self.buf) // 2:
+			self.buf = self.buf[self.pos:]
+			self.pos = 0
+		data = self.fileobj.read(max(self.read_size, len(self.buf) - self.pos))
+		if not data:
+			self.eof = True
+		self.buf += data
+	
+	def peek(self):
+		"""returns the next character after whitespace"""
+		while True:
+			buf = self.buf
+			pos = self.pos
+			while pos < len(buf) and buf[pos] in ' \t\r\n':
+				pos += 1
+			self.pos = pos
+			if pos < len(buf):
+				return buf[pos]
+			self._fill()
+	
+	def expect(self, chars):
+		"""consumes the next character which has to be one of `chars`"""
+		char = self.peek()
+		if char not in chars:
+			raise ValueError('Expected %s at %r' % (' or '.join(chars),
+													self.buf[self.pos:self.pos + 20]))
+		self.pos += 1
+		return char
+	
+	def value(self):
+		"""decodes the next value"""
+		self.peek()
+		while True:
+			try:
+				value, end = self.decoder.raw_decode(self.buf, self.pos)
+				#numbers and literals at the end of the buffer may go on
+				if end < len(self.buf) or self.eof:
+					self.pos = end
+					return value
+			except ValueError:
+				if self.eof:
+					raise
+			self._fill()
+	
+	def skip(self):
+		"""skips the next value without decoding it"""
+		if self.peek() not in '[{':
+			if self.buf[self.pos] == '"':
+				self._skip_string()
+			else:
+				self.value()
+			return
+		depth = 0
+		while True:
+			match = _special.search(self.buf, self.pos)
+			if match == None:
+				self.pos = len(self.buf)
+				self._fill()
+				continue
+			char = match.group()
+			self.pos = match.start()
+			if char == '"':
+				self._skip_string()
+				continue
+			self.pos += 1
+			if char in '[{':
+				depth += 1
+			else:
+				depth -= 1
+				if depth == 0:
+					return
+	
+	def _skip_string(self):
+		self.pos += 1
+		while True:
+			match = _string_special.search(self.buf, self.pos)
+			if match == None:
+				self.pos = len(self.buf)
+				self._fill()
+			elif match.group() == '"':
+				self.pos = match.end()
+				return
+			elif match.start() + 1 < len(self.buf):
+				#skip the escaped character
+				self.pos = match.start() + 2
+			else:
+				self.pos = match.start()
+				self._fill()
+	
+	def find(self, name):
+		"""moves to the value at `name` in the next object or list, returns
+		False if it doesn't exist or is null"""
+		if self.peek() == 'n':
+			self.value()
+			return False
+		if self.expect('{[') == '[':
+			index = int(name)
+			if self.peek() == ']':
+				return False
+			for i in xrange(index):
+				self.skip()
+				if self.expect(',]') == ']':
+					return False
+			return True
+		if self.peek() == '}':
+			return False
+		while True:
+			key = self.value()
+			self.expect(':')
+			if key == name:
+				return True
+			self.skip()
+			if self.expect(',}') == '}':
+				return False
+
+def _flat_value(registry, context, val_type, value, include, exclude):
+	"""flattens a value which isn't streamed with its converter, like a
+	nested call in :func:`flatty.flatit` with the options of the walk"""
+	if registry.get_converter(val_type) == None:
+		return value
+	context.include, context.exclude = include, exclude
+	previous = getattr(flatty._local, 'flat_context', None)
+	#the context is only active during the call, the generator may be
+	#suspended between the values
+	flatty._local.flat_context = context
+	try:
+		with registry:
+			return flatty.ConvertManager.to_flat(val_type, value)
+	finally:
+		flatty._local.flat_context = previous
+
+def _key(k):
+	"""returns the JSON text of the dict key `k`, other keys than
+	strings are converted like in :func:`json.dumps`"""
+	if isinstance(k, basestring):
+		return json.dumps(k)
+	if k is None or isinstance(k, (int, long, float)):
+		#let json convert the key, e.g. its C encoder writes False as "False"
+		return json.dumps({k:None})[1:-len(': null}')]
+	raise TypeError('Key %r is not a string' % (k,))
+
+def _iter_schema(val_type, obj, compact, include, exclude, head, active):
+	projected = include != None or exclude != None
+	child_include, child_exclude = include, exclude
+	if compact:
+		yield '['
+	else:
+		yield '{'
+	first = True
+	if head != None:
+		yield head
+		first = False
+	for attr_name, attr_type, default in val_type.__fields__.values():
+		if projected:
+			projection = flatty._project(include, exclude, attr_name)
+			if projection == None and not compact:
+				continue
+		if first:
+			first = False
+		else:
+			yield ', '
+		if projected:
+			if projection == None:
+				yield 'null'
+				continue
+			child_include, child_exclude = projection
+		if not compact:
+			yield json.dumps(attr_name) + ': '
+		attr_value = getattr(obj, attr_name)
+		if flatty._isclass(attr_value) and attr_value == attr_type:
+			attr_value = None
+		flatty.check_type(attr_type, attr_value)
+		yield (attr_type, attr_value, child_include, child_exclude, None)
+	active.discard(id(obj))
+	if compact:
+		yield ']'
+	else:
+		yield '}'
+
+def _iter_list(val_type, obj, include, exclude):
+	yield '['
+	if flatty._has_primitive_ftype(val_type):
+		for start in xrange(0, len(obj), _SLICE):
+			items = obj[start:start + _SLICE]
+			flatty._check_primitive_items(val_type.ftype, items)
+			if start:
+				yield ', '
+			yield json.dumps(list(items))[1:-1]
+	else:
+		first = True
+		for item in obj:
+			if first:
+				first = False
+			else:
+				yield ', '
+			flatty.check_type(val_type.ftype, item)
+			yield (type(item), item, include, exclude, None)
+	yield ']'
+
+def _iter_dict(val_type, obj, include, exclude):
+	yield '{'
+	primitive = flatty._has_primitive_ftype(val_type)
+	first = True
+	for k, v in obj.iteritems():
+		if first:
+			first = False
+		else:
+			yield ', '
+		yield _key(k) + ': '
+		flatty.check_type(val_type.ftype, v)
+		if primitive:
+			yield json.dumps(v)
+		else:
+			yield (type(v), v, include, exclude, None)
+	yield '}'
@@ -3,12 +3,24 @@ import unittest
 import test_actions
 import test_couchdb
 import test_mongodb
+import test_binary
+import test_store
+import test_index
+import test_sqlite
+import test_changes
+import test_stream
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(test_actions.suite())
     suite.addTest(test_couchdb.suite())
     suite.addTest(test_mongodb.suite())
+    suite.addTest(test_binary.suite())
+    suite.addTest(test_store.suite())
+    suite.addTest(test_index.suite())
+    suite.addTest(test_sqlite.suite())
+    suite.addTest(test_changes.suite())
+    suite.addTest(test_stream.suite())
     
     return suite
 
@@ -5,6 +5,9 @@ import unittest
 import flatty
 import sys
 import copy
+import base64
+import json
+import threading
 
 from test_utils import is_plain_dict
 
@@ -13,6 +16,7 @@ class ActionsTestCase(unittest.TestCase):
 	
 	def setUp(self):
 		pass
+	
 	def tearDown(self):
 		pass
 	
@@ -371,6 +375,992 @@ class ActionsTestCase(unittest.TestCase):
 		s_flat = flatty.flatit(s)
 		self.assertEqual(s, s_flat)
 	
+	def test_conversion_stats(self):
+		import datetime
+		
+		class Bar(flatty.Schema):
+			day = datetime.date
+		
+		class Foo(flatty.Schema):
+			bars = flatty.TypedList.set_type(Bar)
+		
+		self.assertEqual(flatty.stats(), None)
+		recorded = []
+		flatty.ConvertManager.enable_stats(
+			hook=lambda *args: recorded.append(args))
+		try:
+			foo = Foo(bars=[Bar(day=datetime.date(2011, 7, 15)),
+							Bar(day=datetime.date(2012, 1, 13))])
+			Foo.unflatit(foo.flatit())
+			stats = flatty.stats()
+		finally:
+			flatty.ConvertManager.disable_stats()
+		
+		date_stats = stats['converters']['DateConverter']
+		self.assertEqual(date_stats['to_flat']['calls'], 2)
+		self.assertEqual(date_stats['to_obj']['calls'], 2)
+		self.assertEqual(date_stats['to_flat']['size'], 20)
+		list_stats = stats['converters']['TypedListConverter']
+		self.assertEqual(list_stats['to_flat']['size'], 2)
+		self.assertEqual(stats['fields']['Bar.day']['to_obj']['calls'], 2)
+		self.assertEqual(stats['fields']['Foo.bars']['to_flat']['calls'], 1)
+		self.assertTrue(len(recorded) > 0)
+		self.assertEqual(flatty.stats(), None)
+	
+	def test_shared_objects(self):
+		class Address(flatty.Schema):
+			city = str
+		
+		class Order(flatty.Schema):
+			num = int
+			address = Address
+		
+		class Orders(flatty.Schema):
+			orders = flatty.TypedList.set_type(Order)
+		
+		address = Address(city='London')
+		orders = Orders(orders=[Order(num=i, address=address) for i in range(3)])
+		flat_dict = orders.flatit()
+		self.assertTrue(is_plain_dict(flat_dict))
+		self.assertEqual(flat_dict['orders'][2], {'num':2, 'address':{'city':'London'}})
+		#every place gets its own flat dict
+		self.assertFalse(flat_dict['orders'][0]['address'] is \
+						flat_dict['orders'][1]['address'])
+		flat_dict['orders'][0]['address']['city'] = 'Paris'
+		self.assertEqual(flat_dict['orders'][1]['address'], {'city':'London'})
+		
+		#the address is flattened once per call
+		reads = []
+		class CountingAddress(Address):
+			def __getattribute__(self, name):
+				if name == 'city':
+					reads.append(name)
+				return Address.__getattribute__(self, name)
+		
+		address = CountingAddress(city='London')
+		orders = Orders(orders=[Order(num=i, address=address) for i in range(3)])
+		del reads[:]
+		self.assertEqual(orders.flatit()['orders'][2]['address'], {'city':'London'})
+		self.assertEqual(len(reads), 1)
+		
+		#temporary schema objects of converters may get the id of freed ones
+		class Value(flatty.Schema):
+			v = int
+		
+		class Wrapped(object):
+			def __init__(self, v):
+				self.v = v
+		
+		class WrappedConverter(flatty.Converter):
+			@classmethod
+			def to_flat(cls, obj_type, obj):
+				return flatty.flatit(Value(v=obj.v), Value)
+		
+		class Values(flatty.Schema):
+			values = flatty.TypedList.set_type(Wrapped)
+		
+		values = Values(values=[Wrapped(i) for i in range(5)])
+		registry = flatty.ConvertManager.registry().with_converter(Wrapped,
+															WrappedConverter)
+		for iterative in (False, True):
+			self.assertEqual(values.flatit(registry=registry, iterative=iterative),
+							{'values':[{'v':i} for i in range(5)]})
+	
+	def test_cycle_detection(self):
+		class Node(flatty.Schema):
+			name = str
+		Node.next = Node
+		
+		a = Node(name='a')
+		b = Node(name='b', next=a)
+		a.next = b
+		self.assertRaises(flatty.CycleError, flatty.flatit, a)
+		
+		b.next = None
+		flat_dict = flatty.flatit(a)
+		self.assertEqual(flat_dict, {'name':'a', 'next':{'name':'b', 'next':None}})
+		restored = Node.unflatit(flat_dict)
+		self.assertEqual(restored.next.name, 'b')
+		self.assertEqual(restored.next.next, None)
+	
+	def test_compact(self):
+		import datetime
+		
+		class Sample(flatty.Schema):
+			value = float
+			taken = datetime.date
+		
+		class Series(flatty.Schema):
+			name = str
+			samples = flatty.TypedList.set_type(Sample)
+			tags = flatty.TypedDict.set_type(Sample)
+		
+		series = Series(name='temp',
+						samples=[Sample(value=1.5, taken=datetime.date(2012, 1, 13)),
+								Sample(value=2.5)],
+						tags={'max':Sample(value=2.5)})
+		flat = series.flatit(compact=True)
+		self.assertTrue(is_plain_dict(flat))
+		self.assertEqual(flat, [flatty.fingerprint(Series), 'temp',
+								[[datetime.date(2012, 1, 13).isoformat(), 1.5],
+								[None, 2.5]],
+								{'max':[None, 2.5]}])
+		
+		restored = Series.unflatit(flat, compact=True)
+		self.assertTrue(isinstance(restored.samples[0], Sample))
+		self.assertEqual(restored.samples[0].taken, datetime.date(2012, 1, 13))
+		self.assertEqual(restored.tags['max'].value, 2.5)
+		self.assertEqual(restored.flatit(), series.flatit())
+		
+		#a changed schema has another fingerprint
+		class Series(flatty.Schema):
+			name = str
+			samples = flatty.TypedList.set_type(Sample)
+			tags = flatty.TypedDict.set_type(int)
+		self.assertRaises(flatty.SchemaVersionError, Series.unflatit, flat,
+						compact=True)
+	
+	def test_fingerprint(self):
+		class Bar(flatty.Schema):
+			a = int
+		
+		class Foo(flatty.Schema):
+			bar = Bar
+			bars = flatty.TypedList.set_type(Bar)
+		
+		fp = flatty.fingerprint(Foo)
+		self.assertEqual(len(fp), 16)
+		
+		#same structure, other class names
+		class Bar2(flatty.Schema):
+			a = int
+		
+		class Foo2(flatty.Schema):
+			bar = Bar2
+			bars = flatty.TypedList.set_type(Bar2)
+		self.assertEqual(flatty.fingerprint(Foo2), fp)
+		
+		class Bar3(flatty.Schema):
+			a = float
+		
+		class Foo3(flatty.Schema):
+			bar = Bar3
+			bars = flatty.TypedList.set_type(Bar2)
+		self.assertNotEqual(flatty.fingerprint(Foo3), fp)
+		
+		class Node(flatty.Schema):
+			name = str
+		Node.children = flatty.TypedList.set_type(Node)
+		self.assertEqual(len(flatty.fingerprint(Node)), 16)
+	
+	def test_migrations(self):
+		class Person(flatty.Schema):
+			__versioned__ = True
+			name = str
+			age = str
+		
+		v1 = Person(name='John Doe', age='42').flatit()
+		v1_compact = Person(name='John Doe', age='42').flatit(compact=True)
+		self.assertEqual(v1['__fingerprint__'], flatty.fingerprint(Person))
+		fp1 = flatty.fingerprint(Person)
+		
+		class Person(flatty.Schema):
+			__versioned__ = True
+			full_name = str
+			age = str
+		fp2 = flatty.fingerprint(Person)
+		
+		class Person(flatty.Schema):
+			__versioned__ = True
+			full_name = str
+			age = int
+		
+		self.assertRaises(flatty.SchemaVersionError, Person.unflatit, v1)
+		
+		def rename(flat_dict):
+			flat_dict['full_name'] = flat_dict.pop('name')
+			return flat_dict
+		flatty.MigrationManager.add_migration(Person, fp1, fp2, rename)
+		#path is incomplete
+		self.assertRaises(flatty.SchemaVersionError, Person.unflatit, v1)
+		
+		@flatty.migration(Person, fp2)
+		def retype(flat_dict):
+			flat_dict['age'] = int(flat_dict['age'])
+			return flat_dict
+		
+		person = Person.unflatit(v1)
+		self.assertEqual(person.full_name, 'John Doe')
+		self.assertEqual(person.age, 42)
+		#the stored data is not changed
+		self.assertEqual(v1['name'], 'John Doe')
+		
+		#current data isn't migrated
+		self.assertEqual(Person.unflatit(person.flatit()).age, 42)
+		
+		#migrations for compact data get the list of values
+		self.assertRaises(flatty.SchemaVersionError, Person.unflatit, v1_compact,
+						compact=True)
+		@flatty.migration(Person, fp1, compact=True)
+		def compact_upgrade(values):
+			age, name = values
+			return [int(age), name]
+		self.assertEqual(Person.unflatit(v1_compact, compact=True).age, 42)
+		#and don't replace the migrations of dicts
+		self.assertEqual(Person.unflatit(v1).full_name, 'John Doe')
+		
+		#compiled upgrades are dropped when the schema changes
+		Person.nick = str
+		self.assertRaises(flatty.SchemaVersionError, Person.unflatit, v1)
+		del Person.nick
+		self.assertEqual(Person.unflatit(v1).age, 42)
+		flatty.MigrationManager.del_migrations(Person)
+	
+	def test_lazy_adapters(self):
+		import subprocess
+		import os
+		src = os.path.dirname(os.path.dirname(os.path.abspath(flatty.__file__)))
+		script = "import sys, flatty; " \
+			"print sorted(set(sys.modules) & set(['flatty.mongo', 'flatty.couch', " \
+			"'flatty.sqlite', 'flatty.store', 'flatty.binary', 'bson'])); " \
+			"flatty.binary.dumps; print 'flatty.binary' in sys.modules"
+		output = subprocess.check_output([sys.executable, '-c', script],
+										env=dict(os.environ, PYTHONPATH=src))
+		self.assertEqual(output.split(), ['[]', 'True'])
+	
+	def test_projection(self):
+		class Address(flatty.Schema):
+			street = str
+			city = str
+		
+		class Order(flatty.Schema):
+			num = int
+			address = Address
+		
+		class Customer(flatty.Schema):
+			name = str
+			address = Address
+			orders = flatty.TypedList.set_type(Order)
+			tags = flatty.TypedDict.set_type(Address)
+		
+		address = Address(street='Baker Street 221b', city='London')
+		customer = Customer(name='Holmes', address=address,
+							orders=[Order(num=1, address=address),
+									Order(num=2, address=address)],
+							tags={'home':address})
+		
+		flat_dict = customer.flatit(include=['name', 'address.city', 'orders.num'])
+		self.assertEqual(flat_dict, {'name':'Holmes', 'address':{'city':'London'},
+									'orders':[{'num':1}, {'num':2}]})
+		
+		flat_dict = customer.flatit(exclude=['orders.address', 'tags.street',
+											'address'])
+		self.assertEqual(flat_dict, {'name':'Holmes',
+									'orders':[{'num':1}, {'num':2}],
+									'tags':{'home':{'city':'London'}}})
+		
+		flat_dict = customer.flatit(include=['address', 'address.city'],
+									exclude=['address.street'])
+		self.assertEqual(flat_dict, {'address':{'city':'London'}})
+		
+		flat = customer.flatit(include=['name'], compact=True)
+		self.assertEqual(flat[1:], [None, 'Holmes', None, None])
+		
+		restored = Customer.unflatit(customer.flatit(), include=['orders.num'])
+		self.assertEqual(restored.name, str)
+		self.assertEqual(restored.orders[1].num, 2)
+		self.assertEqual(restored.orders[1].address, Address)
+	
+	def test_interning(self):
+		import datetime
+		
+		class Sample(flatty.Schema):
+			day = datetime.date
+			unit = str
+			value = float
+		
+		class Series(flatty.Schema):
+			samples = flatty.TypedList.set_type(Sample)
+		
+		flat_dict = {'samples':[{'day':'2012-01-13', 'unit':'m' * 10, 'value':1.0},
+								{'day':'2012-01-13', 'unit':'m' * 10, 'value':2.0},
+								{'day':'2012-01-14', 'unit':'m' * 10, 'value':3.0}]}
+		series = Series.unflatit(flat_dict)
+		self.assertFalse(series.samples[0].day is series.samples[1].day)
+		
+		flatty.ConvertManager.enable_interning(maxsize=3)
+		try:
+			series = Series.unflatit(flat_dict)
+			stats = flatty.ConvertManager.intern_stats()
+		finally:
+			flatty.ConvertManager.disable_interning()
+		self.assertTrue(series.samples[0].day is series.samples[1].day)
+		self.assertEqual(series.samples[2].day, datetime.date(2012, 1, 14))
+		self.assertEqual(stats['hits'], 3)
+		self.assertEqual(stats['misses'], 3)
+		self.assertEqual(stats['size'], 3)
+		self.assertEqual(stats['hit_rate'], 0.5)
+		self.assertEqual(flatty.ConvertManager.intern_stats(), None)
+		
+		#str and unicode values are interned separately
+		class Label(flatty.Schema):
+			text = unicode
+		
+		flatty.ConvertManager.enable_interning()
+		try:
+			self.assertRaises(TypeError, Label.unflatit, {'text':'x'})
+			label = Label.unflatit({'text':u'x'})
+		finally:
+			flatty.ConvertManager.disable_interning()
+		self.assertEqual(type(label.text), unicode)
+	
+	def test_intern_cache(self):
+		cache = flatty.InternCache(maxsize=2)
+		cache.put((str, 'a'), 1)
+		cache.put((str, 'b'), 2)
+		self.assertEqual(cache.get((str, 'a')), 1)
+		cache.put((str, 'c'), 3)
+		#b was least recently used
+		self.assertEqual(cache.get((str, 'b')), None)
+		self.assertEqual(cache.get((str, 'c')), 3)
+		self.assertEqual(cache.stats()['evictions'], 1)
+		
+		cache = flatty.InternCache(max_bytes=200)
+		for i in range(100):
+			cache.put((str, str(i)), i)
+		self.assertTrue(cache.stats()['bytes'] <= 200)
+		self.assertTrue(cache.stats()['size'] < 10)
+		
+		#threads share the cache
+		cache = flatty.InternCache(maxsize=50)
+		errors = []
+		def use():
+			try:
+				for i in range(5000):
+					cache.put((str, str(i % 80)), i)
+					cache.get((str, str((i * 7) % 80)))
+			except Exception, e:
+				errors.append(e)
+		threads = [threading.Thread(target=use) for i in range(4)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(errors, [])
+		stats = cache.stats()
+		self.assertEqual(stats['size'], 50)
+		self.assertEqual(stats['hits'] + stats['misses'], 20000)
+	
+	def test_primitive_typed_lists(self):
+		class Metrics(flatty.Schema):
+			values = flatty.TypedList.set_type(float)
+			names = flatty.TypedList.set_type(basestring)
+			counts = flatty.TypedDict.set_type(int)
+		
+		metrics = Metrics(values=[0.5 * i for i in range(1000)] + [None],
+						names=['a', u'b'], counts={'a':1, 'b':True})
+		flat_dict = metrics.flatit()
+		self.assertTrue(is_plain_dict(flat_dict))
+		self.assertEqual(type(flat_dict['values']), list)
+		self.assertEqual(flat_dict['values'][-2:], [499.5, None])
+		self.assertFalse(flat_dict['values'] is metrics.values)
+		self.assertEqual(flat_dict['counts'], {'a':1, 'b':True})
+		
+		restored = Metrics.unflatit(flat_dict)
+		self.assertTrue(isinstance(restored.values, flatty.TypedList))
+		self.assertTrue(isinstance(restored.counts, flatty.TypedDict))
+		self.assertEqual(restored.values, metrics.values)
+		self.assertEqual(restored.flatit(), flat_dict)
+		
+		metrics.values.append(1)
+		self.assertRaises(TypeError, flatty.flatit, metrics)
+		metrics.values.pop()
+		metrics.counts['c'] = 'x'
+		self.assertRaises(TypeError, flatty.flatit, metrics)
+	
+	def test_typed_array(self):
+		import array
+		
+		class Series(flatty.Schema):
+			samples = flatty.TypedArray.set_type('float64')
+			packed = flatty.TypedArray.set_type('int32', encoding='base64')
+			empty = flatty.TypedArray.set_type('uint8')
+		
+		series = Series(samples=array.array('d', [0.25, -1.5]),
+						packed=[2 ** 31 - 1, -2, 0])
+		flat_dict = series.flatit()
+		self.assertTrue(is_plain_dict(flat_dict))
+		self.assertEqual(flat_dict['samples'], [0.25, -1.5])
+		self.assertEqual(flat_dict['empty'], None)
+		self.assertTrue(isinstance(flat_dict['packed'], str))
+		self.assertEqual(len(flat_dict['packed']), 16)
+		
+		restored = Series.unflatit(flat_dict)
+		self.assertEqual(list(restored.samples), [0.25, -1.5])
+		self.assertEqual(list(restored.packed), [2 ** 31 - 1, -2, 0])
+		self.assertEqual(restored.flatit(), flat_dict)
+		
+		restored = flatty.binary.loads(Series, flatty.binary.dumps(series))
+		self.assertEqual(list(restored.packed), [2 ** 31 - 1, -2, 0])
+		
+		series.samples = array.array('f', [0.25])
+		self.assertRaises(TypeError, flatty.flatit, series)
+		series.samples = 'abc'
+		self.assertRaises(TypeError, flatty.flatit, series)
+		self.assertRaises(ValueError, flatty.TypedArray.set_type, 'float128')
+		
+		#the items of lists are checked against the type
+		series.samples = ['x', None]
+		self.assertRaises(TypeError, flatty.flatit, series)
+		series.samples = [1, 2L, 0.5]
+		self.assertEqual(flatty.flatit(series)['samples'], [1, 2L, 0.5])
+		series.packed = [1, 0.5]
+		self.assertRaises(TypeError, flatty.flatit, series)
+		self.assertRaises(TypeError, flatty.check_type, Series.__fields__['empty'].type,
+						[None])
+	
+	def test_binary_attributes(self):
+		
+		class Blob(flatty.Schema):
+			raw = buffer
+			view = memoryview
+			mutable = bytearray
+		
+		payload = '\x00\xff' * 4
+		blob = Blob(raw=buffer(payload, 2), view=memoryview(payload),
+					mutable=bytearray(payload))
+		flat_dict = blob.flatit()
+		self.assertTrue(is_plain_dict(flat_dict))
+		self.assertEqual(flat_dict['raw'], base64.b64encode(payload[2:]))
+		restored = Blob.unflatit(flat_dict)
+		self.assertTrue(isinstance(restored.raw, buffer))
+		self.assertTrue(isinstance(restored.view, memoryview))
+		self.assertTrue(isinstance(restored.mutable, bytearray))
+		self.assertEqual(str(restored.raw), payload[2:])
+		self.assertEqual(restored.view.tobytes(), payload)
+		self.assertEqual(restored.mutable, bytearray(payload))
+		
+		#backend specific flat type, str values are not copied
+		class Raw(str):
+			pass
+		
+		blob.raw = payload
+		flat_dict = blob.flatit(binary=Raw)
+		self.assertTrue(isinstance(flat_dict['view'], Raw))
+		self.assertTrue(flatty.BinaryConverter.to_bytes(buffer, payload) is payload)
+		self.assertEqual(flat_dict['raw'], payload)
+		restored = Blob.unflatit(flat_dict, binary=Raw)
+		self.assertEqual(str(restored.raw), payload)
+		self.assertEqual(restored.mutable, bytearray(payload))
+		
+		restored = flatty.binary.loads(Blob, flatty.binary.dumps(blob))
+		self.assertEqual(restored.view.tobytes(), payload)
+		
+		blob.raw = u'text'
+		self.assertRaises(TypeError, flatty.flatit, blob)
+	
+	def test_validate(self):
+		import datetime
+		
+		class Comment(flatty.Schema):
+			txt = str
+			added = datetime.datetime
+		
+		class Book(flatty.Schema):
+			name = str
+			year = datetime.date
+			start = datetime.time
+			comments = flatty.TypedList.set_type(Comment)
+			ratings = flatty.TypedDict.set_type(int)
+			nested = flatty.TypedList.set_type(flatty.TypedList.set_type(float))
+		
+		book = Book(name='Dive Into Python', year=datetime.date(2008, 10, 10),
+					start=datetime.time(9, 30, 0, 5),
+					comments=[Comment(txt='good',
+									added=datetime.datetime(2011, 1, 2, 3, 4, 5, 6))],
+					ratings={'alex':4}, nested=[[1.0], []])
+		flat_dict = book.flatit()
+		self.assertEqual(flatty.validate(Book, flat_dict), [])
+		self.assertEqual(Book.validate_flat(flat_dict), [])
+		self.assertEqual(Book.validate_flat({'unknown':1, 'name':None}), [])
+		
+		flat_dict.update({'name':1, 'year':'2008-02-30', 'start':'25:00:00.0',
+						'ratings':{'alex':'4', 'bob':1}, 'nested':[[1.0, 'x']]})
+		flat_dict['comments'].append({'txt':'bad', 'added':'2011-01-02'})
+		flat_dict['comments'].append('no dict')
+		errors = dict(Book.validate_flat(flat_dict))
+		self.assertEqual(sorted(errors), ['comments.1.added', 'comments.2',
+										'name', 'nested.0.1', 'ratings.alex',
+										'start', 'year'])
+		self.assertTrue('%Y-%m-%dT%H:%M:%S.%f' in errors['comments.1.added'])
+		self.assertTrue('day is out of range' in errors['year'])
+		
+		#every reported date or time value fails in unflatit too
+		for value in ['2008-02-30', '2008-1-1x', 20080101]:
+			self.assertEqual(len(flatty.validate(datetime.date, value)), 1)
+			self.assertRaises((TypeError, ValueError), flatty.unflatit,
+							datetime.date, value)
+		self.assertEqual(flatty.validate(datetime.date, '2008-1-1'), [])
+		flatty.unflatit(datetime.date, '2008-1-1')
+		self.assertEqual(flatty.validate(datetime.time, '09:30:00.5'), [])
+		self.assertEqual(flatty.unflatit(datetime.time, '09:30:00.5'),
+						datetime.time(9, 30, 0, 500000))
+		
+		self.assertEqual(flatty.validate(Book, []), [('', "<type 'list'>!=<type 'dict'>")])
+	
+	def test_schema_fields(self):
+		class Base(flatty.Schema):
+			name = str
+			count = 0
+			
+			def method(self):
+				pass
+		
+		class Child(Base):
+			tags = flatty.TypedList.set_type(str)
+		
+		self.assertEqual(list(Child.__fields__), ['count', 'name', 'tags'])
+		self.assertEqual(Child.__fields__['count'], flatty.Field('count', int, 0))
+		self.assertEqual(Child.__fields__['name'].type, str)
+		self.assertEqual([field.name for field in Child.__fields__.values()],
+						list(Child.__fields__))
+		self.assertEqual(flatty.schema_fields(Child),
+						[('count', int), ('name', str), ('tags', Child.tags)])
+		self.assertTrue('method' not in Child.__fields__)
+		
+		#read-only
+		self.assertRaises(AttributeError, setattr, Child, '__fields__', {})
+		self.assertRaises(TypeError, Child.__fields__.__setitem__, 'x', None)
+		self.assertRaises(TypeError, Child.__fields__.update, {})
+		
+		#changes of the classes are picked up, also by subclasses
+		fp = flatty.fingerprint(Child)
+		Base.added = float
+		self.assertEqual(Child.__fields__['added'].type, float)
+		self.assertTrue(flatty.fingerprint(Child) != fp)
+		del Base.added
+		self.assertTrue('added' not in Child.__fields__)
+		self.assertEqual(flatty.fingerprint(Child), fp)
+		
+		child = Child(name='x', count=2)
+		self.assertEqual(child.count, 2)
+		self.assertRaises(AttributeError, Child, unknown=1)
+		#attributes which are no fields can still be set
+		Child(method=None)
+	
+	def test_converter_registry(self):
+		import datetime
+		import threading
+		
+		class OrdinalConverter(flatty.Converter):
+			@classmethod
+			def to_flat(cls, obj_type, obj):
+				return obj.toordinal()
+			@classmethod
+			def to_obj(cls, val_type, val):
+				return datetime.date.fromordinal(val)
+		
+		class Event(flatty.Schema):
+			day = datetime.date
+			days = flatty.TypedList.set_type(datetime.date)
+		
+		event = Event(day=datetime.date(2011, 7, 15), days=[datetime.date(2011, 7, 16)])
+		default = flatty.ConvertManager.registry()
+		ordinal = default.with_converter(datetime.date, OrdinalConverter)
+		self.assertTrue(flatty.ConvertManager.registry() is default)
+		self.assertEqual(default.get_converter(datetime.date), flatty.DateConverter)
+		self.assertEqual(ordinal.get_converter(datetime.date), OrdinalConverter)
+		self.assertEqual(ordinal.without_converter(datetime.date).get_converter(datetime.date),
+						None)
+		self.assertRaises(TypeError, default.with_converter, datetime.date, object)
+		
+		flat_dict = event.flatit(registry=ordinal)
+		self.assertEqual(flat_dict, {'day':734333, 'days':[734334]})
+		self.assertEqual(Event.unflatit(flat_dict, registry=ordinal).days,
+						[datetime.date(2011, 7, 16)])
+		self.assertEqual(event.flatit()['day'], '2011-07-15')
+		
+		with ordinal:
+			self.assertEqual(event.flatit()['day'], 734333)
+			with default:
+				self.assertEqual(event.flatit()['day'], '2011-07-15')
+			self.assertEqual(flatty.binary.loads(Event,
+								flatty.binary.dumps(event)).day, event.day)
+		self.assertEqual(event.flatit()['day'], '2011-07-15')
+		
+		#other threads are not affected by the registry of a thread
+		results = []
+		def flatten():
+			results.append(event.flatit()['day'])
+		with ordinal:
+			thread = threading.Thread(target=flatten)
+			thread.start()
+			thread.join()
+		self.assertEqual(results, ['2011-07-15'])
+		
+		#set_converter replaces the global registry, snapshots don't change
+		flatty.ConvertManager.set_converter(datetime.date, OrdinalConverter)
+		try:
+			self.assertEqual(event.flatit()['day'], 734333)
+			self.assertEqual(default.get_converter(datetime.date), flatty.DateConverter)
+			self.assertTrue(flatty.ConvertManager.registry() is not default)
+		finally:
+			flatty.ConvertManager.set_converter(datetime.date, flatty.DateConverter)
+		self.assertEqual(event.flatit()['day'], '2011-07-15')
+		
+		#a converter swapped during a conversion applies to later calls
+		class Swap(object):
+			pass
+		
+		class SwapConverter(flatty.Converter):
+			@classmethod
+			def to_flat(cls, obj_type, obj):
+				flatty.ConvertManager.set_converter(datetime.date, OrdinalConverter)
+				return 'swapped'
+			@classmethod
+			def to_obj(cls, val_type, val):
+				flatty.ConvertManager.set_converter(datetime.date, OrdinalConverter)
+				return Swap()
+		
+		class Swapping(flatty.Schema):
+			a_swap = Swap
+			days = flatty.TypedList.set_type(datetime.date)
+		
+		swapping = Swapping(a_swap=Swap(), days=[datetime.date(2011, 7, 15)])
+		flatty.ConvertManager.set_converter(Swap, SwapConverter)
+		try:
+			for iterative in (False, True):
+				flatty.ConvertManager.set_converter(datetime.date, flatty.DateConverter)
+				self.assertEqual(swapping.flatit(iterative=iterative)['days'],
+								['2011-07-15'])
+				self.assertEqual(swapping.flatit(iterative=iterative)['days'], [734333])
+				flatty.ConvertManager.set_converter(datetime.date, flatty.DateConverter)
+				flat_dict = {'a_swap':'swapped', 'days':['2011-07-15']}
+				self.assertEqual(Swapping.unflatit(flat_dict, iterative=iterative).days,
+								[datetime.date(2011, 7, 15)])
+		finally:
+			flatty.ConvertManager.del_converter(Swap)
+			flatty.ConvertManager.set_converter(datetime.date, flatty.DateConverter)
+		
+		#the lookup cache doesn't keep classes alive
+		import gc
+		import weakref
+		Temp = type('Temp', (flatty.Schema,), {'name':str})
+		self.assertEqual(default.get_converter(Temp), flatty.SchemaConverter)
+		temp = weakref.ref(Temp)
+		del Temp
+		gc.collect()
+		self.assertEqual(temp(), None)
+	
+	def test_iterative(self):
+		import datetime
+		
+		class Address(flatty.Schema):
+			city = str
+		
+		class Node(flatty.Schema):
+			name = str
+			day = datetime.date
+			address = Address
+			tags = flatty.TypedList.set_type(str)
+			scores = flatty.TypedDict.set_type(Address)
+		Node.children = flatty.TypedList.set_type(Node)
+		Node.next = Node
+		
+		def chain(depth):
+			root = node = Node(name='0', children=[])
+			for i in range(1, depth):
+				child = Node(name=str(i), day=datetime.date(2011, 1, 1 + i % 28),
+							tags=['a', 'b'], children=[])
+				node.children.append(child)
+				node = child
+			return root
+		
+		address = Address(city='Graz')
+		root = chain(20)
+		root.next = Node(name='next', address=address, scores={'x':address, 'y':None})
+		root.children[0].address = address
+		for kwargs in [{}, {'compact':True}, {'include':['name', 'children.name']},
+					{'exclude':['children.day', 'next']}]:
+			flat = flatty.flatit(root, **kwargs)
+			self.assertEqual(flatty.flatit(root, iterative=True, **kwargs), flat)
+			kwargs.pop('exclude', None)
+			restored = flatty.unflatit(Node, flat, iterative=True, **kwargs)
+			self.assertEqual(flatty.flatit(restored, **kwargs),
+							flatty.flatit(flatty.unflatit(Node, flat, **kwargs),
+										**kwargs))
+		
+		#shared objects are copied like in the recursive engine
+		flat = flatty.flatit(root, iterative=True)
+		self.assertEqual(flat, flatty.flatit(root))
+		self.assertFalse(flat['next']['address'] is flat['children'][0]['address'])
+		self.assertFalse(flat['next']['scores']['x'] is flat['next']['address'])
+		restored = flatty.unflatit(Node, flat, iterative=True)
+		self.assertEqual(restored.children[0].day, datetime.date(2011, 1, 2))
+		self.assertEqual(restored.next.scores['y'], None)
+		
+		root.next.next = root
+		self.assertRaises(flatty.CycleError, flatty.flatit, root, iterative=True)
+		root.next.next = None
+		root.next.tags = [1]
+		self.assertRaises(TypeError, flatty.flatit, root, iterative=True)
+		
+		#deeper than the recursion limit
+		depth = sys.getrecursionlimit() * 2
+		flat = flatty.flatit(chain(depth), iterative=True)
+		restored = flatty.unflatit(Node, flat, iterative=True)
+		for i in range(depth - 1):
+			restored = restored.children[0]
+		self.assertEqual(restored.name, str(depth - 1))
+		self.assertEqual(restored.children, [])
+		
+		#converters which map None are called by both engines
+		class Money(object):
+			def __init__(self, cents):
+				self.cents = cents
+		
+		class MoneyConverter(flatty.Converter):
+			@classmethod
+			def to_flat(cls, obj_type, obj):
+				if obj is None:
+					return 0
+				return obj.cents
+			@classmethod
+			def to_obj(cls, val_type, val):
+				return Money(val or 0)
+		
+		class Account(flatty.Schema):
+			m = Money
+			n = Money
+		
+		account = Account(m=None)
+		registry = flatty.ConvertManager.registry().with_converter(Money, MoneyConverter)
+		flat = flatty.flatit(account, registry=registry)
+		self.assertEqual(flat, {'m':0, 'n':0})
+		self.assertEqual(flatty.flatit(account, registry=registry, iterative=True), flat)
+		self.assertEqual(flatty.aflatit(account, registry=registry).run(), flat)
+		with registry:
+			self.assertEqual(json.loads(''.join(flatty.iter_flat(account))), flat)
+		for iterative in (False, True):
+			restored = flatty.unflatit(Account, {'m':None}, registry=registry,
+									iterative=iterative)
+			self.assertEqual(restored.m.cents, 0)
+	
+	def test_write_behind_session(self):
+		class MemorySession(flatty.WriteBehindSession):
+			def _write(self, entries):
+				self.db['writes'].append([key for key, entry in entries])
+				errors = []
+				for key, (flat, docs, state) in entries:
+					if flat['name'] == 'bad':
+						errors.extend([(doc, ValueError(key)) for doc in docs])
+					else:
+						self.db[key] = flat
+				return errors
+		
+		class Doc(flatty.Schema):
+			name = str
+		
+		db = {'writes':[]}
+		doc1, doc2 = Doc(name='a'), Doc(name='b')
+		self.assertEqual(MemorySession.current(db), None)
+		with MemorySession(db, max_docs=3) as session:
+			self.assertTrue(MemorySession.current(db) is session)
+			self.assertEqual(MemorySession.current({}), None)
+			for i in range(10):
+				doc1.name = 'a%d' % i
+				session.queue(1, doc1, doc1.flatit())
+			session.queue(2, doc2, doc2.flatit())
+			self.assertEqual(len(session), 2)
+			self.assertEqual(db['writes'], [])
+			#the third document fills the queue
+			session.queue(3, Doc(name='c'), Doc(name='c').flatit())
+			self.assertEqual(db['writes'], [[1, 2, 3]])
+			self.assertEqual(db[1], {'name':'a9'})
+			session.queue(2, doc2, {'name':'b2'})
+		self.assertEqual(MemorySession.current(db), None)
+		self.assertEqual(db['writes'], [[1, 2, 3], [2]])
+		self.assertEqual(db[2], {'name':'b2'})
+		
+		#per document errors
+		session = MemorySession(db)
+		session.queue(4, doc1, {'name':'bad'})
+		session.queue(5, doc2, {'name':'fine'})
+		try:
+			session.flush()
+			self.fail('WriteBehindError expected')
+		except flatty.WriteBehindError, e:
+			self.assertEqual(len(e.errors), 1)
+			self.assertTrue(e.errors[0][0] is doc1)
+		self.assertEqual(db[5], {'name':'fine'})
+		failed = []
+		session = MemorySession(db, on_error=lambda doc, error: failed.append(doc))
+		session.queue(6, doc2, {'name':'bad'})
+		session.flush()
+		self.assertEqual(failed, [doc2])
+		
+		#documents stay queued if writing fails
+		class BrokenSession(MemorySession):
+			broken = True
+			def _write(self, entries):
+				if self.broken:
+					raise IOError('connection lost')
+				return MemorySession._write(self, entries)
+		
+		session = BrokenSession(db)
+		session.queue(8, doc1, {'name':'retry'})
+		self.assertRaises(IOError, session.flush)
+		self.assertEqual(len(session), 1)
+		session.broken = False
+		session.flush()
+		self.assertEqual(len(session), 0)
+		self.assertEqual(db[8], {'name':'retry'})
+		
+		#the exception of the with block isn't replaced by write errors
+		try:
+			with BrokenSession(db):
+				BrokenSession.current(db).queue(9, doc1, {'name':'lost'})
+				raise KeyError('block')
+		except KeyError, e:
+			self.assertEqual(e.args, ('block',))
+		try:
+			with MemorySession(db):
+				MemorySession.current(db).queue(10, doc1, {'name':'bad'})
+				raise KeyError('block')
+		except KeyError, e:
+			self.assertEqual(e.args, ('block',))
+		
+		#time based flushes on the next store
+		session = MemorySession(db, max_delay=0)
+		session.queue(7, doc1, {'name':'late'})
+		self.assertEqual(len(session), 0)
+		self.assertEqual(db[7], {'name':'late'})
+		
+		#sessions are active in their thread only
+		seen = []
+		with MemorySession(db):
+			thread = threading.Thread(target=lambda: seen.append(MemorySession.current(db)))
+			thread.start()
+			thread.join()
+		self.assertEqual(seen, [None])
+	
+	def test_content_hash(self):
+		class Doc(flatty.Schema):
+			name = basestring
+			tags = flatty.TypedList.set_type(basestring)
+			attrs = flatty.TypedDict.set_type(int)
+		
+		doc = Doc(name='caf\xc3\xa9', tags=['a', 'b'], attrs={'x':1, 'y':2})
+		flat = doc.flatit()
+		digest = flatty.content_hash(flat)
+		self.assertEqual(len(digest), 40)
+		#a loaded document with unicode strings has the same hash
+		loaded = {'name':u'caf\xe9', 'tags':[u'a', u'b'], 'attrs':{u'y':2, u'x':1}}
+		self.assertEqual(flatty.content_hash(loaded), digest)
+		for changed in ({'tags':['b', 'a']}, {'attrs':{'x':1, 'y':2.0}},
+						{'attrs':{'x':1, 'y':True}}, {'name':None},
+						{'tags':'ab'}, {'tags':['ab']}):
+			other = dict(flat)
+			other.update(changed)
+			self.assertNotEqual(flatty.content_hash(other), digest)
+		
+		#dicts with str and unicode keys
+		mixed = {'caf\xc3\xa9':1, u'x':2, 'y':{u'\u20ac':3, 'a':4}}
+		self.assertEqual(flatty.content_hash(mixed),
+						flatty.content_hash({u'caf\xe9':1, 'x':2,
+											u'y':{'\xe2\x82\xac':3, u'a':4}}))
+		self.assertNotEqual(flatty.content_hash(mixed),
+							flatty.content_hash({'caf\xc3\xa9':2, u'x':1,
+												'y':{u'\u20ac':3, 'a':4}}))
+	
+	def test_sliced(self):
+		import datetime
+		
+		class Item(flatty.Schema):
+			name = str
+			day = datetime.date
+		
+		class Order(flatty.Schema):
+			__versioned__ = True
+			id = int
+			items = flatty.TypedList.set_type(Item)
+			totals = flatty.TypedDict.set_type(float)
+		
+		order = Order(id=1, items=[Item(name=str(i), day=datetime.date(2012, 1, 13))
+								for i in range(500)],
+					totals={'net':1.0, 'gross':1.2})
+		for kwargs in ({}, {'compact':True}, {'include':['items.name']}):
+			task = flatty.aflatit(order, slice_items=50, **kwargs)
+			self.assertTrue(isinstance(task, flatty.SlicedTask))
+			steps = 0
+			while not task.step():
+				steps += 1
+				#other conversions run between the slices
+				self.assertEqual(flatty.flatit(Item(name='x'))['name'], 'x')
+			self.assertTrue(steps > 10)
+			self.assertTrue(task.done)
+			flat = flatty.flatit(order, **kwargs)
+			self.assertEqual(task.result, flat)
+			
+			task = flatty.aunflatit(Order, flat, slice_items=50, **kwargs)
+			self.assertTrue(len(list(task)) > 10)
+			self.assertEqual(flatty.flatit(task.result, **kwargs), flat)
+		
+		#time budget
+		task = flatty.aflatit(order, slice_items=1, slice_ms=1000)
+		self.assertTrue(task.step())
+		self.assertEqual(task.run(), flatty.flatit(order))
+		self.assertEqual(flatty.aunflatit(Order, None).run(), None)
+		
+		#slices stop before the next block would exceed the budget
+		import time
+		
+		class Slow(object):
+			pass
+		
+		converted = []
+		class SlowConverter(flatty.Converter):
+			@classmethod
+			def to_flat(cls, obj_type, obj):
+				time.sleep(0.01)
+				converted.append(obj)
+				return 'slow'
+		
+		class Batch(flatty.Schema):
+			slow = flatty.TypedList.set_type(Slow)
+		
+		registry = flatty.ConvertManager.registry().with_converter(Slow, SlowConverter)
+		task = flatty.aflatit(Batch(slow=[Slow() for i in range(6)]), slice_items=1,
+							slice_ms=25, registry=registry)
+		per_slice = []
+		while not task.step():
+			per_slice.append(len(converted))
+			del converted[:]
+		self.assertTrue(max(per_slice) <= 2)
+		self.assertEqual(task.result, {'slow':['slow'] * 6})
+		
+		#the registry of the creation is used
+		class OrdinalConverter(flatty.Converter):
+			@classmethod
+			def to_flat(cls, obj_type, obj):
+				return obj.toordinal()
+		
+		registry = flatty.ConvertManager.registry().with_converter(
+					datetime.date, OrdinalConverter)
+		with registry:
+			task = flatty.aflatit(order, slice_items=10)
+		self.assertEqual(task.run()['items'][0]['day'], 734515)
+		task = flatty.aflatit(order, slice_items=10, registry=registry)
+		self.assertEqual(task.run()['items'][0]['day'], 734515)
+		
+		order.items[250].name = 1
+		task = flatty.aflatit(order, slice_items=10)
+		self.assertRaises(TypeError, task.run)
+		self.assertTrue(task.done)
+		#later calls raise the exception again
+		self.assertRaises(TypeError, task.step)
+		self.assertRaises(TypeError, task.run)
+		self.assertRaises(TypeError, list, task)
 			
 			
 def suite():
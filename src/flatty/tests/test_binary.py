@@ -0,0 +1,137 @@
+import flatty
+import unittest
+import sys
+import datetime
+
+
+class BinaryTestCase(unittest.TestCase):
+	
+	def setUp(self):
+		pass
+	def tearDown(self):
+		pass
+	
+	def test_roundtrip(self):
+		class Comment(flatty.Schema):
+			user = unicode
+			txt = unicode
+			score = int(0)
+		
+		class Book(flatty.Schema):
+			name = str
+			year = datetime.date
+			added = datetime.datetime
+			opened = datetime.time
+			price = float
+			available = bool
+			comments = flatty.TypedList.set_type(Comment)
+			tags = flatty.TypedDict.set_type(int)
+			extra = None
+		
+		book = Book(name='Dive Into Python',
+					year=datetime.date(2008, 10, 10),
+					added=datetime.datetime(2012, 1, 13, 19, 11, 5, 123),
+					opened=datetime.time(8, 30),
+					price=29.99,
+					available=False,
+					comments=[Comment(user=u'Alex', txt=u'g\xfcter', score=-3)],
+					tags={'python':2},
+					extra={'a':[1, None, u'x', 2 ** 70]})
+		data = flatty.binary.dumps(book)
+		restored = flatty.binary.loads(Book, data)
+		self.assertTrue(isinstance(restored, Book))
+		self.assertTrue(isinstance(restored.comments[0], Comment))
+		self.assertTrue(isinstance(restored.comments, flatty.TypedList))
+		self.assertTrue(isinstance(restored.tags, flatty.TypedDict))
+		self.assertEqual(book.flatit(), restored.flatit())
+		
+		#unset fields are restored as None, like unflatit does
+		restored = flatty.binary.loads(Book, flatty.binary.dumps(Book()))
+		self.assertEqual(restored.comments, None)
+		self.assertEqual(restored.name, None)
+	
+	def test_smaller_than_flat_dict(self):
+		class Point(flatty.Schema):
+			x_position = int
+			y_position = int
+		
+		class Line(flatty.Schema):
+			points = flatty.TypedList.set_type(Point)
+		
+		line = Line(points=[Point(x_position=i, y_position=-i) for i in range(100)])
+		self.assertTrue(len(flatty.binary.dumps(line)) * 3 < len(repr(line.flatit())))
+	
+	def test_custom_converter(self):
+		class Rgb(object):
+			def __init__(self, r, g, b):
+				self.rgb = (r, g, b)
+			
+		class RgbConverter(flatty.Converter):
+			@classmethod
+			def to_flat(cls, obj_type, obj):
+				return list(obj.rgb)
+			@classmethod
+			def to_obj(cls, val_type, val):
+				return Rgb(*val)
+		
+		flatty.ConvertManager.set_converter(Rgb, RgbConverter)
+		try:
+			class Foo(flatty.Schema):
+				color = Rgb
+			
+			foo = flatty.binary.loads(Foo, flatty.binary.dumps(Foo(color=Rgb(1, 2, 3))))
+			self.assertEqual(foo.color.rgb, (1, 2, 3))
+		finally:
+			flatty.ConvertManager.del_converter(Rgb)
+	
+	def test_type_checks(self):
+		class Foo(flatty.Schema):
+			num = int
+		
+		self.assertRaises(TypeError, flatty.binary.dumps, Foo(num='42'))
+		data = flatty.binary.dumps(Foo(num=42))
+		self.assertRaises(flatty.binary.DecodeError, flatty.binary.loads, Foo, data[:-2])
+		self.assertRaises(flatty.binary.DecodeError, flatty.binary.loads, Foo, data + '\x00')
+		
+		class Bar(flatty.Schema):
+			num = str
+		self.assertRaises(flatty.SchemaVersionError, flatty.binary.loads, Bar, data)
+	
+	def test_schema_changes(self):
+		class Order(flatty.Schema):
+			count = int
+			total = int
+		
+		data = flatty.binary.dumps(Order(count=3, total=100))
+		#fields are stored by position, an added field would shift them
+		Order.amount = int
+		self.assertRaises(flatty.SchemaVersionError, flatty.binary.loads, Order, data)
+		del Order.amount
+		order = flatty.binary.loads(Order, data)
+		self.assertEqual((order.count, order.total), (3, 100))
+		
+		class Address(flatty.Schema):
+			city = str
+		
+		class Person(flatty.Schema):
+			address = Address
+		
+		data = flatty.binary.dumps(Person(address=Address(city='Graz')))
+		Address.zip = int
+		self.assertRaises(flatty.SchemaVersionError, flatty.binary.loads, Person, data)
+	
+	
+def suite():
+	suite = unittest.TestSuite()
+	if len(sys.argv) > 1 and sys.argv[1][:2] == 't:':
+		suite.addTest(BinaryTestCase(sys.argv[1][2:]))
+	else:
+		suite.addTest(unittest.makeSuite(BinaryTestCase, 'test'))
+	return suite
+
+
+if __name__ == '__main__':
+	#call it with 
+	#t:<my_testcase>
+	#to launch only <my_testcase> test 
+	unittest.TextTestRunner(verbosity=1).run(suite())
@@ -0,0 +1,232 @@
+import flatty
+import unittest
+import sys
+import copy
+import datetime
+
+class ChangesTestCase(unittest.TestCase):
+
+	def setUp(self):
+		class Comment(flatty.Schema):
+			id = int
+			txt = str
+
+		class Address(flatty.Schema):
+			city = str
+			street = str
+
+		class Book(flatty.Schema):
+			name = str
+			year = datetime.date
+			address = Address
+			comments = flatty.TypedList.set_type(Comment)
+			ratings = flatty.TypedDict.set_type(int)
+
+		self.Comment = Comment
+		self.Address = Address
+		self.Book = Book
+		self.book = Book(name='Dive Into Python', year=datetime.date(2008, 10, 10),
+						address=Address(city='Graz', street='Hauptplatz'),
+						comments=[Comment(id=1, txt='good'), Comment(id=2, txt='bad')],
+						ratings={'alex':4, 'bob':2})
+
+	def copy_book(self):
+		return copy.deepcopy(self.book)
+
+	def test_identical(self):
+		self.assertEqual(flatty.diff(self.book, self.book), [])
+		self.assertEqual(flatty.diff(self.book, self.copy_book()), [])
+		flat = self.book.flatit()
+		self.assertEqual(flatty.diff(flat, copy.deepcopy(flat)), [])
+
+	def test_schema_diff(self):
+		new = self.copy_book()
+		new.year = datetime.date(2009, 1, 1)
+		new.address.city = 'Wien'
+		new.comments[1].txt = 'boring'
+		new.comments.append(self.Comment(id=3, txt='new'))
+		new.ratings['alex'] = 5
+		del new.ratings['bob']
+		new.ratings['carl'] = 3
+		changes = flatty.diff(self.book, new)
+		self.assertEqual(sorted(changes), sorted([
+			{'op':'set', 'path':'year', 'value':'2009-01-01'},
+			{'op':'set', 'path':'address.city', 'value':'Wien'},
+			{'op':'set', 'path':'comments.1.txt', 'value':'boring'},
+			{'op':'set', 'path':'comments.2', 'value':{'id':3, 'txt':'new'}},
+			{'op':'set', 'path':'ratings.alex', 'value':5},
+			{'op':'set', 'path':'ratings.carl', 'value':3},
+			{'op':'unset', 'path':'ratings.bob'},
+			]))
+
+		#the same changes are found in the flat form
+		self.assertEqual(sorted(flatty.diff(self.book.flatit(), new.flatit())),
+						sorted(changes))
+
+	def test_unset_and_removed(self):
+		new = self.copy_book()
+		new.address = None
+		del new.comments[0]
+		changes = flatty.diff(self.book, new)
+		self.assertEqual(sorted(changes), sorted([
+			{'op':'set', 'path':'address', 'value':None},
+			{'op':'set', 'path':'comments', 'value':[{'id':2, 'txt':'bad'}]},
+			]))
+		new = self.copy_book()
+		new.address = self.Address(city='Graz')
+		self.assertEqual(flatty.diff(self.book, new),
+						[{'op':'set', 'path':'address.street', 'value':None}])
+
+	def test_keyed_lists(self):
+		new = self.copy_book()
+		new.comments.reverse()
+		self.assertEqual(len(flatty.diff(self.book, new)), 4)
+		self.assertEqual(flatty.diff(self.book, new, keys={'comments':'id'}), [])
+
+		del new.comments[0]
+		new.comments[0].txt = 'excellent'
+		new.comments.append(self.Comment(id=5, txt='new'))
+		expected = [{'op':'set', 'path':'comments.1.txt', 'value':'excellent'},
+					{'op':'set', 'path':'comments.5', 'value':{'id':5, 'txt':'new'}},
+					{'op':'unset', 'path':'comments.2'}]
+		self.assertEqual(flatty.diff(self.book, new, keys={'comments':'id'}),
+						expected)
+		self.assertEqual(flatty.diff(self.book.flatit(), new.flatit(),
+									keys={'comments':'id'}),
+						expected)
+
+		new.comments.append(self.Comment(id=5, txt='duplicate'))
+		self.assertRaises(ValueError, flatty.diff, self.book, new,
+						keys={'comments':'id'})
+
+	def test_paths(self):
+		new = self.copy_book()
+		new.name = 'Dive Into Python 3'
+		new.address.city = 'Wien'
+		new.comments[0].txt = 'great'
+		self.assertEqual(flatty.diff(self.book, new, paths=['address', 'comments.id']),
+						[{'op':'set', 'path':'address.city', 'value':'Wien'}])
+		self.assertEqual(flatty.diff(self.book.flatit(), new.flatit(),
+									paths=['name']),
+						[{'op':'set', 'path':'name', 'value':'Dive Into Python 3'}])
+
+	def test_shared_objects(self):
+		reads = []
+
+		class Counting(flatty.Schema):
+			value = int
+
+			def __getattribute__(self, name):
+				if name == 'value':
+					reads.append(name)
+				return flatty.Schema.__getattribute__(self, name)
+
+		class Holder(flatty.Schema):
+			item = Counting
+			other = int
+
+		shared = Counting(value=1)
+		old, new = Holder(item=shared, other=1), Holder(item=shared, other=2)
+		del reads[:]
+		self.assertEqual(flatty.diff(old, new),
+						[{'op':'set', 'path':'other', 'value':2}])
+		self.assertEqual(reads, [])
+
+	def test_patch(self):
+		new = self.copy_book()
+		new.year = datetime.date(2009, 1, 1)
+		new.address.city = 'Wien'
+		new.comments[1].txt = 'boring'
+		new.comments.append(self.Comment(id=3, txt='new'))
+		new.ratings['alex'] = 5
+		del new.ratings['bob']
+		changes = flatty.diff(self.book, new)
+
+		book = self.copy_book()
+		address = book.address
+		self.assertTrue(flatty.patch(book, changes) is book)
+		self.assertEqual(book.flatit(), new.flatit())
+		self.assertTrue(book.address is address)
+		self.assertTrue(isinstance(book.year, datetime.date))
+		self.assertTrue(isinstance(book.comments[2], self.Comment))
+
+		#removed list items replace the whole list
+		del new.comments[0]
+		flatty.patch(book, flatty.diff(book, new))
+		self.assertEqual(book.flatit(), new.flatit())
+
+	def test_patch_keyed(self):
+		keys = {'comments':'id'}
+		new = self.copy_book()
+		new.comments.reverse()
+		del new.comments[0]
+		new.comments[0].txt = 'excellent'
+		new.comments.append(self.Comment(id=5, txt='new'))
+		book = self.copy_book()
+		flatty.patch(book, flatty.diff(book, new, keys=keys), keys=keys)
+		self.assertEqual([(c.id, c.txt) for c in book.comments],
+						[(1, 'excellent'), (5, 'new')])
+
+	def test_patch_update_document(self):
+		book = self.copy_book()
+		flatty.patch(book, {'$set':{'year':'2012-01-13', 'comments.0.txt':'fine',
+									'ratings.carl':1},
+							'$unset':{'name':'', 'ratings.alex':''}})
+		self.assertEqual(book.year, datetime.date(2012, 1, 13))
+		self.assertEqual(book.comments[0].txt, 'fine')
+		self.assertEqual(book.ratings, {'bob':2, 'carl':1})
+		self.assertEqual(book.name, str)
+
+		update = flatty.changes.to_update(flatty.diff(self.book, book))
+		self.assertEqual(update['$unset'], {'ratings.alex':''})
+		self.assertEqual(update['$set']['name'], None)
+
+		#missing schema objects are created
+		book.address = None
+		flatty.patch(book, {'$set':{'address.city':'Wien'}})
+		self.assertEqual(book.address.city, 'Wien')
+		self.assertEqual(book.address.street, str)
+
+		self.assertRaises(ValueError, flatty.patch, book, {'$push':{'comments':{}}})
+
+	def test_patch_errors(self):
+		book = self.copy_book()
+		self.assertRaises(AttributeError, flatty.patch, book,
+						[{'op':'set', 'path':'address.zip', 'value':8010}])
+		self.assertRaises(TypeError, flatty.patch, book,
+						[{'op':'set', 'path':'address.city', 'value':42}])
+		self.assertRaises(IndexError, flatty.patch, book,
+						[{'op':'set', 'path':'comments.5.txt', 'value':'x'}])
+		self.assertRaises(KeyError, flatty.patch, book,
+						[{'op':'unset', 'path':'ratings.nobody'}])
+		self.assertRaises(TypeError, flatty.patch, book,
+						[{'op':'set', 'path':'name.first', 'value':'x'}])
+		self.assertEqual(book.flatit(), self.book.flatit())
+
+		#patching into None names the path of the None value
+		book.comments = None
+		self.assertRaisesRegexp(TypeError, 'comments is None', flatty.patch, book,
+								[{'op':'set', 'path':'comments.0', 'value':None}])
+		book.comments = [None]
+		self.assertRaisesRegexp(TypeError, 'comments.0 is None', flatty.patch, book,
+								[{'op':'set', 'path':'comments.0.txt', 'value':'x'}])
+
+	def test_type_mismatch(self):
+		self.assertRaises(TypeError, flatty.diff, self.book, self.Address())
+		self.assertRaises(TypeError, flatty.diff, {}, [])
+
+
+def suite():
+	suite = unittest.TestSuite()
+	if len(sys.argv) > 1 and sys.argv[1][:2] == 't:':
+		suite.addTest(ChangesTestCase(sys.argv[1][2:]))
+	else:
+		suite.addTest(unittest.makeSuite(ChangesTestCase, 'test'))
+	return suite
+
+
+if __name__ == '__main__':
+	#call it with
+	#t:<my_testcase>
+	#to launch only <my_testcase> test
+	unittest.TextTestRunner(verbosity=1).run(suite())
@@ -94,6 +94,71 @@ class CouchdbTestCase(unittest.TestCase):
 		self.assertEqual(library2.books['978-1590593561'].comments, None)
 		self.assertEqual(len(library2.books['978-0596158101'].comments), 1)
 		self.assertTrue(isinstance(library2.address, Address))
+	
+	def test_write_behind(self):
+		db = self.db
+		
+		class Counter(flatty.couch.Document):
+			name = unicode
+			count = int
+		
+		counter = Counter(name=u'hits', count=0)
+		with flatty.couch.WriteBehindSession(db, max_docs=10) as session:
+			for i in range(25):
+				counter.count = i
+				id, rev = counter.store(db)
+				self.assertEqual(rev, None)
+			Counter(name=u'other', count=1).store(db)
+			self.assertEqual(len(session), 2)
+			self.assertEqual(len(db), 0)
+		self.assertEqual(len(db), 2)
+		self.assertEqual(counter._id, id)
+		self.assertTrue(counter._rev.startswith('1-'))
+		self.assertEqual(Counter.load(db, id).count, 24)
+		
+		stale = Counter.load(db, id)
+		with flatty.couch.WriteBehindSession(db):
+			counter.count = 25
+			counter.store(db)
+		self.assertTrue(counter._rev.startswith('2-'))
+		
+		failed = []
+		with flatty.couch.WriteBehindSession(db, on_error=lambda doc, e: failed.append(doc)):
+			stale.count = 1
+			stale.store(db)
+		self.assertEqual(failed, [stale])
+		self.assertEqual(Counter.load(db, id).count, 25)
+	
+	def test_skip_unchanged(self):
+		db = self.db
+		
+		class Person(flatty.couch.Document):
+			__skip_unchanged__ = True
+			name = unicode
+			age = int
+		
+		person = Person(name=u'John Doe', age=42)
+		id, rev = person.store(db)
+		self.assertTrue(person.__written__)
+		self.assertEqual(person.store(db), (id, rev))
+		self.assertFalse(person.__written__)
+		
+		loaded = Person.load(db, id)
+		self.assertEqual(loaded.store(db), (id, rev))
+		self.assertFalse(loaded.__written__)
+		loaded.age = 43
+		id, rev2 = loaded.store(db)
+		self.assertTrue(loaded.__written__)
+		self.assertNotEqual(rev, rev2)
+		
+		with flatty.couch.WriteBehindSession(db):
+			loaded.store(db)
+			self.assertFalse(loaded.__written__)
+			loaded.age = 44
+			loaded.store(db)
+		self.assertTrue(loaded._rev.startswith('3-'))
+		loaded.store(db)
+		self.assertFalse(loaded.__written__)
 		
 
 		
@@ -0,0 +1,94 @@
+import flatty
+import flatty.index
+import unittest
+import sys
+import datetime
+
+class IndexTestCase(unittest.TestCase):
+	
+	def setUp(self):
+		class Address(flatty.Schema):
+			city = str
+		
+		class User(flatty.Schema):
+			__indexes__ = ['email', 'age', 'address.city', 'created.date']
+			_id = int
+			email = str
+			age = int
+			address = Address
+			created = datetime.datetime
+		
+		self.Address = Address
+		self.User = User
+		self.users = [User(_id=i, email='user%d@example.com' % i, age=20 + i % 3,
+						address=Address(city=['Graz', 'Wien'][i % 2]),
+						created=datetime.datetime(2012, 1, 1 + i % 4, 12))
+					for i in range(12)]
+		self.manager = flatty.index.IndexManager(User)
+		for user in self.users:
+			self.manager.add(user)
+	
+	def tearDown(self):
+		pass
+	
+	def emails(self, users):
+		return sorted([user.email for user in users])
+	
+	def test_find_by(self):
+		manager = self.manager
+		self.assertEqual(len(manager), 12)
+		self.assertEqual(manager.find_by('email', 'user3@example.com'), [self.users[3]])
+		self.assertEqual(len(manager.find_by('address.city', 'Wien')), 6)
+		self.assertEqual(len(manager.find_by('created.date', datetime.date(2012, 1, 2))), 3)
+		self.assertEqual(manager.find_by('age', 99), [])
+		self.assertRaises(AttributeError, flatty.index.IndexManager, self.User, ['name'])
+	
+	def test_find_range(self):
+		manager = self.manager
+		ages = [user.age for user in manager.find_range('age', 21)]
+		self.assertEqual(ages, [21] * 4 + [22] * 4)
+		self.assertEqual(len(manager.find_range('age', 20, 21)), 8)
+		self.assertEqual(len(manager.find_range('created.date',
+									high=datetime.date(2012, 1, 1))), 3)
+	
+	def test_add_remove_update(self):
+		manager = self.manager
+		manager.remove(3)
+		self.assertEqual(manager.find_by('email', 'user3@example.com'), [])
+		self.assertEqual(len(manager.find_range('age', 20, 20)), 3)
+		self.assertRaises(KeyError, manager.remove, 3)
+		
+		user = self.users[4]
+		user.age = 30
+		manager.update(4)
+		self.assertEqual(manager.find_by('age', 30), [user])
+		self.assertEqual(manager.find_range('age', 25), [user])
+		
+		key = manager.add(self.User(email='nobody@example.com'))
+		self.assertEqual(manager.find_by('address.city', None), [manager.get(key)])
+	
+	def test_dump_load(self):
+		data = self.manager.dump()
+		objects = dict([(user._id, user) for user in self.users])
+		manager = flatty.index.IndexManager.load(self.User, data, objects)
+		self.assertEqual(manager.find_by('email', 'user3@example.com'), [self.users[3]])
+		self.assertEqual(self.emails(manager.find_range('created.date',
+									datetime.date(2012, 1, 4))),
+						self.emails(self.manager.find_range('created.date',
+									datetime.date(2012, 1, 4))))
+	
+	
+def suite():
+	suite = unittest.TestSuite()
+	if len(sys.argv) > 1 and sys.argv[1][:2] == 't:':
+		suite.addTest(IndexTestCase(sys.argv[1][2:]))
+	else:
+		suite.addTest(unittest.makeSuite(IndexTestCase, 'test'))
+	return suite
+
+
+if __name__ == '__main__':
+	#call it with 
+	#t:<my_testcase>
+	#to launch only <my_testcase> test 
+	unittest.TextTestRunner(verbosity=1).run(suite())
@@ -120,6 +120,111 @@ class MongodbTestCase(unittest.TestCase):
 		person_conflicting.age = 86
 		
 		self.assertRaises(flatty.mongo.UpdateFailedError, person_conflicting.store, db)
+	
+	def test_binary_attribute(self):
+		from bson.binary import Binary
+		db = self.db
+		
+		class Image(flatty.mongo.Document):
+			name = basestring
+			data = buffer
+		
+		payload = '\x89PNG' + '\x00\xff' * 1024
+		image = Image(name='logo', data=buffer(payload))
+		image.store(db)
+		doc = db['image'].find_one({'_id':image._id})
+		self.assertTrue(isinstance(doc['data'], Binary))
+		image2 = Image.load(db, image._id)
+		self.assertEqual(str(image2.data), payload)
+	
+	def test_write_behind(self):
+		from datetime import datetime
+		db = self.db
+		
+		class Counter(flatty.mongo.Document):
+			name = basestring
+			count = int
+			updated = datetime
+		
+		counter = Counter(name='hits', count=0)
+		with flatty.mongo.WriteBehindSession(db, max_docs=10) as session:
+			for i in range(25):
+				counter.count = i
+				counter.updated = datetime.now()
+				self.assertEqual(counter.store(db), counter._id)
+			Counter(name='other', count=1).store(db)
+			self.assertEqual(len(session), 2)
+			self.assertEqual(db['counter'].find().count(), 0)
+		self.assertEqual(db['counter'].find().count(), 2)
+		self.assertEqual(Counter.load(db, counter._id).count, 24)
+		
+		#stored documents and loaded documents can be stored again
+		stale = Counter.load(db, counter._id)
+		with flatty.mongo.WriteBehindSession(db):
+			counter.count = 25
+			counter.store(db)
+		loaded = Counter.load(db, counter._id)
+		with flatty.mongo.WriteBehindSession(db):
+			loaded.count = 26
+			loaded.store(db)
+		self.assertEqual(Counter.load(db, counter._id).count, 26)
+		
+		#documents changed in the meantime are reported
+		session = flatty.mongo.WriteBehindSession(db)
+		with session:
+			stale.count = 1
+			stale.store(db)
+			new = Counter(name='new')
+			new.store(db)
+			self.assertRaises(flatty.WriteBehindError, session.flush)
+		try:
+			with flatty.mongo.WriteBehindSession(db):
+				stale.store(db)
+				new.store(db)
+			self.fail('WriteBehindError expected')
+		except flatty.WriteBehindError, e:
+			self.assertEqual(len(e.errors), 1)
+			self.assertTrue(e.errors[0][0] is stale)
+			self.assertTrue(isinstance(e.errors[0][1], flatty.mongo.UpdateFailedError))
+		self.assertEqual(Counter.load(db, counter._id).count, 26)
+		self.assertEqual(Counter.load(db, new._id).name, 'new')
+	
+	def test_skip_unchanged(self):
+		db = self.db
+		
+		class Person(flatty.mongo.Document):
+			__skip_unchanged__ = True
+			name = basestring
+			age = int
+		
+		person = Person(name='John Doe', age=42)
+		person.store(db)
+		self.assertTrue(person.__written__)
+		person.store(db)
+		self.assertFalse(person.__written__)
+		
+		loaded = Person.load(db, person._id)
+		loaded.store(db)
+		self.assertFalse(loaded.__written__)
+		loaded.age = 44
+		loaded.store(db)
+		self.assertTrue(loaded.__written__)
+		loaded.store(db)
+		self.assertFalse(loaded.__written__)
+		
+		loaded = Person.load(db, person._id)
+		self.assertEqual(loaded.age, 44)
+		with flatty.mongo.WriteBehindSession(db) as session:
+			loaded.store(db)
+			self.assertFalse(loaded.__written__)
+			loaded.age = 45
+			loaded.store(db)
+			loaded.age = 44
+			loaded.store(db)
+			self.assertTrue(loaded.__written__)
+			self.assertEqual(len(session), 1)
+		loaded.store(db)
+		self.assertFalse(loaded.__written__)
 		
 		
 		
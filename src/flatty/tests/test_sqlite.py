@@ -0,0 +1,147 @@
+import flatty
+import flatty.sqlite
+import sqlite3
+import unittest
+import sys
+
+class SqliteTestCase(unittest.TestCase):
+	
+	def setUp(self):
+		self.db = sqlite3.connect(':memory:')
+		
+	def tearDown(self):
+		self.db.close()
+	
+	def test_create_document(self):
+		from datetime import datetime
+		db = self.db
+		t_now = datetime.now()
+		
+		class Person(flatty.sqlite.Document):
+			name = basestring
+			age = int
+			added = datetime
+			
+		person = Person(name='John Doe', age=42, added=t_now)
+		id, rev = person.store(db)
+		self.assertEqual(rev, 1)
+		self.assertEqual(person._id, id)
+		person2 = Person.load(db, id)
+		self.assertEqual(person.name, person2.name)
+		self.assertEqual(person.added, person2.added)
+		self.assertEqual(person2._rev, 1)
+		
+		person2.name = 'John R. Doe'
+		self.assertEqual(person2.store(db), (id, 2))
+		person3 = Person.load(db, id)
+		self.assertEqual(person3.name, 'John R. Doe')
+		self.assertRaises(KeyError, Person.load, db, u'missing')
+	
+	def test_conflicting_documents(self):
+		db = self.db
+		
+		class Person(flatty.sqlite.Document):
+			name = basestring
+		
+		id, rev = Person(name='John Doe').store(db)
+		person = Person.load(db, id)
+		person_conflicting = Person.load(db, id)
+		person.store(db)
+		person_conflicting.name = 'Jane Doe'
+		self.assertRaises(flatty.sqlite.UpdateFailedError, person_conflicting.store, db)
+		self.assertRaises(flatty.sqlite.UpdateFailedError, Person(_id=id).store, db)
+	
+	def test_batches(self):
+		db = self.db
+		
+		class Address(flatty.Schema):
+			city = basestring
+		
+		class Person(flatty.sqlite.Document):
+			__table__ = 'people'
+			__indexes__ = ['name', 'address.city']
+			name = basestring
+			address = Address
+		
+		people = [Person(name='person %d' % i, address=Address(city=['Graz', 'Wien'][i % 2]))
+				for i in range(1200)]
+		results = Person.store_many(db, people)
+		self.assertEqual(len(results), 1200)
+		ids = [id for id, rev in results]
+		loaded = Person.load_many(db, ids[::-1] + [u'missing'])
+		self.assertEqual(loaded[0].name, 'person 1199')
+		self.assertEqual(loaded[-1], None)
+		self.assertEqual(len(Person.find_by(db, 'address.city', 'Wien')), 600)
+		self.assertEqual(Person.find_by(db, 'name', 'person 7')[0]._id, ids[7])
+		self.assertRaises(AttributeError, Person.find_by, db, 'address', 'Wien')
+		
+		#a failing document rolls back the whole batch
+		people[0].name = 'changed'
+		stale = Person.load(db, ids[1])
+		people[1].store(db)
+		self.assertRaises(flatty.sqlite.UpdateFailedError, Person.store_many, db,
+						[people[0], stale])
+		self.assertEqual(Person.load(db, ids[0]).name, 'person 0')
+		self.assertEqual(people[0]._rev, 1)
+	
+	def test_failing_batch(self):
+		db = self.db
+		
+		class Person(flatty.sqlite.Document):
+			name = basestring
+		
+		Person(name='first').store(db)
+		def fail():
+			raise ValueError('boom')
+		db.create_function('fail', 0, fail)
+		db.execute("CREATE TRIGGER boom BEFORE INSERT ON person "
+					"WHEN NEW.data LIKE '%boom%' BEGIN SELECT fail(); END")
+		people = [Person(name='a'), Person(name='b'), Person(name='boom')]
+		self.assertRaises(sqlite3.OperationalError, Person.store_many, db, people)
+		self.assertEqual(db.execute('SELECT COUNT(*) FROM person').fetchone()[0], 1)
+		self.assertEqual([person._id for person in people], [unicode] * 3)
+	
+	def test_added_index(self):
+		db = self.db
+		
+		class Person(flatty.sqlite.Document):
+			__table__ = 'people'
+			name = basestring
+		
+		id, rev = Person(name='John Doe').store(db)
+		
+		class IndexedPerson(Person):
+			__indexes__ = ['name']
+		
+		self.assertEqual(IndexedPerson.find_by(db, 'name', 'John Doe')[0]._id, id)
+		self.assertEqual(IndexedPerson.find_by(db, 'name', 'Jane Doe'), [])
+	
+	def test_pending_transaction(self):
+		db = self.db
+		
+		class Person(flatty.sqlite.Document):
+			name = basestring
+		
+		id, rev = Person(name='John Doe').store(db)
+		db.execute('CREATE TABLE other (value TEXT)')
+		#the table already exists, loading doesn't commit the insert
+		db.execute("INSERT INTO other VALUES ('pending')")
+		self.assertEqual(Person.load(db, id).name, 'John Doe')
+		db.rollback()
+		self.assertEqual(db.execute('SELECT COUNT(*) FROM other').fetchone()[0], 0)
+	
+	
+def suite():
+	suite = unittest.TestSuite()
+	if len(sys.argv) > 1 and sys.argv[1][:2] == 't:':
+		suite.addTest(SqliteTestCase(sys.argv[1][2:]))
+	else:
+		suite.addTest(unittest.makeSuite(SqliteTestCase, 'test'))
+	return suite
+
+
+if __name__ == '__main__':
+	#call it with 
+	#t:<my_testcase>
+	#to launch only <my_testcase> test 
+	unittest.TextTestRunner(verbosity=1).run(suite())
@@ -0,0 +1,153 @@
+import flatty
+import flatty.store
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+
+class StoreTestCase(unittest.TestCase):
+	
+	def setUp(self):
+		self.path = tempfile.mkdtemp()
+		self.db = flatty.store.Store(self.path)
+		
+	def tearDown(self):
+		self.db.close()
+		shutil.rmtree(self.path)
+	
+	def reopen(self, **kwargs):
+		self.db.close()
+		self.db = flatty.store.Store(self.path, **kwargs)
+	
+	def test_create_document(self):
+		from datetime import datetime
+		db = self.db
+		t_now = datetime.now()
+		
+		class Person(flatty.store.Document):
+			name = unicode
+			age = int
+			added = datetime
+			
+		person = Person(name=u'John Doe', age=42, added=t_now)
+		id = person.store(db)
+		self.assertEqual(id, person._id)
+		person2 = Person.load(db, id)
+		self.assertEqual(person.name, person2.name)
+		self.assertEqual(person.added, person2.added)
+		
+		person2.name = u'John R. Doe'
+		self.assertEqual(person2.store(db), id)
+		self.reopen()
+		person3 = Person.load(self.db, id)
+		self.assertEqual(person3.name, u'John R. Doe')
+		self.assertEqual(person3._id, id)
+		self.assertEqual(len(self.db), 1)
+		
+		class Person(flatty.store.Document):
+			name = unicode
+		self.assertRaises(flatty.SchemaVersionError, Person.load, self.db, id)
+	
+	def test_records(self):
+		db = self.db
+		db.put('a', 'first')
+		db.put(u'b\xfc', 'second')
+		db.put('a', 'third')
+		self.assertEqual(str(db.get('a')), 'third')
+		self.assertTrue(isinstance(db.get('a'), buffer))
+		self.assertEqual(str(db.get(u'b\xfc')), 'second')
+		self.assertEqual(sorted(db.keys()), [u'a', u'b\xfc'])
+		
+		db.delete('a')
+		self.assertFalse('a' in db)
+		self.assertRaises(KeyError, db.get, 'a')
+		self.assertRaises(KeyError, db.delete, 'a')
+		
+		#reopen with and without the index file
+		self.reopen()
+		self.assertEqual(self.db.keys(), [u'b\xfc'])
+		self.db.put('c', 'fourth')
+		self.db._file.close()
+		self.db._file = None
+		self.db = flatty.store.Store(self.path)
+		self.assertEqual(str(self.db.get('c')), 'fourth')
+		os.remove(os.path.join(self.path, 'index'))
+		self.reopen()
+		self.assertEqual(sorted(self.db.keys()), [u'b\xfc', u'c'])
+	
+	def test_segments_and_compaction(self):
+		self.reopen(segment_size=100)
+		db = self.db
+		for i in range(20):
+			db.put(str(i % 5), 'x' * 20 + str(i))
+		self.assertTrue(len(os.listdir(self.path)) > 2)
+		
+		db.compact()
+		self.assertEqual(len(db), 5)
+		for i in range(15, 20):
+			self.assertEqual(str(db.get(str(i % 5))), 'x' * 20 + str(i))
+		
+		self.reopen()
+		self.assertEqual(str(self.db.get('4')), 'x' * 20 + '19')
+	
+	def crash(self):
+		#lose the open file and the index like an interrupted process
+		self.db._file.close()
+		self.db._file = None
+		index = os.path.join(self.path, 'index')
+		if os.path.exists(index):
+			os.remove(index)
+	
+	def test_torn_record(self):
+		db = self.db
+		db.put('a', 'AAAAAAAAAA')
+		db.put('b', 'BBBBBBBBBB')
+		self.crash()
+		segment = os.path.join(self.path, 'segment-000000.dat')
+		size = os.path.getsize(segment)
+		with open(segment, 'r+b') as f:
+			f.truncate(size - 4)
+		
+		self.db = flatty.store.Store(self.path)
+		self.assertEqual(self.db.keys(), [u'a'])
+		self.assertRaises(KeyError, self.db.get, 'b')
+		self.db.put('c', 'CCCC')
+		self.crash()
+		self.db = flatty.store.Store(self.path)
+		self.assertEqual(sorted(self.db.keys()), [u'a', u'c'])
+		self.assertEqual(str(self.db.get('c')), 'CCCC')
+		
+		#a torn header
+		self.crash()
+		with open(segment, 'ab') as f:
+			f.write('\x00\x00')
+		self.reopen()
+		self.assertEqual(sorted(self.db.keys()), [u'a', u'c'])
+	
+	def test_buffers_after_close(self):
+		db = self.db
+		db.put('a', 'first')
+		data = db.get('a')
+		db.put('a', 'second')
+		db.compact()
+		self.assertEqual(str(data), 'first')
+		data = db.get('a')
+		db.close()
+		self.assertEqual(str(data), 'second')
+	
+	
+def suite():
+	suite = unittest.TestSuite()
+	if len(sys.argv) > 1 and sys.argv[1][:2] == 't:':
+		suite.addTest(StoreTestCase(sys.argv[1][2:]))
+	else:
+		suite.addTest(unittest.makeSuite(StoreTestCase, 'test'))
+	return suite
+
+
+if __name__ == '__main__':
+	#call it with 
+	#t:<my_testcase>
+	#to launch only <my_testcase> test 
+	unittest.TextTestRunner(verbosity=1).run(suite())
@@ -0,0 +1,218 @@
+import flatty
+import unittest
+import sys
+import json
+import datetime
+import StringIO
+
+class StreamTestCase(unittest.TestCase):
+
+	def setUp(self):
+		class Point(flatty.Schema):
+			x = int
+			y = float
+			label = unicode
+
+		class Track(flatty.Schema):
+			name = str
+			day = datetime.date
+			start = Point
+			points = flatty.TypedList.set_type(Point)
+			nums = flatty.TypedList.set_type(int)
+			tags = flatty.TypedDict.set_type(str)
+			named = flatty.TypedDict.set_type(Point)
+
+		self.Point = Point
+		self.Track = Track
+		self.track = Track(name='run', day=datetime.date(2012, 1, 13),
+						start=Point(x=0, y=0.5, label=u'start'),
+						points=[Point(x=i, y=i / 2.0, label=unicode(i))
+								for i in range(2500)],
+						nums=range(2500),
+						tags={'a':'b', 'c':'d'},
+						named={'end':Point(x=1, y=1.0)})
+
+	def loads(self, chunks):
+		return json.loads(''.join(chunks))
+
+	def expected(self, obj, **kwargs):
+		return json.loads(json.dumps(flatty.flatit(obj, **kwargs)))
+
+	def test_iter_flat(self):
+		chunks = list(flatty.iter_flat(self.track, chunk_size=4096))
+		self.assertTrue(len(chunks) > 10)
+		for chunk in chunks[:-1]:
+			self.assertTrue(4096 <= len(chunk) < 8192)
+		self.assertEqual(self.loads(chunks), self.expected(self.track))
+
+	def test_unset_and_none(self):
+		track = self.Track(name='empty', start=None, nums=[])
+		self.assertEqual(self.loads(flatty.iter_flat(track)), self.expected(track))
+		self.assertEqual(self.loads(flatty.iter_flat(None, obj_type=self.Track)),
+						None)
+
+	def test_options(self):
+		self.assertEqual(self.loads(flatty.iter_flat(self.track, compact=True)),
+						self.expected(self.track, compact=True))
+		for include, exclude in ((['name', 'points.x'], None),
+								(None, ['points', 'nums', 'start.label']),
+								(['tags'], None)):
+			self.assertEqual(self.loads(flatty.iter_flat(self.track, include=include,
+														exclude=exclude)),
+							self.expected(self.track, include=include,
+										exclude=exclude))
+			self.assertEqual(self.loads(flatty.iter_flat(self.track, compact=True,
+														include=include,
+														exclude=exclude)),
+							self.expected(self.track, compact=True,
+										include=include, exclude=exclude))
+
+	def test_versioned(self):
+		class Versioned(flatty.Schema):
+			__versioned__ = True
+			name = str
+
+		obj = Versioned(name='v')
+		self.assertEqual(self.loads(flatty.iter_flat(obj)), self.expected(obj))
+		self.assertEqual(self.loads(flatty.iter_flat(obj, exclude=['name'])),
+						self.expected(obj, exclude=['name']))
+
+	def test_dict_keys(self):
+		class Counts(flatty.Schema):
+			counts = flatty.TypedDict.set_type(int)
+			points = flatty.TypedDict.set_type(self.Point)
+
+		counts = Counts(counts={1:1, 2.5:2, 10L:3, False:4, None:5, u'x':6, 'y':7},
+						points={3:self.Point(x=3)})
+		self.assertEqual(self.loads(flatty.iter_flat(counts)), self.expected(counts))
+		counts.counts = {(1, 2):1}
+		self.assertRaises(TypeError, list, flatty.iter_flat(counts))
+
+	def test_converted_values(self):
+		#converters of single values see the options of the walk
+		class Wrapper(object):
+			def __init__(self, point):
+				self.point = point
+
+		Point = self.Point
+		class WrapperConverter(flatty.Converter):
+			@classmethod
+			def to_flat(cls, obj_type, obj):
+				return flatty.flatit(obj.point, Point)
+
+		class Shape(flatty.Schema):
+			corner = Wrapper
+			name = str
+
+		shape = Shape(corner=Wrapper(Point(x=1, y=2.0, label=u'a')), name='box')
+		flatty.ConvertManager.set_converter(Wrapper, WrapperConverter)
+		try:
+			for kwargs in ({}, {'compact':True}, {'include':['corner.x']},
+						{'exclude':['corner.label']}):
+				self.assertEqual(self.loads(flatty.iter_flat(shape, **kwargs)),
+								self.expected(shape, **kwargs))
+		finally:
+			flatty.ConvertManager.del_converter(Wrapper)
+
+	def test_dump(self):
+		out = StringIO.StringIO()
+		flatty.stream.dump(self.track, out, chunk_size=100)
+		self.assertEqual(json.loads(out.getvalue()), self.expected(self.track))
+
+	def test_errors(self):
+		self.track.points.append(1)
+		self.assertRaises(TypeError, list, flatty.iter_flat(self.track))
+		self.track.points.pop()
+		self.track.nums.append('x')
+		self.assertRaises(TypeError, list, flatty.iter_flat(self.track))
+
+		class Node(flatty.Schema):
+			name = str
+		Node.child = Node
+		node = Node(name='a')
+		node.child = node
+		self.assertRaises(flatty.CycleError, list, flatty.iter_flat(node))
+
+		#shared objects are written at every place
+		point = self.Point(x=1)
+		track = self.Track(start=point, points=[point, point])
+		self.assertEqual(self.loads(flatty.iter_flat(track)), self.expected(track))
+
+	def items(self, path, text, read_size=7):
+		return list(flatty.iter_unflat_items(self.Track, StringIO.StringIO(text), path,
+											read_size=read_size))
+
+	def test_iter_unflat_items(self):
+		text = ''.join(flatty.iter_flat(self.track))
+		for read_size in (1, 7, 65536):
+			points = self.items('points', text, read_size)
+			self.assertEqual(len(points), 2500)
+			self.assertTrue(isinstance(points[10], self.Point))
+			self.assertEqual([(p.x, p.y, p.label) for p in points],
+							[(p.x, p.y, p.label) for p in self.track.points])
+		self.assertEqual(self.items('nums', text), range(2500))
+		self.assertEqual(self.items('points', '{"points": []}'), [])
+		self.assertEqual(self.items('points', '{"points": null}'), [])
+		self.assertEqual(self.items('points', '{"name": "x"}'), [])
+		self.assertEqual(self.items('nums', '{"nums":[1,22,333]}'), [1, 22, 333])
+
+	def test_long_values(self):
+		class CountingFile(StringIO.StringIO):
+			reads = 0
+			def read(self, size=-1):
+				self.reads += 1
+				return StringIO.StringIO.read(self, size)
+
+		track = self.Track(name='x',
+						points=[self.Point(x=1, label=u'y' * 100000)])
+		fileobj = CountingFile(''.join(flatty.iter_flat(track)))
+		points = list(flatty.iter_unflat_items(self.Track, fileobj, 'points', read_size=7))
+		self.assertEqual(points[0].label, u'y' * 100000)
+		#the reads grow with the buffered text
+		self.assertTrue(fileobj.reads < 100)
+
+	def test_skipped_values(self):
+		#values before the list are skipped, also with tricky strings
+		text = json.dumps({'name':'a "}]\\', 'tags':{'x':'[{'},
+							'named':{'p':{'x':1, 'label':u'\u20ac"'}},
+							'start':None, 'nums':[1, 2]})
+		self.assertEqual(self.items('nums', text, 1), [1, 2])
+		self.assertEqual(self.items('nums', '{"nums": [1, 2], "name": ', 3), [1, 2])
+
+		class Outer(flatty.Schema):
+			tracks = flatty.TypedList.set_type(self.Track)
+			by_name = flatty.TypedDict.set_type(self.Track)
+
+		outer = Outer(tracks=[self.Track(nums=[1]), self.track],
+					by_name={'a':self.Track(nums=[5, 6])})
+		text = ''.join(flatty.iter_flat(outer))
+		items = lambda path: list(flatty.iter_unflat_items(Outer,
+										StringIO.StringIO(text), path, read_size=5))
+		self.assertEqual(items('tracks.0.nums'), [1])
+		self.assertEqual(len(items('tracks.1.points')), 2500)
+		self.assertEqual(items('tracks.2.nums'), [])
+		self.assertEqual(items('by_name.a.nums'), [5, 6])
+
+	def test_unflat_errors(self):
+		self.assertRaises(TypeError, self.items, 'name', '{}')
+		self.assertRaises(TypeError, self.items, 'unknown', '{}')
+		self.assertRaises(TypeError, self.items, 'points', '{"points": [1]}')
+		self.assertRaises(ValueError, self.items, 'nums', '{"nums": [1, 2')
+		self.assertRaises(ValueError, self.items, 'nums', '{"nums" 1}')
+		self.assertRaises(ValueError, self.items, 'nums', '{"name": "abc')
+
+
+def suite():
+	suite = unittest.TestSuite()
+	if len(sys.argv) > 1 and sys.argv[1][:2] == 't:':
+		suite.addTest(StreamTestCase(sys.argv[1][2:]))
+	else:
+		suite.addTest(unittest.makeSuite(StreamTestCase, 'test'))
+	return suite
+
+
+if __name__ == '__main__':
+	#call it with
+	#t:<my_testcase>
+	#to launch only <my_testcase> test
+	unittest.TextTestRunner(verbosity=1).run(suite())